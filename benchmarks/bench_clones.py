@@ -0,0 +1,73 @@
+'''
+Times copying a large outline with :class:`fiction_outlines_api.clones.OutlineCloner`, against copying its
+story tree one ``add_child`` call per node, and measures the memory the clone allocates at peak.
+
+Run from the repository root::
+
+    python benchmarks/bench_clones.py [--nodes 10000] [--batch-size 500]
+
+The outline is imported with the document of ``bench_imports.py``. The clone is run twice, once for the
+time and once with ``tracemalloc`` for the memory.
+'''
+import argparse
+import logging
+import time
+import tracemalloc
+
+from bench_imports import iter_document
+from bench_renderers import get_user_model
+from django.conf import settings
+from django.core.management import call_command
+from fiction_outlines.models import Outline, StoryElementNode
+from fiction_outlines_api.clones import OutlineCloner
+from fiction_outlines_api.imports import OutlineImporter
+
+
+def copy_story_tree(outline, user):
+    '''
+    Copies the story tree of ``outline`` into a new outline, the way a client calling the node endpoints would.
+    '''
+    copy = Outline.objects.create(title=outline.title, user=user)
+    copies = {}
+    for node in StoryElementNode.objects.filter(outline=outline).order_by('path'):
+        if node.is_root():
+            copies[node.path] = copy.story_tree_root
+            continue
+        parent = copies[node.path[:-node.steplen]]
+        copies[node.path] = parent.add_child(outline=copy, story_element_type=node.story_element_type,
+                                             name=node.name, description=node.description)
+    return copy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=10000, help='Approximate number of story nodes.')
+    parser.add_argument('--batch-size', type=int, default=500, help='Number of rows read and written at a time.')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    # The test settings log every query while DEBUG is on, which would count as memory used by the clone.
+    settings.DEBUG = False
+
+    call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create(username='benchmark')
+    outline = OutlineImporter(user).run(iter_document(args.nodes))
+    cloner = OutlineCloner(outline, batch_size=args.batch_size)
+    start = time.perf_counter()
+    cloner.run()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    OutlineCloner(outline, batch_size=args.batch_size).run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    copy_story_tree(outline, user)
+    naive_seconds = time.perf_counter() - start
+    print('%d story nodes, %d arc nodes' % (cloner.counts['storyelementnode'], cloner.counts['arcelementnode']))
+    print('clone          %8.2f s' % seconds)
+    print('add_child copy %8.2f s (story tree only)' % naive_seconds)
+    print('peak memory    %8.1f MiB' % (peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
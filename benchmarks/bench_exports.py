@@ -0,0 +1,55 @@
+'''
+Times exporting large outlines with :func:`fiction_outlines_api.exports.iter_outline_document`, and measures
+the memory it allocates at peak, which should not grow with the size of the outline.
+
+Run from the repository root::
+
+    python benchmarks/bench_exports.py [--nodes 10000] [--chunk-size 500]
+
+Outlines of a tenth of the nodes and of all of them are imported with the document of
+``bench_imports.py``, then exported twice each, once for the time and once with ``tracemalloc`` for the
+memory. The lines are counted and dropped as they are produced, like a streamed response would send them.
+'''
+import argparse
+import logging
+import time
+import tracemalloc
+
+from bench_imports import iter_document
+from bench_renderers import get_user_model
+from django.conf import settings
+from django.core.management import call_command
+from fiction_outlines_api.exports import iter_outline_document
+from fiction_outlines_api.imports import OutlineImporter
+
+
+def export(outline, chunk_size):
+    return sum(1 for line in iter_outline_document(outline, chunk_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=10000, help='Approximate number of story nodes.')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Number of rows read at a time.')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    # The test settings log every query while DEBUG is on, which would count as memory used by the export.
+    settings.DEBUG = False
+
+    call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create(username='benchmark')
+    for node_count in (args.nodes // 10, args.nodes):
+        outline = OutlineImporter(user).run(iter_document(node_count))
+        start = time.perf_counter()
+        lines = export(outline, args.chunk_size)
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        export(outline, args.chunk_size)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%6d lines  export %6.2f s  peak memory %6.1f MiB' % (lines, seconds, peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
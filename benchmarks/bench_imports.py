@@ -0,0 +1,94 @@
+'''
+Times importing a large outline document with :class:`fiction_outlines_api.imports.OutlineImporter`, and
+measures the memory it allocates at peak.
+
+Run from the repository root::
+
+    python benchmarks/bench_imports.py [--nodes 10000] [--batch-size 500]
+
+The document is generated line by line and never held in memory as a whole, like a file or a request body
+read line by line, so the peak only covers the importer itself. The import is run twice, once for the time
+and once with ``tracemalloc`` for the memory.
+'''
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+from bench_renderers import get_user_model
+from django.conf import settings
+from django.core.management import call_command
+from fiction_outlines_api.imports import OutlineImporter
+
+
+def iter_document(node_count):
+    '''
+    Yields the lines of an outline document of parts, chapters and scenes with about ``node_count`` story
+    nodes, a character associated to every scene and an arc node linked to every chapter.
+    '''
+    records = [
+        {'type': 'character', 'id': 'c', 'name': 'Benchmark character'},
+        {'type': 'outline', 'id': 'o', 'title': 'Benchmark'},
+        {'type': 'character_instance', 'id': 'ci', 'character': 'c'},
+        {'type': 'arc', 'id': 'a', 'name': 'Benchmark arc', 'mace_type': 'character'},
+        {'type': 'story_node', 'id': 'root', 'parent': None, 'story_element_type': 'root'},
+    ]
+    for record in records:
+        yield json.dumps(record)
+    chapters = []
+    created = part = 0
+    while created < node_count:
+        part += 1
+        yield json.dumps({'type': 'story_node', 'id': 'p%d' % part, 'parent': 'root', 'story_element_type': 'part',
+                          'name': 'Part', 'description': 'A part. ' * 20})
+        created += 1
+        for x in range(10):
+            chapter = 'p%dc%d' % (part, x)
+            chapters.append(chapter)
+            yield json.dumps({'type': 'story_node', 'id': chapter, 'parent': 'p%d' % part,
+                              'story_element_type': 'chapter', 'name': 'Chapter %d' % x,
+                              'description': 'A chapter. ' * 20})
+            created += 1
+            for y in range(10):
+                yield json.dumps({'type': 'story_node', 'id': '%ss%d' % (chapter, y), 'parent': chapter,
+                                  'story_element_type': 'ss', 'name': 'Scene %d' % y,
+                                  'description': 'A scene with “quotes” and ünïcode. ' * 20,
+                                  'assoc_characters': ['ci']})
+                created += 1
+    yield json.dumps({'type': 'arc_node', 'id': 'root', 'arc': 'a', 'parent': None, 'arc_element_type': 'root',
+                      'description': 'Root'})
+    yield json.dumps({'type': 'arc_node', 'id': 'tf', 'arc': 'a', 'parent': 'root', 'arc_element_type': 'tf',
+                      'description': 'Try/fail'})
+    for chapter in chapters:
+        yield json.dumps({'type': 'arc_node', 'id': chapter, 'arc': 'a', 'parent': 'tf', 'arc_element_type': 'beat',
+                          'description': 'Something happens in %s.' % chapter, 'story_element_node': chapter})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=10000, help='Approximate number of story nodes.')
+    parser.add_argument('--batch-size', type=int, default=500, help='Number of rows written per bulk insert.')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    # The test settings log every query while DEBUG is on, which would count as memory used by the import.
+    settings.DEBUG = False
+
+    call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create(username='benchmark')
+    importer = OutlineImporter(user, batch_size=args.batch_size)
+    start = time.perf_counter()
+    importer.run(iter_document(args.nodes))
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    OutlineImporter(user, batch_size=args.batch_size).run(iter_document(args.nodes))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%d story nodes, %d arc nodes' % (importer.counts['story_node'], importer.counts['arc_node']))
+    print('import      %8.2f s' % seconds)
+    print('peak memory %8.1f MiB' % (peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
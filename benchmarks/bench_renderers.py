@@ -0,0 +1,98 @@
+'''
+Compares the default JSON renderer and parser of rest framework with the ones from
+:mod:`fiction_outlines_api.renderers` and :mod:`fiction_outlines_api.parsers` on a large outline.
+
+Run from the repository root::
+
+    python benchmarks/bench_renderers.py [--nodes 5000] [--repeat 20]
+
+The outline is built in an in-memory database using the test settings, and serialized once with
+:class:`fiction_outlines_api.serializers.OutlineSerializer`, so only encoding and decoding are timed.
+'''
+import argparse
+import io
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from rest_framework.parsers import JSONParser  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from fiction_outlines.models import Outline, Character, CharacterInstance  # noqa: E402
+from fiction_outlines_api import renderers  # noqa: E402
+from fiction_outlines_api.parsers import FastJSONParser  # noqa: E402
+from fiction_outlines_api.renderers import FastJSONRenderer  # noqa: E402
+from fiction_outlines_api.serializers import OutlineSerializer  # noqa: E402
+
+
+def build_outline(node_count):
+    '''
+    Creates an outline of parts, chapters and scenes with about ``node_count`` nodes, with a character
+    associated to every scene.
+    '''
+    user = get_user_model().objects.create(username='benchmark')
+    outline = Outline.objects.create(title='Benchmark', user=user)
+    character = CharacterInstance.objects.create(
+        outline=outline, character=Character.objects.create(name='Benchmark character', user=user))
+    chapters_per_part = scenes_per_chapter = 10
+    created = 0
+    while created < node_count:
+        outline.story_tree_root.refresh_from_db()
+        part = outline.story_tree_root.add_child(story_element_type='part', name='Part', description='A part. ' * 20)
+        created += 1
+        for x in range(chapters_per_part):
+            part.refresh_from_db()
+            chapter = part.add_child(story_element_type='chapter', name='Chapter %d' % x,
+                                     description='A chapter. ' * 20)
+            created += 1
+            for y in range(scenes_per_chapter):
+                chapter.refresh_from_db()
+                scene = chapter.add_child(story_element_type='ss', name='Scene %d' % y,
+                                          description='A scene with “quotes” and ünïcode. ' * 20)
+                scene.assoc_characters.add(character)
+                created += 1
+    return outline
+
+
+def best_of(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=5000, help='Approximate number of story nodes.')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs, the best one is reported.')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    if renderers.orjson is None:
+        print('orjson is not installed, the fast renderer falls back to the default one.')
+
+    call_command('migrate', verbosity=0)
+    outline = build_outline(args.nodes)
+    data = OutlineSerializer(outline).data
+    body = JSONRenderer().render(data)
+    print('%d nodes, %.1f KiB of JSON' % (len(data['outline_structure']), len(body) / 1024))
+
+    results = [
+        ('render', 'JSONRenderer', best_of(lambda: JSONRenderer().render(data), args.repeat)),
+        ('render', 'FastJSONRenderer', best_of(lambda: FastJSONRenderer().render(data), args.repeat)),
+        ('parse', 'JSONParser', best_of(lambda: JSONParser().parse(io.BytesIO(body)), args.repeat)),
+        ('parse', 'FastJSONParser', best_of(lambda: FastJSONParser().parse(io.BytesIO(body)), args.repeat)),
+    ]
+    for operation, name, milliseconds in results:
+        print('%-7s %-17s %8.2f ms' % (operation, name, milliseconds))
+    print('render speedup: %.1fx' % (results[0][2] / results[1][2]))
+    print('parse speedup:  %.1fx' % (results[2][2] / results[3][2]))
+
+
+if __name__ == '__main__':
+    main()
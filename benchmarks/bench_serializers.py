@@ -0,0 +1,39 @@
+'''
+Compares serializing the nodes of a large outline with ``StoryElementNodeSerializer(many=True)`` and with the
+precompiled field plan of :class:`fiction_outlines_api.serializers.CompiledSerializer`.
+
+Run from the repository root::
+
+    python benchmarks/bench_serializers.py [--nodes 5000] [--repeat 20]
+'''
+import argparse
+import logging
+
+from bench_renderers import build_outline, best_of
+from django.core.management import call_command
+from fiction_outlines_api.serializers import CompiledSerializer, StoryElementNodeSerializer
+from fiction_outlines_api.trees import StoryTree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=5000, help='Approximate number of story nodes.')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs, the best one is reported.')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    call_command('migrate', verbosity=0)
+    tree = StoryTree(build_outline(args.nodes))
+    context = {'tree_aggregates': tree.aggregates}
+    print('%d nodes' % len(tree.nodes))
+
+    default = best_of(lambda: StoryElementNodeSerializer(tree.nodes, many=True, context=context).data, args.repeat)
+    compiled = best_of(lambda: CompiledSerializer(StoryElementNodeSerializer, context).to_representation_many(
+        tree.nodes), args.repeat)
+    print('%-26s %8.2f ms' % ('StoryElementNodeSerializer', default))
+    print('%-26s %8.2f ms' % ('CompiledSerializer', compiled))
+    print('speedup: %.1fx' % (default / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,3 +5,6 @@ from django.apps import AppConfig
 class FictionOutlinesApiConfig(AppConfig):
     name = 'fiction_outlines_api'
     verbose_name = 'Fiction Outlines API'
+
+    def ready(self):
+        from . import cache  # noqa: F401 Connects the structure cache receivers.
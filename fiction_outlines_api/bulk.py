@@ -0,0 +1,251 @@
+'''
+Bulk writes for the story and arc trees.
+
+Treebeard rewrites the paths of a tree one operation at a time: every move or insert shifts the following
+siblings with an ``UPDATE`` each, and re-reads parent and sibling state before the next operation. When many
+operations hit the same tree, :class:`TreeLayout` applies them to an in-memory copy of the shape of the tree
+instead, and :meth:`TreeLayout.save` writes every changed node once.
+
+Paths are allocated the way treebeard would: children keep their step when it still fits between their
+siblings, and otherwise take the next free one, so nodes that were not touched keep their paths.
+
+New nodes can be added to a layout too. They are inserted with ``bulk_create``, which skips the structural checks
+of ``add_child``/``add_sibling``, so :func:`check_story_placement` and :func:`check_arc_placement` apply the same
+rules against the layout.
+'''
+import logging
+from collections import deque
+from django.db import transaction
+from django.utils.translation import gettext as _
+from treebeard.exceptions import InvalidMoveToDescendant, InvalidPosition, PathOverflow
+from fiction_outlines.models import ArcGenerationError, ArcIntegrityError, IntegrityError
+from fiction_outlines.models import STORY_NODE_ELEMENT_DEFINITIONS
+
+logger = logging.getLogger('fiction-outlines-api')
+
+# Paths are unique, so rewritten paths are parked under a prefix that is not part of any treebeard alphabet.
+PARKING_PREFIX = '~'
+
+
+class TreeLayout(object):
+    '''
+    In-memory shape of one tree: the parent and the ordered children of every node.
+
+    Nodes keep their original ``path``, ``depth`` and ``numchild`` until :meth:`assign_paths` is called, but
+    ``get_parent()`` already answers from the layout, so that the ``tree_manipulation`` receivers of
+    ``fiction_outlines`` can validate each operation against the state left by the previous ones.
+
+    :param nodes:
+        Every node of the tree in path order, starting with the root.
+    '''
+
+    def __init__(self, nodes):
+        self.root = nodes[0]
+        self.model = self.root.__class__
+        self.steplen = self.model.steplen
+        self.max_step = len(self.model.alphabet) ** self.steplen - 1
+        self.nodes = {}
+        self.parents = {}
+        self.children = {}
+        self.original = {}
+        self.original_parents = {}
+        by_path = {}
+        for node in nodes:
+            parent = by_path.get(node.path[:-self.steplen])
+            by_path[node.path] = node
+            self.register(node, parent)
+            self.original[node.pk] = (node.path, node.depth, node.numchild)
+            self.original_parents[node.pk] = parent
+
+    @classmethod
+    def load(cls, node, queryset=None, fields=()):
+        '''
+        Loads the tree a node belongs to with a single query.
+
+        :param node:
+            Any node of the tree.
+        :param queryset:
+            The queryset to load the nodes from, defaults to all nodes of the model.
+        :param fields:
+            Columns to load besides the tree fields, e.g. the fields the ``tree_manipulation`` receivers read.
+            When empty, whole rows are loaded.
+        '''
+        if queryset is None:
+            queryset = node.__class__.objects.all()
+        if fields:
+            queryset = queryset.only('path', 'depth', 'numchild', *fields)
+        root_path = node.path[:node.steplen]
+        logger.debug('Loading the layout of the tree at %s' % root_path)
+        return cls(list(queryset.filter(path__startswith=root_path).order_by('path')))
+
+    def register(self, node, parent):
+        self.nodes[node.pk] = node
+        self.children[node.pk] = []
+        self.set_parent(node, parent)
+
+    def set_parent(self, node, parent):
+        self.parents[node.pk] = parent
+        if parent is not None:
+            self.children[parent.pk].append(node)
+            node._cached_parent_obj = parent
+
+    def get_parent(self, node):
+        return self.parents[node.pk]
+
+    def is_descendant(self, node, ancestor):
+        '''
+        Whether ``node`` is ``ancestor`` or lies below it.
+        '''
+        while node is not None:
+            if node is ancestor:
+                return True
+            node = self.parents[node.pk]
+        return False
+
+    def place(self, node, target, pos):
+        '''
+        Puts a node that has no parent in the layout at ``pos`` relative to ``target``.
+
+        :raises InvalidPosition: if the position is unknown or would make the node a root.
+        '''
+        if pos.endswith('child'):
+            parent = target
+        else:
+            parent = self.parents[target.pk]
+            if parent is None:
+                raise InvalidPosition(_('Nodes cannot be placed at the level of the root.'))
+        siblings = self.children[parent.pk]
+        if pos in ('first-child', 'first-sibling'):
+            index = 0
+        elif pos in ('last-child', 'last-sibling'):
+            index = len(siblings)
+        elif pos == 'left':
+            index = siblings.index(target)
+        elif pos == 'right':
+            index = siblings.index(target) + 1
+        else:
+            raise InvalidPosition(_('Not a valid position: %s') % pos)
+        self.set_parent(node, parent)
+        siblings.remove(node)
+        siblings.insert(index, node)
+
+    def move(self, node, target, pos):
+        '''
+        Moves a node and its descendants like ``node.move(target, pos)`` would.
+
+        :raises InvalidMoveToDescendant: if the target is the node itself or one of its descendants.
+        :raises InvalidPosition: if the position is unknown or would make the node a root.
+        '''
+        if self.is_descendant(target, node):
+            raise InvalidMoveToDescendant(_('Cannot move a node to one of its descendants or itself.'))
+        old_parent = self.parents[node.pk]
+        old_index = self.children[old_parent.pk].index(node)
+        self.children[old_parent.pk].pop(old_index)
+        try:
+            self.place(node, target, pos)
+        except InvalidPosition:
+            self.children[old_parent.pk].insert(old_index, node)
+            raise
+
+    def add(self, node, target, pos):
+        '''
+        Adds a new node to the layout at ``pos`` relative to ``target``. It is inserted by :meth:`save`.
+
+        :raises InvalidPosition: if the position is unknown or would make the node a root.
+        '''
+        self.register(node, None)
+        try:
+            self.place(node, target, pos)
+        except InvalidPosition:
+            del self.nodes[node.pk], self.children[node.pk], self.parents[node.pk]
+            raise
+
+    def assign_paths(self):
+        '''
+        Computes the ``path``, ``depth`` and ``numchild`` of every node from the layout.
+
+        :raises PathOverflow: if a node has more children than its path steps can number.
+
+        :returns: The nodes whose tree fields changed, in path order of the new layout.
+        '''
+        changed = []
+        queue = deque([self.root])
+        while queue:
+            parent = queue.popleft()
+            last = 0
+            children = self.children[parent.pk]
+            for child in children:
+                step = None
+                if self.original_parents.get(child.pk) is parent:
+                    step = self.model._str2int(self.original[child.pk][0][-self.steplen:])
+                if step is None or step <= last:
+                    step = last + 1
+                if step > self.max_step:
+                    raise PathOverflow(_('There is no room left under %s.') % parent.path)
+                last = step
+                child.path = self.model._get_path(parent.path, parent.depth + 1, step)
+                child.depth = parent.depth + 1
+                queue.append(child)
+            parent.numchild = len(children)
+            if self.original.get(parent.pk) != (parent.path, parent.depth, parent.numchild):
+                changed.append(parent)
+        changed.sort(key=lambda node: node.path)
+        return changed
+
+    def save(self):
+        '''
+        Writes the layout to the database in one transaction, with one bulk update per batch of changed nodes
+        and one bulk insert per batch of new nodes.
+
+        :returns: The nodes that were written.
+        '''
+        changed = self.assign_paths()
+        added = [node for node in changed if node.pk not in self.original]
+        updated = [node for node in changed if node.pk in self.original]
+        moved = [node for node in updated if node.path != self.original[node.pk][0]]
+        logger.debug('Saving %d changed nodes, %d of them with new paths, and %d new nodes' %
+                     (len(updated), len(moved), len(added)))
+        with transaction.atomic():
+            if moved:
+                new_paths = [node.path for node in moved]
+                for node in moved:
+                    node.path = PARKING_PREFIX + self.original[node.pk][0]
+                self.model.objects.bulk_update(moved, ['path'])
+                for node, path in zip(moved, new_paths):
+                    node.path = path
+            if updated:
+                self.model.objects.bulk_update(updated, ['path', 'depth', 'numchild'])
+            if added:
+                self.model.objects.bulk_create(added)
+        for node in changed:
+            self.original[node.pk] = (node.path, node.depth, node.numchild)
+            self.original_parents[node.pk] = self.parents[node.pk]
+        return changed
+
+
+def check_story_placement(layout, node):
+    '''
+    Story nodes may only be placed below the types listed in the ``allowed_parents`` of their own type.
+
+    :raises IntegrityError: if the parent of the node in the layout is not allowed.
+    '''
+    parent = layout.get_parent(node)
+    if parent.story_element_type not in STORY_NODE_ELEMENT_DEFINITIONS[node.story_element_type]['allowed_parents']:
+        raise IntegrityError(_('%s is not an allowed child of %s') % (node.story_element_type,
+                                                                      parent.story_element_type))
+
+
+def check_arc_placement(layout, node):
+    '''
+    Milestones cannot be children of other milestones, and every milestone appears at most once per arc.
+
+    :raises ArcGenerationError: if a milestone is placed below another milestone.
+    :raises ArcIntegrityError: if the layout already holds a milestone of the same type.
+    '''
+    if not node.is_milestone:
+        return
+    if layout.get_parent(node).is_milestone:
+        raise ArcGenerationError(_('You cannot have a milestone as a child to another milestone.'))
+    for other in layout.nodes.values():
+        if other is not node and other.arc_element_type == node.arc_element_type:
+            raise ArcIntegrityError(_('You cannot have two of the same milestone in the same arc.'))
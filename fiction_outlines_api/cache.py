@@ -0,0 +1,286 @@
+'''
+Versioned cache for serialized tree structures.
+
+Every outline has a revision token. The serialized ``outline_structure`` of an outline and the
+``arc_structure`` of its arcs are cached under keys that include that token, so changing anything in
+the outline only needs a new token: older entries can no longer be reached and simply age out of the cache.
+
+Tokens are random rather than incrementing counters, so an evicted revision can never come back with a
+value that matches stale entries.
+
+Caching is off unless it is configured with the following settings:
+
+- ``FICTION_OUTLINES_API_CACHE``: alias of a cache from ``CACHES`` to use. It must be shared by every process
+  serving the API, e.g. Redis or Memcached, since revisions are bumped by the process that handles a change.
+- ``FICTION_OUTLINES_API_CACHE_SIZE``: when no alias is set, a positive number opts into a bounded in-process
+  :class:`LRUCache` of that many entries. Other processes never see the revisions it bumps and would keep
+  serving stale structures, so it is only safe for deployments running a single process.
+- ``FICTION_OUTLINES_API_CACHE_TIMEOUT``: timeout for structure entries on a Django cache (defaults to the
+  cache's own timeout). Revision tokens never expire on their own.
+
+Revisions are bumped by the receivers at the bottom of this module, which are connected by
+:class:`fiction_outlines_api.apps.FictionOutlinesApiConfig`. Changes made with ``QuerySet.update()`` or
+raw SQL do not send signals and must be followed by a call to :func:`invalidate_outline`.
+
+The revision tokens also serve as ETags for conditional requests, which are only offered while caching is
+configured: a token kept by another process, or by nothing at all, cannot tell that an outline changed.
+'''
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+from functools import partial
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from fiction_outlines.models import Character, Location, Outline, Arc, CharacterInstance, LocationInstance
+from fiction_outlines.models import ArcElementNode, StoryElementNode
+from fiction_outlines.signals import tree_manipulation
+
+logger = logging.getLogger('fiction-outlines-api')
+
+KEY_PREFIX = 'fiction_outlines_api'
+
+
+class LRUCache(object):
+    '''
+    Bounded, thread safe, in-process cache implementing the parts of the Django cache API used here. Only
+    suitable for single-process deployments, see the module documentation.
+    Values are pickled, so callers never share mutable objects with the cache. Timeouts are ignored:
+    entries are only dropped when the cache is full, least recently used first.
+
+    :param maxsize:
+        Maximum number of entries.
+    '''
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return pickle.loads(self._data[key])
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.get(key, self)
+            if value is not self:
+                found[key] = value
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if self.maxsize <= 0:
+            return
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT):
+        with self._lock:
+            if key in self._data:
+                return False
+        self.set(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local_cache = None
+_disabled_cache = DummyCache(KEY_PREFIX, {})
+
+
+def get_cache():
+    '''
+    Returns the configured Django cache, the in-process cache if it was opted into, or a cache that stores
+    nothing.
+    '''
+    global _local_cache
+    alias = getattr(settings, 'FICTION_OUTLINES_API_CACHE', None)
+    if alias:
+        return caches[alias]
+    size = getattr(settings, 'FICTION_OUTLINES_API_CACHE_SIZE', 0)
+    if size <= 0:
+        return _disabled_cache
+    if _local_cache is None or _local_cache.maxsize != size:
+        _local_cache = LRUCache(size)
+    return _local_cache
+
+
+def revisions_tracked():
+    '''
+    Tells whether revision tokens are kept anywhere. Without a cache every lookup gets a new token, which
+    cannot tell whether an outline changed.
+    '''
+    return get_cache() is not _disabled_cache
+
+
+def revision_key(outline_id):
+    return '%s:revision:%s' % (KEY_PREFIX, outline_id)
+
+
+def get_revisions(outline_ids):
+    '''
+    Fetches the current revision token of several outlines at once, creating the missing ones.
+
+    :returns: A dict of outline id -> revision token.
+    '''
+    cache = get_cache()
+    keys = dict((outline_id, revision_key(outline_id)) for outline_id in outline_ids)
+    found = cache.get_many(keys.values())
+    revisions = {}
+    for outline_id, key in keys.items():
+        if key not in found:
+            token = uuid4().hex
+            cache.add(key, token, timeout=None)
+            # Another process may have won the race to create it. A disabled cache keeps nothing, so every
+            # lookup gets a token of its own and nothing cached under an older one can ever match.
+            found[key] = cache.get(key) or token
+        revisions[outline_id] = found[key]
+    return revisions
+
+
+def bump_revision(outline_id):
+    '''
+    Gives the outline a new revision token, which makes every structure cached for it unreachable.
+    '''
+    logger.debug('Bumping structure revision of outline %s' % outline_id)
+    get_cache().set(revision_key(outline_id), uuid4().hex, timeout=None)
+
+
+def invalidate_outline(outline_id):
+    '''
+    Invalidates the cached structures of an outline right away, and again once the current transaction
+    commits so that a structure cached by a concurrent reader in the meantime is not kept either.
+    '''
+    if outline_id is None:
+        return
+    bump_revision(outline_id)
+    transaction.on_commit(partial(bump_revision, outline_id))
+
+
+class StructureCache(object):
+    '''
+    Looks up the cached structures of several objects of one kind in a single cache round trip.
+
+    :param kind:
+        ``outline`` or ``arc``.
+    :param objects:
+        A dict of object pk -> id of the outline it belongs to.
+    :param tree_format:
+        The tree format the structures are serialized in.
+
+    :attribute hits:
+        A dict of object pk -> cached value for every object found in the cache.
+    '''
+
+    def __init__(self, kind, objects, tree_format=None):
+        self.cache = get_cache()
+        revisions = get_revisions(set(objects.values()))
+        self.keys = dict((pk, '%s:%s:%s:%s:%s' % (KEY_PREFIX, kind, pk, revisions[outline_id],
+                                                  tree_format or 'annotated'))
+                         for pk, outline_id in objects.items())
+        found = self.cache.get_many(self.keys.values())
+        self.hits = dict((pk, found[key]) for pk, key in self.keys.items() if key in found)
+        logger.debug('%d of %d %s structures found in cache' % (len(self.hits), len(self.keys), kind))
+
+    def set(self, pk, value):
+        '''
+        Caches the value for an object, under the revision that was current when it was looked up.
+        '''
+        self.cache.set(self.keys[pk], value,
+                       timeout=getattr(settings, 'FICTION_OUTLINES_API_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def arc_outline_id(arc_id):
+    return Arc.objects.filter(pk=arc_id).values_list('outline_id', flat=True).first()
+
+
+@receiver(tree_manipulation)
+def tree_manipulation_invalidation(sender, instance, **kwargs):
+    if isinstance(instance, StoryElementNode):
+        invalidate_outline(instance.outline_id)
+    else:
+        invalidate_outline(arc_outline_id(instance.arc_id))
+
+
+@receiver(post_save, sender=Outline)
+def outline_invalidation(sender, instance, **kwargs):
+    '''
+    The revision also stamps the outline's own fields for conditional requests, see
+    :class:`fiction_outlines_api.mixins.ConditionalRetrieveMixin`.
+    '''
+    invalidate_outline(instance.pk)
+
+
+@receiver(m2m_changed, sender=Outline.tags.through)
+def outline_tags_invalidation(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_outline(instance.pk)
+
+
+@receiver(post_save, sender=StoryElementNode)
+@receiver(post_delete, sender=StoryElementNode)
+@receiver(post_save, sender=CharacterInstance)
+@receiver(post_delete, sender=CharacterInstance)
+@receiver(post_save, sender=LocationInstance)
+@receiver(post_delete, sender=LocationInstance)
+@receiver(post_save, sender=Arc)
+@receiver(post_delete, sender=Arc)
+def outline_member_invalidation(sender, instance, **kwargs):
+    invalidate_outline(instance.outline_id)
+
+
+@receiver(post_save, sender=ArcElementNode)
+@receiver(post_delete, sender=ArcElementNode)
+def arc_node_invalidation(sender, instance, **kwargs):
+    invalidate_outline(arc_outline_id(instance.arc_id))
+
+
+@receiver(post_save, sender=Character)
+@receiver(post_save, sender=Location)
+def instance_name_invalidation(sender, instance, **kwargs):
+    '''
+    Nodes show the name of their characters and locations, so renaming one affects every outline it is in.
+    '''
+    instance_class = CharacterInstance if sender is Character else LocationInstance
+    filter_kwargs = {sender._meta.model_name: instance}
+    for outline_id in set(instance_class.objects.filter(**filter_kwargs).values_list('outline_id', flat=True)):
+        invalidate_outline(outline_id)
+
+
+@receiver(m2m_changed, sender=StoryElementNode.assoc_characters.through)
+@receiver(m2m_changed, sender=StoryElementNode.assoc_locations.through)
+@receiver(m2m_changed, sender=ArcElementNode.assoc_characters.through)
+@receiver(m2m_changed, sender=ArcElementNode.assoc_locations.through)
+def association_invalidation(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # The instance is a character or location instance, which only belongs to one outline.
+        invalidate_outline(instance.outline_id)
+    elif isinstance(instance, StoryElementNode):
+        invalidate_outline(instance.outline_id)
+    else:
+        invalidate_outline(arc_outline_id(instance.arc_id))
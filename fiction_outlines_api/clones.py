@@ -0,0 +1,152 @@
+'''
+Copies of whole outlines.
+
+A clone gets a copy of the outline, its tags, its character and location instances, its arcs, its story tree
+and the tree of every arc, with the characters and locations of every node. The characters, locations and
+series themselves are shared with the original rather than copied.
+
+Nodes are read in path order from chunked queryset iterators and written back with ``bulk_create``. Every
+copied object gets a new UUID, and the nodes of every tree get the path of the tree in the clone: only the
+first step of a path depends on the tree, so the copies keep the depth and number of children of the
+originals. The new ids of the nodes are kept until the end, to point arc nodes and relations to the copies.
+Everything is written in one transaction.
+
+Model signals are not sent, which also keeps the outline from getting a second story root.
+'''
+import logging
+import uuid
+from collections import OrderedDict
+from django.db import transaction
+from fiction_outlines.models import Outline, CharacterInstance, LocationInstance, Arc
+from fiction_outlines.models import ArcElementNode, StoryElementNode
+from .cache import invalidate_outline
+from .exceptions import TreeUnavailable
+from .streaming import DEFAULT_CHUNK_SIZE
+
+logger = logging.getLogger('fiction-outlines-api')
+
+
+class OutlineCloner(object):
+    '''
+    Copies an outline, see the module documentation.
+
+    :param outline:
+        The outline to copy.
+    :param batch_size:
+        The number of rows read and written at a time.
+    '''
+    # Fields that are set anew on every copy.
+    skipped_fields = ('id', 'created', 'modified')
+
+    def __init__(self, outline, batch_size=DEFAULT_CHUNK_SIZE):
+        self.outline = outline
+        self.batch_size = batch_size
+        # Original pk -> pk of the copy, per model.
+        self.ids = dict((model, {}) for model in (CharacterInstance, LocationInstance, Arc, StoryElementNode,
+                                                  ArcElementNode))
+        self.counts = OrderedDict((model._meta.model_name, 0) for model in self.ids)
+
+    def run(self, title=None):
+        '''
+        Copies the outline.
+
+        :param title:
+            The title of the copy. Defaults to the title of the original.
+
+        :raises TreeUnavailable: if a tree has no room left for another root.
+
+        :returns: The new outline.
+        '''
+        with transaction.atomic():
+            clone = self.copy_outline(title)
+            for model in (CharacterInstance, LocationInstance, Arc):
+                self.write(model, self.iter_copies(
+                    model, model._default_manager.filter(outline=self.outline).order_by('pk'), outline_id=clone.pk))
+            self.write(StoryElementNode, self.iter_node_copies(
+                StoryElementNode, StoryElementNode.objects.filter(outline=self.outline), outline_id=clone.pk))
+            self.write(ArcElementNode, self.iter_node_copies(
+                ArcElementNode, ArcElementNode.objects.filter(arc__outline=self.outline)))
+            for field_name in ('assoc_characters', 'assoc_locations'):
+                self.copy_relations(StoryElementNode, field_name, outline=self.outline)
+                self.copy_relations(ArcElementNode, field_name, arc__outline=self.outline)
+        invalidate_outline(clone.pk)
+        logger.debug('Cloned outline %s to %s: %s' % (self.outline.pk, clone.pk, dict(self.counts)))
+        return clone
+
+    def copy_outline(self, title):
+        clone = Outline(title=title or self.outline.title, description=self.outline.description,
+                        series_id=self.outline.series_id, user_id=self.outline.user_id)
+        Outline.objects.bulk_create([clone])
+        through = Outline.tags.through
+        through._default_manager.bulk_create(
+            [through(tag_id=tag_id, **through.lookup_kwargs(clone))
+             for tag_id in through._default_manager.filter(**through.lookup_kwargs(self.outline))
+             .values_list('tag_id', flat=True)])
+        return clone
+
+    def get_columns(self, model):
+        return [field.attname for field in model._meta.concrete_fields if field.name not in self.skipped_fields]
+
+    def iter_copies(self, model, queryset, **overrides):
+        '''
+        Yields a copy with a new pk of every row of ``queryset``, with the values of ``overrides`` and the
+        foreign keys to copied objects pointing to the copies.
+        '''
+        ids = self.ids[model]
+        remapped = [(field.attname, self.ids[field.related_model]) for field in model._meta.concrete_fields
+                    if field.is_relation and field.related_model in self.ids]
+        for row in queryset.values('id', *self.get_columns(model)).iterator(chunk_size=self.batch_size):
+            ids[row.pop('id')] = row['id'] = uuid.uuid4()
+            for attname, copies in remapped:
+                row[attname] = copies.get(row[attname])
+            row.update(overrides)
+            yield model(**row)
+
+    def iter_node_copies(self, model, queryset, **overrides):
+        '''
+        Yields copies of the nodes of one or more trees, each tree moved to a new root after the last one.
+        '''
+        prefixes = {}
+        last_root = model.get_root_nodes().values_list('path', flat=True).last()
+        step = model._str2int(last_root) if last_root else 0
+        max_step = len(model.alphabet) ** model.steplen - 1
+        for node in self.iter_copies(model, queryset.order_by('path'), **overrides):
+            prefix = node.path[:model.steplen]
+            if prefix not in prefixes:
+                step += 1
+                if step > max_step:  # pragma: no cover It would take a monumental amount of data to trigger this.
+                    raise TreeUnavailable
+                prefixes[prefix] = model._get_path('', 1, step)
+            node.path = prefixes[prefix] + node.path[model.steplen:]
+            yield node
+
+    def write(self, model, copies):
+        '''
+        Inserts the copies in batches.
+        '''
+        batch = []
+        for obj in copies:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                model._default_manager.bulk_create(batch)
+                batch = []
+        model._default_manager.bulk_create(batch)
+        if model in self.ids:
+            self.counts[model._meta.model_name] = len(self.ids[model])
+
+    def copy_relations(self, model, field_name, **filters):
+        '''
+        Copies the rows of a many-to-many relation of the copied nodes.
+
+        :param filters:
+            Lookups on the node model selecting the original nodes.
+        '''
+        field = model._meta.get_field(field_name)
+        through = field.remote_field.through
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        nodes, others = self.ids[model], self.ids[field.related_model]
+        rows = through._default_manager.filter(
+            **dict(('%s__%s' % (source, key), value) for key, value in filters.items())
+        ).values_list(source + '_id', target + '_id')
+        self.write(through, (through(**{source + '_id': nodes[node], target + '_id': others[other]})
+                             for node, other in rows.iterator(chunk_size=self.batch_size)))
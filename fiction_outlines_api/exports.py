@@ -0,0 +1,133 @@
+'''
+Streaming export of whole outlines.
+
+An outline is exported as a document in the format of :mod:`fiction_outlines_api.imports`, so that it can be
+imported again: the series, characters and locations it uses, the outline, its character and location
+instances, the nodes of its story tree in tree order, its arcs and then the nodes of every arc in tree order.
+Records use the primary keys of the exported objects as their ids.
+
+Series, characters and locations are loaded up front with their tags, since there are only a few of them per
+outline. The nodes, which make up the bulk of an outline, are pulled from chunked queryset iterators in path
+order and written a chunk at a time, after the instances associated to the nodes of the chunk are read from
+the relation tables by node id. Only one chunk and the ancestors of the current node are kept, so memory
+stays flat however large the outline is, and the associations stay correct even if nodes are moved while the
+export runs.
+'''
+import logging
+from collections import OrderedDict
+from fiction_outlines.models import Series, Character, Location, CharacterInstance, LocationInstance
+from fiction_outlines.models import Arc, ArcElementNode, StoryElementNode
+from .imports import OutlineImporter
+from .streaming import DEFAULT_CHUNK_SIZE, encode
+
+logger = logging.getLogger('fiction-outlines-api')
+
+
+def make_record(record_type, pk, values, **extra):
+    '''
+    Renders one line of a document, taking the fields that the importer reads for ``record_type`` from
+    ``values``, a dict or a model instance.
+    '''
+    record = OrderedDict((('type', record_type), ('id', str(pk))))
+    for name in OutlineImporter.fields[record_type]:
+        record[name] = values[name] if isinstance(values, dict) else getattr(values, name)
+    record.update(extra)
+    return encode(record) + '\n'
+
+
+def tag_names(obj):
+    return sorted(tag.name for tag in obj.tags.all())
+
+
+def reference(pk):
+    return None if pk is None else str(pk)
+
+
+def iter_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_relations(model, field_name, pks):
+    '''
+    Reads the instances associated to a chunk of nodes from a many-to-many relation table.
+
+    :returns: A dict of node pk -> list of instance ids.
+    '''
+    field = model._meta.get_field(field_name)
+    source, target = field.m2m_field_name() + '_id', field.m2m_reverse_field_name() + '_id'
+    relations = dict((pk, []) for pk in pks)
+    rows = field.remote_field.through._default_manager.filter(**{source + '__in': pks}).order_by(target)
+    for pk, other in rows.values_list(source, target):
+        relations[pk].append(str(other))
+    return relations
+
+
+def iter_node_records(model, record_type, chunk_size=DEFAULT_CHUNK_SIZE, extra_fields=(), **filters):
+    '''
+    Renders the nodes of one or more trees in path order, naming the parent and the associated instances of
+    every node.
+
+    :param extra_fields:
+        Pairs of a record field and the column it is read from.
+    '''
+    columns = ('id', 'depth') + OutlineImporter.fields[record_type] + tuple(column for name, column in extra_fields)
+    ancestors = []
+    rows = model._default_manager.filter(**filters).order_by('path').values(*columns)
+    for chunk in iter_chunks(rows.iterator(chunk_size=chunk_size), chunk_size):
+        pks = [row['id'] for row in chunk]
+        characters = get_relations(model, 'assoc_characters', pks)
+        locations = get_relations(model, 'assoc_locations', pks)
+        for row in chunk:
+            while ancestors and ancestors[-1][0] >= row['depth']:
+                ancestors.pop()
+            extra = OrderedDict((name, reference(row[column])) for name, column in extra_fields)
+            extra['parent'] = str(ancestors[-1][1]) if ancestors else None
+            extra['assoc_characters'] = characters[row['id']]
+            extra['assoc_locations'] = locations[row['id']]
+            ancestors.append((row['depth'], row['id']))
+            yield make_record(record_type, row['id'], row, **extra)
+
+
+def iter_outline_document(outline, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Renders an outline and everything it uses as the lines of an import document.
+
+    :param chunk_size:
+        The number of rows pulled from the database at a time.
+    '''
+    logger.debug('Exporting outline %s' % outline.pk)
+    character_instances = list(CharacterInstance.objects.filter(outline=outline)
+                               .order_by('character__name', 'pk'))
+    location_instances = list(LocationInstance.objects.filter(outline=outline)
+                              .order_by('location__name', 'pk'))
+    characters = list(Character.objects.filter(pk__in=[instance.character_id for instance in character_instances])
+                      .order_by('name', 'pk').prefetch_related('tags', 'series'))
+    locations = list(Location.objects.filter(pk__in=[instance.location_id for instance in location_instances])
+                     .order_by('name', 'pk').prefetch_related('tags', 'series'))
+    series_ids = set(series.pk for obj in characters + locations for series in obj.series.all())
+    if outline.series_id is not None:
+        series_ids.add(outline.series_id)
+    for series in Series.objects.filter(pk__in=series_ids).order_by('title', 'pk').prefetch_related('tags'):
+        yield make_record('series', series.pk, series, tags=tag_names(series))
+    for record_type, objects in (('character', characters), ('location', locations)):
+        for obj in objects:
+            yield make_record(record_type, obj.pk, obj, tags=tag_names(obj),
+                              series=[str(series.pk) for series in obj.series.all()])
+    yield make_record('outline', outline.pk, outline, tags=tag_names(outline), series=reference(outline.series_id))
+    for instance in character_instances:
+        yield make_record('character_instance', instance.pk, instance, character=str(instance.character_id))
+    for instance in location_instances:
+        yield make_record('location_instance', instance.pk, instance, location=str(instance.location_id))
+    yield from iter_node_records(StoryElementNode, 'story_node', chunk_size, outline=outline)
+    for arc in Arc.objects.filter(outline=outline).order_by('name', 'pk'):
+        yield make_record('arc', arc.pk, arc)
+    yield from iter_node_records(ArcElementNode, 'arc_node', chunk_size,
+                                 (('arc', 'arc_id'), ('story_element_node', 'story_element_node_id')),
+                                 arc__outline=outline)
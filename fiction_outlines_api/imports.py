@@ -0,0 +1,405 @@
+'''
+Bulk import of whole outlines.
+
+An import document is newline-delimited JSON: every line holds one record, an object with a ``type`` and an
+``id``. Blank lines are skipped. Ids only need to be unique among the records of a type, since every imported
+object gets a new UUID. Records refer to each other by these ids, and can only refer to records that appear
+before them.
+
+======================  ==========================================================================
+type                    fields
+======================  ==========================================================================
+``series``              ``title``, ``description``, ``tags``
+``character``           ``name``, ``description``, ``tags``, ``series`` (list of series ids)
+``location``            ``name``, ``description``, ``tags``, ``series`` (list of series ids)
+``outline``             ``title``, ``description``, ``tags``, ``series`` (series id or ``null``)
+``character_instance``  ``character``, ``main_character``, ``pov_character``, ``protagonist``,
+                        ``antagonist``, ``obstacle``, ``villain``
+``location_instance``   ``location``
+``arc``                 ``name``, ``mace_type``
+``story_node``          ``parent``, ``story_element_type``, ``name``, ``description``,
+                        ``assoc_characters``, ``assoc_locations`` (lists of instance ids)
+``arc_node``            ``arc``, ``parent``, ``arc_element_type``, ``description``, ``story_element_node``,
+                        ``assoc_characters``, ``assoc_locations``
+======================  ==========================================================================
+
+A document holds exactly one outline, which must come before its instances, arcs and nodes. Nodes come after
+their parent, and children are ordered as they appear. ``parent`` is ``null`` for the root of the story tree
+and for the root of every arc, which have the type ``root``. Fields that are left out take their model
+defaults, and fields that are not listed above are ignored.
+
+The document is read one line at a time. Paths are allocated as the nodes arrive, and rows are written with
+``bulk_create`` in batches, so only a few values per node (its new id, path and number of children) are kept
+until the end. Everything is written in one transaction.
+
+Model signals are not sent, so the structural rules of the trees are checked here instead, arc node headlines
+are generated, and story nodes get the characters and locations of the arc nodes linked to them, as the
+receivers of ``fiction_outlines`` would do.
+'''
+import json
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.utils.translation import gettext as _
+from fiction_outlines.models import Series, Character, Location, Outline, CharacterInstance, LocationInstance
+from fiction_outlines.models import Arc, ArcElementNode, StoryElementNode, STORY_NODE_ELEMENT_DEFINITIONS
+from fiction_outlines.receivers import generate_headline_from_description
+from .cache import invalidate_outline
+from .streaming import DEFAULT_CHUNK_SIZE
+from .tags import get_or_create_tags
+
+logger = logging.getLogger('fiction-outlines-api')
+
+
+class OutlineImportError(Exception):
+    '''
+    Raised for an invalid import document.
+
+    :attribute line:
+        The number of the offending line, or ``None`` if the document is incomplete.
+    '''
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+
+    def __str__(self):
+        if self.line is None:
+            return self.message
+        return _('Line %(line)d: %(message)s') % {'line': self.line, 'message': self.message}
+
+
+class OutlineImporter(object):
+    '''
+    Imports one outline document for a user, see the module documentation for the format.
+
+    :param user:
+        The owner of every imported object.
+    :param batch_size:
+        The number of rows buffered before they are written.
+    '''
+    fields = OrderedDict((
+        ('series', ('title', 'description')),
+        ('character', ('name', 'description')),
+        ('location', ('name', 'description')),
+        ('outline', ('title', 'description')),
+        ('character_instance', ('main_character', 'pov_character', 'protagonist', 'antagonist', 'obstacle',
+                                'villain')),
+        ('location_instance', ()),
+        ('arc', ('name', 'mace_type')),
+        ('story_node', ('story_element_type', 'name', 'description')),
+        ('arc_node', ('arc_element_type', 'description')),
+    ))
+    # Rows are written in this order, so that foreign keys only point to rows that were written before.
+    # The through models of many-to-many relations follow.
+    write_order = (Series, Character, Location, Outline, CharacterInstance, LocationInstance, Arc,
+                   StoryElementNode, ArcElementNode)
+
+    def __init__(self, user, batch_size=DEFAULT_CHUNK_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.line = None
+        self.outline = None
+        self.ids = dict((record_type, {}) for record_type in self.fields)
+        self.counts = OrderedDict((record_type, 0) for record_type in self.fields)
+        # Document id -> [pk, path, numchild, type] for story nodes, plus the arc document id for arc nodes.
+        self.nodes = {'story_node': {}, 'arc_node': {}}
+        self.story_root = None
+        self.arc_roots = {}
+        self.milestones = {}
+        self.instanced = {'character_instance': set(), 'location_instance': set()}
+        self.last_root_steps = {}
+        self.pending = OrderedDict((model, []) for model in self.write_order)
+        self.pending_count = 0
+        self.tags = OrderedDict()
+
+    def error(self, message):
+        return OutlineImportError(message, self.line)
+
+    def run(self, lines):
+        '''
+        Imports a document.
+
+        :param lines:
+            An iterable of the lines of the document, as text or bytes.
+
+        :raises OutlineImportError: if the document is invalid. Nothing is written in that case.
+
+        :returns: The new outline.
+        '''
+        with transaction.atomic():
+            for self.line, raw in enumerate(lines, 1):
+                if raw.strip():
+                    self.import_record(self.parse(raw))
+            self.line = None
+            self.finish()
+        logger.debug('Imported outline %s: %s' % (self.outline.pk, dict(self.counts)))
+        return self.outline
+
+    def parse(self, raw):
+        try:
+            record = json.loads(raw)
+        except ValueError as VE:
+            raise self.error(_('Invalid JSON: %s') % VE)
+        if not isinstance(record, dict):
+            raise self.error(_('Every line must hold a JSON object.'))
+        if record.get('type') not in self.fields:
+            raise self.error(_('Unknown record type: %s') % record.get('type'))
+        return record
+
+    def import_record(self, record):
+        record_type = record['type']
+        if 'id' not in record:
+            raise self.error(_('Every record needs an id.'))
+        record_id = str(record['id'])
+        if record_id in self.ids[record_type]:
+            raise self.error(_('Duplicate %(type)s id: %(id)s') % {'type': record_type, 'id': record_id})
+        if record_type not in ('series', 'character', 'location', 'outline') and self.outline is None:
+            raise self.error(_('The outline must come before its %s records.') % record_type)
+        obj = getattr(self, 'import_%s' % record_type)(record_id, record)
+        self.ids[record_type][record_id] = obj.pk
+        self.counts[record_type] += 1
+        self.add_row(obj)
+
+    def build(self, model, record, **kwargs):
+        '''
+        Instantiates an object from the fields of a record and validates them.
+        '''
+        names = self.fields[record['type']]
+        for name in names:
+            if name in record:
+                kwargs[name] = record[name]
+        obj = model(**kwargs)
+        try:
+            obj.clean_fields(exclude=[field.name for field in model._meta.fields if field.name not in names])
+        except ValidationError as VE:
+            raise self.error('; '.join('%s: %s' % (name, ' '.join(messages))
+                                       for name, messages in VE.message_dict.items()))
+        return obj
+
+    def get_reference(self, record_type, record, key, required=False):
+        '''
+        Returns the new primary key of the record a field refers to.
+        '''
+        value = record.get(key)
+        if value is None:
+            if required:
+                raise self.error(_('The field %s is required.') % key)
+            return None
+        try:
+            return self.ids[record_type][str(value)]
+        except KeyError:
+            raise self.error(_('Unknown %(type)s: %(id)s') % {'type': record_type, 'id': value})
+
+    def get_references(self, record_type, record, key):
+        values = record.get(key) or []
+        if not isinstance(values, list):
+            raise self.error(_('The field %s must be a list.') % key)
+        return [self.get_reference(record_type, {key: value}, key) for value in values]
+
+    def get_parent(self, record_type, record):
+        value = record.get('parent')
+        if value is None:
+            return None
+        try:
+            return self.nodes[record_type][str(value)]
+        except KeyError:
+            raise self.error(_('Unknown parent: %s') % value)
+
+    def add_tags(self, model, obj, record):
+        names = record.get('tags') or []
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise self.error(_('The field tags must be a list of names.'))
+        if names:
+            self.tags.setdefault(model.tags.through, []).append((model, obj.pk, set(names)))
+
+    def add_relations(self, model, field_name, pk, others):
+        '''
+        Buffers the rows of a many-to-many relation from ``pk`` to every primary key in ``others``.
+        '''
+        field = model._meta.get_field(field_name)
+        through = field.remote_field.through
+        source, target = field.m2m_field_name() + '_id', field.m2m_reverse_field_name() + '_id'
+        for other in others:
+            self.add_row(through(**{source: pk, target: other}))
+
+    def add_row(self, obj):
+        self.pending.setdefault(obj.__class__, []).append(obj)
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the buffered rows. Relations are written ignoring conflicts, since story nodes can get the same
+        instance from themselves and from several arc nodes.
+        '''
+        for model, rows in self.pending.items():
+            if rows:
+                model._default_manager.bulk_create(rows, batch_size=self.batch_size,
+                                                   ignore_conflicts=model not in self.write_order)
+                del rows[:]
+        self.pending_count = 0
+
+    def allocate_path(self, model, parent):
+        '''
+        Returns the path of a new last child of ``parent``, or of a new last root node if it is ``None``.
+        '''
+        max_step = len(model.alphabet) ** model.steplen - 1
+        if parent is None:
+            if model not in self.last_root_steps:
+                path = model.get_root_nodes().values_list('path', flat=True).last()
+                self.last_root_steps[model] = model._str2int(path) if path else 0
+            self.last_root_steps[model] += 1
+            step, parent_path = self.last_root_steps[model], ''
+        else:
+            parent[2] += 1
+            step, parent_path = parent[2], parent[1]
+        if step > max_step:  # pragma: no cover It would take a monumental amount of data to trigger this.
+            raise self.error(_('There is no room left for another node.'))
+        path = model._get_path(parent_path, len(parent_path) // model.steplen + 1, step)
+        if len(path) > model._meta.get_field('path').max_length:
+            raise self.error(_('The tree is too deep.'))
+        return path
+
+    def import_series(self, record_id, record):
+        series = self.build(Series, record, user=self.user)
+        self.add_tags(Series, series, record)
+        return series
+
+    def import_character(self, record_id, record):
+        character = self.build(Character, record, user=self.user)
+        self.add_tags(Character, character, record)
+        self.add_relations(Character, 'series', character.pk, self.get_references('series', record, 'series'))
+        return character
+
+    def import_location(self, record_id, record):
+        location = self.build(Location, record, user=self.user)
+        self.add_tags(Location, location, record)
+        self.add_relations(Location, 'series', location.pk, self.get_references('series', record, 'series'))
+        return location
+
+    def import_outline(self, record_id, record):
+        if self.outline is not None:
+            raise self.error(_('A document can only hold one outline.'))
+        self.outline = self.build(Outline, record, user=self.user,
+                                  series_id=self.get_reference('series', record, 'series'))
+        self.add_tags(Outline, self.outline, record)
+        return self.outline
+
+    def import_instance(self, model, record_type, related_type, record):
+        related = self.get_reference(related_type, record, related_type, required=True)
+        if related in self.instanced[record_type]:
+            raise self.error(_('The %s already has an instance in this outline.') % related_type)
+        self.instanced[record_type].add(related)
+        return self.build(model, record, outline_id=self.outline.pk, **{related_type + '_id': related})
+
+    def import_character_instance(self, record_id, record):
+        return self.import_instance(CharacterInstance, 'character_instance', 'character', record)
+
+    def import_location_instance(self, record_id, record):
+        return self.import_instance(LocationInstance, 'location_instance', 'location', record)
+
+    def import_arc(self, record_id, record):
+        self.arc_roots[record_id] = False
+        self.milestones[record_id] = set()
+        return self.build(Arc, record, outline_id=self.outline.pk)
+
+    def import_story_node(self, record_id, record):
+        node = self.build(StoryElementNode, record, outline_id=self.outline.pk)
+        parent = self.get_parent('story_node', record)
+        if parent is None:
+            if self.story_root is not None:
+                raise self.error(_('The story tree can only have one root.'))
+            if node.story_element_type != 'root':
+                raise self.error(_('The root of the story tree must have the type root.'))
+            self.story_root = record_id
+        elif parent[3] not in STORY_NODE_ELEMENT_DEFINITIONS[node.story_element_type]['allowed_parents']:
+            raise self.error(_('%s is not an allowed child of %s') % (node.story_element_type, parent[3]))
+        node.path = self.allocate_path(StoryElementNode, parent)
+        node.depth = len(node.path) // node.steplen
+        self.nodes['story_node'][record_id] = [node.pk, node.path, 0, node.story_element_type]
+        self.add_relations(StoryElementNode, 'assoc_characters', node.pk,
+                           self.get_references('character_instance', record, 'assoc_characters'))
+        self.add_relations(StoryElementNode, 'assoc_locations', node.pk,
+                           self.get_references('location_instance', record, 'assoc_locations'))
+        return node
+
+    def import_arc_node(self, record_id, record):
+        arc_id = str(record.get('arc'))
+        node = self.build(ArcElementNode, record, arc_id=self.get_reference('arc', record, 'arc', required=True))
+        parent = self.get_parent('arc_node', record)
+        if parent is None:
+            if self.arc_roots[arc_id]:
+                raise self.error(_('An arc can only have one root.'))
+            if node.arc_element_type != 'root':
+                raise self.error(_('The root of an arc must have the type root.'))
+            self.arc_roots[arc_id] = True
+        elif parent[4] != arc_id:
+            raise self.error(_('The parent of an arc node must belong to the same arc.'))
+        elif node.arc_element_type == 'root':
+            raise self.error(_('Only the root of an arc can have the type root.'))
+        elif node.is_milestone:
+            if 'mile' in parent[3]:
+                raise self.error(_('You cannot have a milestone as a child to another milestone.'))
+            if node.arc_element_type in self.milestones[arc_id]:
+                raise self.error(_('You cannot have two of the same milestone in the same arc.'))
+            self.milestones[arc_id].add(node.arc_element_type)
+        node.path = self.allocate_path(ArcElementNode, parent)
+        node.depth = len(node.path) // node.steplen
+        generate_headline_from_description(sender=ArcElementNode, instance=node)
+        self.nodes['arc_node'][record_id] = [node.pk, node.path, 0, node.arc_element_type, arc_id]
+        characters = self.get_references('character_instance', record, 'assoc_characters')
+        locations = self.get_references('location_instance', record, 'assoc_locations')
+        self.add_relations(ArcElementNode, 'assoc_characters', node.pk, characters)
+        self.add_relations(ArcElementNode, 'assoc_locations', node.pk, locations)
+        story_value = record.get('story_element_node')
+        if story_value is not None:
+            if str(story_value) not in self.nodes['story_node']:
+                raise self.error(_('Unknown story_node: %s') % story_value)
+            node.story_element_node_id = self.nodes['story_node'][str(story_value)][0]
+            self.add_relations(StoryElementNode, 'assoc_characters', node.story_element_node_id, characters)
+            self.add_relations(StoryElementNode, 'assoc_locations', node.story_element_node_id, locations)
+        return node
+
+    def finish(self):
+        '''
+        Checks that the document is complete, writes the remaining rows, the number of children of every node
+        and the tags.
+        '''
+        if self.outline is None:
+            raise self.error(_('The document does not hold an outline.'))
+        if self.story_root is None:
+            raise self.error(_('The story tree of the outline has no root.'))
+        for arc_id, has_root in self.arc_roots.items():
+            if not has_root:
+                raise self.error(_('The arc %s has no root.') % arc_id)
+        self.flush()
+        for model, nodes in ((StoryElementNode, self.nodes['story_node']), (ArcElementNode, self.nodes['arc_node'])):
+            parents = [model(pk=info[0], numchild=info[2]) for info in nodes.values() if info[2]]
+            model._default_manager.bulk_update(parents, ['numchild'], batch_size=self.batch_size)
+        for through, items in self.tags.items():
+            self.write_tags(through, items)
+        invalidate_outline(self.outline.pk)
+
+    def write_tags(self, through, items):
+        '''
+        Tags every object of ``items``, a list of ``(model, pk, names)``, with one bulk insert.
+
+        With ``TAGGIT_CASE_INSENSITIVE`` the names have to be matched one by one, so this falls back to
+        ``TaggableManager.set``.
+        '''
+        if getattr(settings, 'TAGGIT_CASE_INSENSITIVE', False):
+            for model, pk, names in items:
+                model(pk=pk).tags.set(names)
+            return
+        using = router.db_for_write(through)
+        tags = get_or_create_tags(through.tag_model(), set(name for model, pk, names in items for name in names),
+                                  using)
+        tags = dict((tag.name, tag) for tag in tags)
+        through._default_manager.using(using).bulk_create(
+            [through(tag=tags[name], **through.lookup_kwargs(model(pk=pk))) for model, pk, names in items
+             for name in names], batch_size=self.batch_size)
@@ -0,0 +1,33 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from fiction_outlines.models import Outline
+from fiction_outlines_api.exports import iter_outline_document
+from fiction_outlines_api.streaming import DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    '''
+    Exports an outline as a document that :mod:`fiction_outlines_api.imports` can read back, see
+    :mod:`fiction_outlines_api.exports`.
+    '''
+    help = 'Exports an outline as a newline-delimited JSON document.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('outline', help='The id of the outline.')
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Path of the document, or - to write it to standard output (the default).')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Number of rows read from the database at a time.')
+
+    def handle(self, outline, path, chunk_size, **options):
+        try:
+            outline = Outline.objects.get(pk=outline)
+        except (Outline.DoesNotExist, ValidationError):
+            raise CommandError('There is no outline with the id %s.' % outline)
+        lines = iter_outline_document(outline, chunk_size)
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.writelines(lines)
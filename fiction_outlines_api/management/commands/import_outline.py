@@ -0,0 +1,36 @@
+import sys
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from fiction_outlines_api.imports import OutlineImporter, OutlineImportError
+from fiction_outlines_api.streaming import DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    '''
+    Imports an outline document for a user, see :mod:`fiction_outlines_api.imports` for the format.
+    '''
+    help = 'Imports an outline from a newline-delimited JSON document.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='The user that will own the imported outline.')
+        parser.add_argument('path', help='Path of the document, or - to read it from standard input.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Number of rows written per bulk insert.')
+
+    def handle(self, username, path, batch_size, **options):
+        user_model = get_user_model()
+        try:
+            user = user_model._default_manager.get_by_natural_key(username)
+        except user_model.DoesNotExist:
+            raise CommandError('There is no user named %s.' % username)
+        importer = OutlineImporter(user, batch_size=batch_size)
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            outline = importer.run(stream)
+        except OutlineImportError as OIE:
+            raise CommandError(str(OIE))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        counts = ', '.join('%d %s' % (count, record_type) for record_type, count in importer.counts.items())
+        self.stdout.write('Imported outline %s (%s): %s' % (outline.title, outline.pk, counts))
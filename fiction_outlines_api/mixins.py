@@ -1,22 +1,303 @@
+import hashlib
 import logging
-from django.db import transaction
+from collections import OrderedDict
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models.signals import pre_save
+from django.utils.http import parse_etags, quote_etag
+from django.utils.translation import get_language
 from django.utils.translation import gettext_lazy as _
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from treebeard.exceptions import InvalidPosition, InvalidMoveToDescendant, PathOverflow
-from rest_framework.generics import get_object_or_404
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from rest_framework import response, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.mediatypes import _MediaType
+from rest_framework_rules.mixins import PermissionRequiredMixin
 from fiction_outlines.signals import tree_manipulation
 from fiction_outlines.models import IntegrityError
+from .bulk import TreeLayout
 from .exceptions import TreeUnavailable
+from .cache import get_revisions, invalidate_outline, revisions_tracked
+from .permissions import get_permission_cache
+from .streaming import DEFAULT_CHUNK_SIZE
 from fiction_outlines.models import ArcGenerationError
 
 
 POSITIONS = ('first-child', 'last-child', 'first-sibling', 'last-sibling', 'left', 'right')
 
+TREE_FORMATS = ('annotated', 'nested')
+
 logger = logging.getLogger('fiction-outlines-api')
 
 
+class TreeFormatMixin(object):
+    '''
+    API Mixin that lets the client choose how tree structures are represented, either with a query parameter
+    (``?tree=nested``) or with a media type parameter (``Accept: application/json; tree=nested``).
+
+    - ``annotated``: the default treebeard annotated list of ``[node, info]`` pairs.
+    - ``nested``: a list of top level nodes, each with its descendants under ``children``.
+
+    The chosen format is passed to the serializer as ``tree_format`` in its context.
+    '''
+    tree_format_query_param = 'tree'
+    default_tree_format = 'annotated'
+
+    def get_tree_format(self):
+        '''
+        Reads the requested tree format, the query parameter taking precedence over the media type.
+
+        :raises ValidationError: if the format is not one of ``TREE_FORMATS``.
+        '''
+        tree_format = self.request.query_params.get(self.tree_format_query_param)
+        if tree_format is None and getattr(self.request, 'accepted_media_type', None):
+            tree_format = _MediaType(self.request.accepted_media_type).params.get(self.tree_format_query_param)
+            if isinstance(tree_format, bytes):
+                tree_format = tree_format.decode('ascii')
+        tree_format = tree_format or self.default_tree_format
+        if tree_format not in TREE_FORMATS:
+            raise ValidationError({self.tree_format_query_param: _('Unknown tree format: %s') % tree_format})
+        return tree_format
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['tree_format'] = self.get_tree_format()
+        return context
+
+
+class SparseFieldsetsMixin(object):
+    '''
+    API Mixin that reads comma separated field names from ``?fields=`` and ``?omit=`` on GET requests and
+    passes them to the serializer context as ``fields`` and ``omit``, see
+    :class:`fiction_outlines_api.serializers.SparseFieldsetsSerializerMixin`. Other methods always use
+    every field, so writes are validated in full.
+
+    :attribute field_prefetches:
+        A dict of field name -> lookups to prefetch when that field is rendered. Use
+        :meth:`get_field_prefetches` in ``get_queryset`` so that omitted fields do not cost any queries.
+    '''
+    fields_query_param = 'fields'
+    omit_query_param = 'omit'
+    field_prefetches = {}
+
+    def get_field_names(self, query_param):
+        '''
+        :returns: The set of field names in the query parameter, or ``None`` if it is absent or empty.
+        '''
+        if self.request.method not in ('GET', 'HEAD'):
+            return None
+        names = set(name.strip() for name in self.request.query_params.get(query_param, '').split(','))
+        names.discard('')
+        return names or None
+
+    def field_requested(self, field_name):
+        '''
+        Whether the field will be rendered for this request.
+        '''
+        requested = self.get_field_names(self.fields_query_param)
+        omit = self.get_field_names(self.omit_query_param) or ()
+        return (requested is None or field_name in requested) and field_name not in omit
+
+    def get_field_prefetches(self):
+        '''
+        :returns: The lookups from :attr:`field_prefetches` needed by the fields that will be rendered.
+        '''
+        prefetches = []
+        for field_name, lookups in self.field_prefetches.items():
+            if self.field_requested(field_name):
+                prefetches.extend(lookup for lookup in lookups if lookup not in prefetches)
+        return prefetches
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        requested = self.get_field_names(self.fields_query_param)
+        omit = self.get_field_names(self.omit_query_param)
+        if requested is not None:
+            context['fields'] = requested
+        if omit is not None:
+            context['omit'] = omit
+        return context
+
+
+class ConditionalRetrieveMixin(object):
+    '''
+    API Mixin that adds a strong ``ETag`` to retrieved objects and answers ``304 Not Modified`` to a GET whose
+    ``If-None-Match`` matches it.
+
+    The ETag is derived from the revision token of the outline the object belongs to (see
+    :mod:`fiction_outlines_api.cache`), which changes whenever anything in that outline does. Checking it only
+    needs the object itself for the permission check and a cache lookup, so a matching request never loads or
+    serializes the tree.
+
+    ETags are only sent while revisions are tracked in a cache shared by every process, or by the in-process
+    cache of a single-process deployment (see :func:`fiction_outlines_api.cache.revisions_tracked`). Otherwise
+    objects are retrieved as usual, since another process could answer ``304`` for an outline it never saw
+    change.
+    '''
+
+    def get_outline_id(self, obj):
+        '''
+        Returns the id of the outline whose revision stamps this object.
+        '''
+        return obj.outline_id
+
+    def get_etag(self, obj):
+        '''
+        Builds the ETag from the outline revision and everything else that changes the representation: the
+        object, the query string, the negotiated media type and the active language.
+        '''
+        outline_id = self.get_outline_id(obj)
+        variant = '|'.join([obj._meta.label, str(obj.pk), str(get_revisions([outline_id])[outline_id]),
+                            self.request.META.get('QUERY_STRING', ''),
+                            getattr(self.request, 'accepted_media_type', '') or '', get_language() or ''])
+        return quote_etag(hashlib.sha1(variant.encode('utf-8')).hexdigest())
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if not revisions_tracked():
+            return self.get_retrieve_response(instance)
+        etag = self.get_etag(instance)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            logger.debug('Object %s not modified' % instance.pk)
+            return response.Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        retrieve_response = self.get_retrieve_response(instance)
+        retrieve_response['ETag'] = etag
+        return retrieve_response
+
+    def get_retrieve_response(self, instance):
+        serializer = self.get_serializer(instance)
+        return response.Response(serializer.data)
+
+
+class StreamingMixin(object):
+    '''
+    API Mixin that streams JSON responses when the request has ``?stream=true``, so that very large outlines
+    and lists are rendered piece by piece instead of being built in memory first. Views provide the chunks of
+    JSON through :attr:`stream_object` and :attr:`stream_list` (see :mod:`fiction_outlines_api.streaming`).
+
+    Requests for other renderers, such as the browsable API, and paginated lists get regular responses.
+    Detail views must also use :class:`ConditionalRetrieveMixin`, placed after this one, so that streamed
+    objects keep their ``ETag``. Views that leave out a hook are never streamed.
+
+    :attribute stream_object:
+        Called with the retrieved object, returns an iterable of the chunks of its JSON.
+    :attribute stream_list:
+        Called with the filtered queryset, returns an iterable of the chunks of the JSON of the list.
+    '''
+    stream_object = None  # Specify in subclass
+    stream_list = None  # Specify in subclass
+    stream_query_param = 'stream'
+    stream_chunk_size = DEFAULT_CHUNK_SIZE
+
+    def stream_requested(self):
+        return (self.request.query_params.get(self.stream_query_param, '').lower() in ('1', 'true', 'yes') and
+                isinstance(getattr(self.request, 'accepted_renderer', None), JSONRenderer))
+
+    def streaming_response(self, chunks):
+        return StreamingHttpResponse((chunk.encode('utf-8') for chunk in chunks), content_type='application/json')
+
+    def get_retrieve_response(self, instance):
+        if self.stream_object is None or not self.stream_requested():
+            return super().get_retrieve_response(instance)
+        logger.debug('Streaming %s %s' % (instance._meta.model_name, instance.pk))
+        return self.streaming_response(self.stream_object(instance))
+
+    def list(self, request, *args, **kwargs):
+        if self.stream_list is None or not self.stream_requested():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        logger.debug('Streaming a list of %s' % queryset.model._meta.model_name)
+        return self.streaming_response(self.stream_list(queryset))
+
+
+class PermissionCacheMixin(object):
+    '''
+    API Mixin that memoizes permission checks for the length of a request through
+    :class:`fiction_outlines_api.permissions.PermissionCache`.
+
+    The hits and misses of the cache are logged at the end of the request, and with ``DEBUG`` on they are
+    also returned in the ``X-Permission-Cache`` header.
+    '''
+
+    def has_perm(self, perm, obj=None):
+        '''
+        Checks a permission of the current user, asking the rules at most once per permission and object.
+
+        :param perm:
+            The permission to validate against (in :module:`rules`) format.
+        :param obj:
+            The object to evaluate, if any.
+
+        :returns: ``True`` if the user has the permission.
+        '''
+        return get_permission_cache(self.request).has_perm(self.request.user, perm, obj)
+
+    def get_denied_objects(self, perm, objects, select_related=('user',)):
+        '''
+        Checks a permission for several objects of the same model at once. The objects are loaded again with
+        ``select_related`` in a single query, so that rules following those relations do not query per object.
+
+        :param perm:
+            The permission to validate against (in :module:`rules`) format.
+        :param objects:
+            The objects to evaluate.
+        :param select_related:
+            Relations the rules of the permission follow. Defaults to the owner.
+
+        :returns: A list of the objects the user lacks the permission for, in their original order.
+        '''
+        objects = list(objects)
+        if not objects:
+            return []
+        loaded = type(objects[0])._default_manager.select_related(*select_related).in_bulk(
+            [obj.pk for obj in objects])
+        return [obj for obj in objects if not self.has_perm(perm, loaded.get(obj.pk, obj))]
+
+    def check_series_permissions(self, series):
+        '''
+        Verifies that the user can edit all the given series with a single query.
+
+        :param series:
+            A list of series.
+
+        :raises PermissionDenied: listing the ids of every series the user cannot edit.
+        '''
+        denied = self.get_denied_objects('fiction_outlines.edit_series', series)
+        if denied:
+            logger.debug('Editing rights missing for %d series' % len(denied))
+            raise PermissionDenied({'detail': _('You do not have editing rights for the specified series.'),
+                                    'series': [str(item.pk) for item in denied]})
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        cache = get_permission_cache(request)
+        logger.debug('Permission cache: %d hits, %d misses' % (cache.hits, cache.misses))
+        if settings.DEBUG:
+            response['X-Permission-Cache'] = 'hits=%d, misses=%d' % (cache.hits, cache.misses)
+        return response
+
+
+class CachedPermissionRequiredMixin(PermissionCacheMixin, PermissionRequiredMixin):
+    '''
+    Same as ``rest_framework_rules.mixins.PermissionRequiredMixin``, with the checks going through
+    :meth:`PermissionCacheMixin.has_perm`.
+    '''
+
+    def check_object_permissions(self, request, obj):
+        missing_permissions = [perm for perm in self.get_object_permission_required() if not self.has_perm(perm, obj)]
+        if missing_permissions:
+            self.permission_denied(request, message='MISSING: {}'.format(', '.join(missing_permissions)))
+
+    def check_permissions(self, request):
+        missing_permissions = [perm for perm in self.get_permission_required() if not self.has_perm(perm)]
+        if missing_permissions:
+            self.permission_denied(request, message='MISSING: {}'.format(', '.join(missing_permissions)))
+
+
 class MultiObjectPermissionsMixin(object):
     '''
     API Mixin that compares ``n`` objects and their permissions and returns if both are valid.
@@ -25,28 +306,42 @@ class MultiObjectPermissionsMixin(object):
 
     {'obj1': {'obj_class': class_model, 'lookup_url_kwarg', 'object_permission_required': 'your rules perm here'}, ...}
 
+    Entries can also list the relations their rules follow under ``select_related`` (the owner by default).
+    Objects are fetched together with those relations, with one query per model class, before any rule is evaluated.
+
     Is it ugly, yes. Does it make doing this in view after view repeatable. Yep.
     '''
     object_class_permission_dict = {}
+    default_permission_related = ('user',)
 
-    def get_permission_object(self, pkval, objectpermission, obj_class):
+    def get_permission_objects(self, kwargs):
         '''
-        Fetches the permission object and checks it agains the permission specified.
+        Fetches the permission objects of all entries, grouping the lookups by model class.
 
-        :param pkval:
-            The pk value to use in the search.
-        :param objectpermission:
-            A permission based on the :module:`rules` format, e.g. "app_name.permission_name"
-        :param obj_class:
-            The class of the object we are searching for.
+        :param kwargs:
+            The url kwargs holding the lookup values.
 
-        :returns: The found object.
+        :returns: A dict with the found objects by entry key. Entries whose object does not exist are left out.
         '''
-        queryset = self.filter_queryset(self.get_object_permission_queryset(obj_class))
-        filter_kwargs = {self.lookup_field: pkval}
-        obj = get_object_or_404(queryset, **filter_kwargs)
-        self.check_object_permissions(self.request, objectpermission, obj)
-        return obj
+        lookups = OrderedDict()
+        for key, attrs in self.object_class_permission_dict.items():
+            lookups.setdefault(attrs['obj_class'], []).append(key)
+        objects = {}
+        for obj_class, keys in lookups.items():
+            related = set()
+            for key in keys:
+                related.update(self.object_class_permission_dict[key].get('select_related',
+                                                                          self.default_permission_related))
+            queryset = self.filter_queryset(self.get_object_permission_queryset(obj_class)).select_related(*related)
+            logger.debug('Fetching %d %s objects' % (len(keys), obj_class._meta.model_name))
+            found = queryset.in_bulk(
+                [kwargs[self.object_class_permission_dict[key]['lookup_url_kwarg']] for key in keys],
+                field_name=self.lookup_field)
+            for key in keys:
+                pkval = kwargs[self.object_class_permission_dict[key]['lookup_url_kwarg']]
+                if pkval in found:
+                    objects[key] = found[pkval]
+        return objects
 
     def check_object_permissions(self, request, perm, obj):
         '''
@@ -61,17 +356,18 @@ class MultiObjectPermissionsMixin(object):
 
         :raise PermissionDenied: when user lacks the required permission.
         '''
-        if not request.user.has_perm(perm, obj):
+        if not get_permission_cache(request).has_perm(request.user, perm, obj):
             raise PermissionDenied
         return super().check_object_permissions(request, obj)
 
     def post(self, request, *args, **kwargs):
-        self.permission_object_dict = {}
+        self.permission_object_dict = self.get_permission_objects(kwargs)
         for obj, attrs in self.object_class_permission_dict.items():
+            if obj not in self.permission_object_dict:
+                raise Http404
             try:
-                self.permission_object_dict[obj] = self.get_permission_object(kwargs[attrs['lookup_url_kwarg']],
-                                                                              attrs['object_permission_required'],
-                                                                              attrs['obj_class'])
+                self.check_object_permissions(request, attrs['object_permission_required'],
+                                              self.permission_object_dict[obj])
             except PermissionDenied as PD:
                 error_response = response.Response({'error_message': str(PD)}, status=status.HTTP_403_FORBIDDEN,
                                                    content_type='application/json')
@@ -172,6 +468,153 @@ class NodeAddMixin(object):
         return new_serializer
 
 
+class NodeBulkAddMixin(object):
+    '''
+    API mixin that adds a nested list of new nodes in one transaction. Each item of the request body holds the
+    fields of a new node, as for :class:`NodeAddMixin`, and an optional ``children`` list of further items.
+    The top level items are placed in order at ``position`` relative to the node of the url, which must be one
+    of :data:`POSITIONS`, and children are appended to their parent.
+
+    The paths of the new nodes are allocated in memory by :class:`fiction_outlines_api.bulk.TreeLayout` and the
+    nodes are inserted with ``bulk_create``, so the number of queries does not grow with the number of nodes.
+    The structural rules ``add_child``/``add_sibling`` would enforce are checked against the layout with
+    :attr:`placement_rules`. ``pre_save`` is sent for every new node, ``post_save`` is not.
+
+    When any item is invalid nothing is created, and the errors are returned keyed by the position of the item
+    in the request, e.g. ``0/children/2``.
+
+    The fields of the new nodes are the ``fields_required_for_add`` of the view.
+
+    :attribute max_nodes:
+        The largest number of nodes accepted in one request, counting children.
+    :attribute placement_rules:
+        Called with the layout and each new node once it is placed, raises ``IntegrityError`` if the node
+        breaks the rules of its tree.
+    '''
+    related_key = None  # Specify in subclass
+    target_node_type_fieldname = None  # Specify in subclass
+    placement_rules = None  # Specify in subclass
+    max_nodes = 1000
+
+    def get_outline_id(self, node):
+        '''
+        Returns the id of the outline whose revision stamps the tree of a node.
+        '''
+        return node.outline_id
+
+    def build_node(self, validated_data):
+        '''
+        Instantiates a new node from validated data, in the same tree as the node of the url. Fields that were
+        not submitted keep their model defaults.
+        '''
+        kwargs = dict((field, validated_data[field]) for field in self.fields_required_for_add
+                      if field in validated_data)
+        kwargs[self.related_key] = getattr(self.source_node, self.related_key)
+        return self.get_queryset().model(**kwargs)
+
+    def validate_item(self, item):
+        '''
+        Validates the fields of one item of the request.
+
+        :raises ValidationError: if the item is invalid.
+
+        :returns: A tuple of the new, unsaved, node and the list of its children items.
+        '''
+        if not isinstance(item, dict):
+            raise ValidationError([_('Expected an object describing a node.')])
+        data = dict(item)
+        children = data.pop('children', None) or []
+        if not isinstance(children, list):
+            raise ValidationError({'children': [_('Expected a list of nodes.')]})
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data.get('assoc_characters') or serializer.validated_data.get('assoc_locations'):
+            raise ValidationError([_('Specifying linked characters and locations at creation is not supported.')])
+        return self.build_node(serializer.validated_data), children
+
+    def perform_bulk_add(self, items, pos):
+        '''
+        Validates every item, and if they are all valid, writes the new nodes.
+
+        :raises ValidationError: if there are too many nodes, or any of them is invalid.
+
+        :raises TreeUnavailable: if the DB tree is out of available nodes.
+
+        :returns: The ids and types of the new nodes, nested like the request.
+        '''
+        layout = TreeLayout.load(self.source_node, self.get_queryset().select_related(None),
+                                 fields=(self.related_key, self.target_node_type_fieldname))
+        source = layout.nodes[self.source_node.pk]
+        results = []
+        added = []
+        errors = OrderedDict()
+        previous = None
+        stack = [(str(index), item, None, results) for index, item in reversed(list(enumerate(items)))]
+        while stack:
+            index, item, parent, siblings = stack.pop()
+            if len(added) + len(errors) >= self.max_nodes:
+                raise ValidationError(_('At most %d nodes can be added at once.') % self.max_nodes)
+            try:
+                node, children = self.validate_item(item)
+                if parent is not None:
+                    layout.add(node, parent, 'last-child')
+                elif previous is not None:
+                    layout.add(node, previous, 'right')
+                else:
+                    layout.add(node, source, pos)
+            except ValidationError as VE:
+                errors[index] = VE.detail
+                continue
+            except InvalidPosition as IP:
+                errors[index] = [str(IP)]
+                continue
+            if parent is None:
+                previous = node
+            try:
+                self.placement_rules(layout, node)
+            except IntegrityError as IE:
+                errors[index] = [str(IE)]
+            added.append((index, node))
+            result = OrderedDict((('id', node.pk),
+                                  (self.target_node_type_fieldname, getattr(node, self.target_node_type_fieldname)),
+                                  ('children', [])))
+            siblings.append(result)
+            stack.extend(('%s/children/%d' % (index, child_index), child, node, result['children'])
+                         for child_index, child in reversed(list(enumerate(children))))
+        # bulk_create does not send pre_save, but the headlines and the link checks of arc nodes rely on it.
+        model = self.get_queryset().model
+        using = router.db_for_write(model)
+        for index, node in added:
+            if index in errors:
+                continue
+            try:
+                pre_save.send(sender=model, instance=node, raw=False, using=using, update_fields=None)
+            except IntegrityError as IE:
+                errors[index] = [str(IE)]
+        if errors:
+            logger.debug('%d of the new nodes are invalid' % len(errors))
+            raise ValidationError(errors)
+        try:
+            layout.save()
+        except PathOverflow as PO:  # pragma: no cover It would take a monumental amount of data to trigger this.
+            logger.error('There is no further room within the tree for %s: %s' % (self.get_queryset().model, PO))
+            raise TreeUnavailable
+        logger.debug('Added %d nodes next to %s' % (len(added), self.source_node))
+        invalidate_outline(self.get_outline_id(self.source_node))
+        return results
+
+    def post(self, request, *args, **kwargs):
+        self.source_node = self.get_object()
+        pos = kwargs['position']
+        if pos not in POSITIONS:
+            raise ValidationError(_('Not a valid position for adding nodes.'))
+        if not isinstance(request.data, list) or not request.data:
+            raise ValidationError(_('Expected a list of at least one node.'))
+        with transaction.atomic():
+            results = self.perform_bulk_add(request.data, pos)
+        return response.Response(results, status=status.HTTP_201_CREATED)
+
+
 class NodeMoveMixin(object):
     '''
     API mixin for move method for nodes.
@@ -181,28 +624,38 @@ class NodeMoveMixin(object):
     target_node_type_fieldname = None  # fieldname to send to tree_manipulation signal.
     pos = None
     related_key = None  # Specify in subclass
+    tree_fields = ('path', 'depth', 'numchild')
 
-    def get_object(self, pkval):
+    def get_nodes(self, *pkvals):
         '''
-        Fetches an individual object and verifies that the user has the appropriate
-        permissions to move it.
+        Fetches nodes with a single query and verifies that the user has the appropriate
+        permissions to move each of them.
 
-        :param pkval:
-             The primary key value to use in the search.
+        :param pkvals:
+             The primary key values to use in the search.
 
-        :returns: Object
+        :returns: A list of the nodes, in the order of ``pkvals``.
 
-        :raises Http404: if object cannot be found
+        :raises Http404: if a node cannot be found
 
         :raises PermissionDenied: if user does not have the required permissions.
         '''
-        logger.debug('generating queryset')
-        queryset = self.filter_queryset(self.get_queryset())
-        filter_kwargs = {self.lookup_field: pkval}
-        logger.debug('Searching for node with: %s' % filter_kwargs)
-        obj = get_object_or_404(queryset, **filter_kwargs)
-        self.check_object_permissions(self.request, obj)
-        return obj
+        logger.debug('Searching for nodes with %s in %s' % (self.lookup_field, pkvals))
+        found = self.filter_queryset(self.get_queryset()).in_bulk(pkvals, field_name=self.lookup_field)
+        nodes = []
+        for pkval in pkvals:
+            if pkval not in found:
+                raise Http404
+            self.check_object_permissions(self.request, found[pkval])
+            nodes.append(found[pkval])
+        return nodes
+
+    def refresh_tree_fields(self, node):
+        '''
+        Reloads the columns treebeard rewrites during a move, keeping everything else that was already loaded.
+        '''
+        node.refresh_from_db(fields=self.tree_fields)
+        node.__dict__.pop('_cached_parent_obj', None)
 
     def perform_move(self):
         '''
@@ -246,13 +699,115 @@ class NodeMoveMixin(object):
             logger.error(_('There is no further room within the tree for %s!!!!! DETAILS: %s' %
                            (str(self.source_node.__class__), str(PO))))
             raise TreeUnavailable
-        return self.get_serializer_class()(self.get_object(self.source_node.pk))
+        self.refresh_tree_fields(self.source_node)
+        return self.get_serializer_class()(self.source_node)
 
     def post(self, request, *args, **kwargs):
-        logger.debug("Trying to fetch source node.")
-        self.source_node = self.get_object(kwargs['node_to_move_id'])
-        logger.debug("Trying to fetch target node")
-        self.target_node = self.get_object(kwargs['target_node_id'])
+        logger.debug("Trying to fetch source and target nodes.")
+        self.source_node, self.target_node = self.get_nodes(kwargs['node_to_move_id'], kwargs['target_node_id'])
         self.pos = kwargs['position']
         new_node_serializer = self.perform_move()
         return response.Response(new_node_serializer.data, status=status.HTTP_200_OK)
+
+
+class NodeBulkMoveMixin(NodeMoveMixin):
+    '''
+    API mixin that applies an ordered list of moves in one transaction. The request body is a list of
+    ``{"node": <uuid>, "target": <uuid>, "position": <position>}`` operations, where ``position`` is one of
+    :data:`POSITIONS`.
+
+    All nodes are fetched and permission checked with one query. Each operation is then validated, including the
+    ``tree_manipulation`` rules, against the layout left by the operations before it (see
+    :class:`fiction_outlines_api.bulk.TreeLayout`), and only once every operation is valid are the trees written,
+    each changed node once.
+
+    The response lists the result of each operation in order. When any operation is invalid nothing is moved, the
+    status is 400, and the invalid operations carry an ``error``.
+
+    :attribute max_operations:
+        The largest number of operations accepted in one request.
+    '''
+    max_operations = 500
+
+    def get_layout(self, node):
+        '''
+        Returns the layout of the tree of a node, loading it with the fields the move rules need on first use.
+        '''
+        root_path = node.path[:node.steplen]
+        if root_path not in self.layouts:
+            self.layouts[root_path] = TreeLayout.load(node, self.get_queryset().select_related(None),
+                                                      fields=(self.related_key, self.target_node_type_fieldname))
+        return self.layouts[root_path]
+
+    def simulate_move(self, source_node, target_node, pos):
+        '''
+        Validates a move and applies it to the layout of the tree.
+
+        :raises ValidationError: if the move request violates tree structure.
+        '''
+        if pos not in POSITIONS:
+            raise ValidationError(_('Not a valid position for moving a node.'))
+        if getattr(source_node, self.related_key) != getattr(target_node, self.related_key):
+            raise ValidationError(_('Nodes must be from the same %s' % self.related_key))
+        layout = self.get_layout(source_node)
+        node, target = layout.nodes[source_node.pk], layout.nodes[target_node.pk]
+        if 'child' not in pos and layout.get_parent(target) is None:
+            raise ValidationError(_('You cannot move this item to the same level as a root node!'))
+        try:
+            tree_manipulation.send(sender=node.__class__, instance=node, target_node=target,
+                                   target_node_type=getattr(target, self.target_node_type_fieldname),
+                                   action='move', pos=pos)
+            layout.move(node, target, pos)
+            self.moved_nodes[node.pk] = node
+        except IntegrityError as IE:
+            raise ValidationError(_('This would result in nodes being children of invalid parent nodes. %s' % str(IE)))
+        except InvalidMoveToDescendant:
+            raise ValidationError(_('You cannot move a node to be the sibling or child of one of its descendants.'))
+
+    def perform_bulk_move(self, operations):
+        '''
+        Validates all operations, and if they are all valid, writes the changed trees.
+
+        :raises TreeUnavailable: if the DB tree is out of available nodes.
+
+        :returns: A tuple of the list of results and whether every operation was valid.
+        '''
+        pkvals = list(OrderedDict.fromkeys(pkval for operation in operations
+                                           for pkval in (operation['node'], operation['target'])))
+        nodes = dict((node.pk, node) for node in self.get_nodes(*pkvals))
+        self.layouts = {}
+        self.moved_nodes = {}
+        results = []
+        for operation in operations:
+            result = OrderedDict((key, operation[key]) for key in ('node', 'target', 'position'))
+            try:
+                self.simulate_move(nodes[operation['node']], nodes[operation['target']], operation['position'])
+                result['status'] = 'valid'
+            except ValidationError as VE:
+                logger.debug('Operation %s is invalid: %s' % (len(results), VE.detail))
+                result['status'] = 'invalid'
+                result['error'] = VE.detail[0]
+            results.append(result)
+        if any(result['status'] == 'invalid' for result in results):
+            return results, False
+        try:
+            for layout in self.layouts.values():
+                layout.save()
+        except PathOverflow as PO:  # pragma: no cover It would take a monumental amount of data to trigger this.
+            logger.error('There is no further room within the tree for %s: %s' % (self.get_queryset().model, PO))
+            raise TreeUnavailable
+        for result in results:
+            result['status'] = 'moved'
+            result['parent'] = self.moved_nodes[result['node']].get_parent().pk
+        return results, True
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data:
+            raise ValidationError(_('At least one operation is required.'))
+        if len(serializer.validated_data) > self.max_operations:
+            raise ValidationError(_('At most %d operations can be sent at once.') % self.max_operations)
+        with transaction.atomic():
+            results, valid = self.perform_bulk_move(serializer.validated_data)
+        return response.Response(results, status=status.HTTP_200_OK if valid else status.HTTP_400_BAD_REQUEST)
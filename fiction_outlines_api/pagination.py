@@ -0,0 +1,29 @@
+'''
+Pagination for the list endpoints.
+'''
+import logging
+from rest_framework.pagination import CursorPagination
+
+logger = logging.getLogger('fiction-outlines-api')
+
+
+class OptionalCursorPagination(CursorPagination):
+    '''
+    Opt-in keyset pagination. Lists are only paginated when the request has a ``cursor`` or ``page_size``
+    query parameter, so clients that expect the full list keep getting it.
+
+    Pages are ordered by primary key, which is unique, indexed and never changes, so every page is a single
+    ``WHERE id > ... LIMIT ...`` query no matter how deep it is, and no ``COUNT(*)`` is ever run. The
+    response holds ``next``, ``previous`` and ``results``.
+    '''
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (self.cursor_query_param not in request.query_params and
+                self.page_size_query_param not in request.query_params):
+            return None
+        logger.debug('Paginating %s' % queryset.model.__name__)
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,27 @@
+'''
+Optional fast JSON parsing, the counterpart of :class:`fiction_outlines_api.renderers.FastJSONRenderer`.
+'''
+import codecs
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from .renderers import orjson
+
+
+class FastJSONParser(JSONParser):
+    '''
+    JSON parser that uses ``orjson`` when it is available, and the JSON parser of rest framework otherwise.
+    Like the latter in strict mode, it rejects ``NaN`` and ``Infinity``.
+    '''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            if codecs.lookup(encoding).name != 'utf-8':
+                data = data.decode(encoding)
+            return orjson.loads(data)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
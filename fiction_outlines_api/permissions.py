@@ -0,0 +1,73 @@
+'''
+Request-scoped memoization of permission checks.
+
+The object rules of :mod:`fiction_outlines.rules` walk relations such as node → outline → user, and a single
+request can ask the same question more than once, from the view and from the mixins it is built from.
+:class:`PermissionCache` remembers every decision for the length of a request, keyed by user, permission and
+object, and counts its hits and misses.
+
+Objects are identified by model and primary key, so a fresh copy of an object that was already checked is a
+hit too. Unsaved objects are never cached.
+'''
+import logging
+
+logger = logging.getLogger('fiction-outlines-api')
+
+
+class PermissionCache(object):
+    '''
+    Memoizes ``user.has_perm`` decisions.
+
+    :attribute hits:
+        Number of checks answered from the cache.
+    :attribute misses:
+        Number of checks that were evaluated.
+    '''
+
+    def __init__(self):
+        self.decisions = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(user, perm, obj=None):
+        '''
+        Builds the cache key of a check, or returns ``None`` if the check cannot be cached.
+        '''
+        if obj is None:
+            return (user.pk, perm, None, None)
+        if obj._state.adding:
+            return None
+        return (user.pk, perm, obj._meta.label, obj.pk)
+
+    def has_perm(self, user, perm, obj=None):
+        '''
+        Same as ``user.has_perm(perm, obj)``, evaluated at most once per user, permission and object.
+        '''
+        key = self.get_key(user, perm, obj)
+        if key is None:
+            return user.has_perm(perm, obj)
+        if key in self.decisions:
+            self.hits += 1
+            return self.decisions[key]
+        self.misses += 1
+        decision = self.decisions[key] = user.has_perm(perm, obj)
+        return decision
+
+    def clear(self):
+        '''
+        Forgets all decisions, e.g. after a change of ownership. The counters are kept.
+        '''
+        self.decisions.clear()
+
+
+def get_permission_cache(request):
+    '''
+    Returns the permission cache of a request, creating it on first use. The cache is stored on the
+    underlying ``HttpRequest``, so it is shared by everything that wraps the same request.
+    '''
+    request = getattr(request, '_request', request)
+    cache = getattr(request, 'permission_cache', None)
+    if cache is None:
+        cache = request.permission_cache = PermissionCache()
+    return cache
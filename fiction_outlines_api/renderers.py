@@ -0,0 +1,67 @@
+'''
+Optional fast JSON rendering.
+
+:class:`FastJSONRenderer` encodes responses with `orjson`_ when it is installed, which serializes UUIDs, dicts
+and lists natively and is several times faster than the standard library on large outline structures. Without
+``orjson``, or when the client asks for something ``orjson`` cannot produce (an indent other than 2, ASCII only
+output, or non compact output), it falls back to the JSON renderer of rest framework. Either way the output
+parses to the same JSON.
+
+The renderer and :class:`fiction_outlines_api.parsers.FastJSONParser` are enabled in the project's settings:
+
+.. code-block:: python
+
+    REST_FRAMEWORK = {
+        'DEFAULT_RENDERER_CLASSES': [
+            'fiction_outlines_api.renderers.FastJSONRenderer',
+            'rest_framework.renderers.BrowsableAPIRenderer',
+        ],
+        'DEFAULT_PARSER_CLASSES': [
+            'fiction_outlines_api.parsers.FastJSONParser',
+            'rest_framework.parsers.FormParser',
+            'rest_framework.parsers.MultiPartParser',
+        ],
+    }
+
+.. _`orjson`: https://github.com/ijl/orjson
+'''
+import logging
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger('fiction-outlines-api')
+
+
+def default(obj):
+    '''
+    Encodes the types ``orjson`` does not know about (decimals, lazy translations, querysets, ...) the same way
+    as rest framework does.
+    '''
+    return encoders.JSONEncoder().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    '''
+    JSON renderer that uses ``orjson`` when it is available.
+    '''
+
+    def can_render_fast(self, accepted_media_type, renderer_context):
+        if orjson is None or not api_settings.UNICODE_JSON or not api_settings.COMPACT_JSON:
+            return False
+        return self.get_indent(accepted_media_type, renderer_context or {}) in (None, 2)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not self.can_render_fast(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        option = orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=option)
@@ -1,10 +1,19 @@
 import logging
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
 from django.utils.translation import gettext_lazy as _
 from taggit_serializer.serializers import TaggitSerializer, TagListSerializerField
 from fiction_outlines.models import Series, Character, Location, Outline
 from fiction_outlines.models import CharacterInstance, LocationInstance, Arc
 from fiction_outlines.models import ArcElementNode, StoryElementNode, MACE_TYPES
+from .trees import StoryTree, ArcTree, annotate_nodes
+from .cache import StructureCache
+from .tags import set_tags
 
 
 logger = logging.getLogger('fiction-outlines-api')
@@ -19,18 +28,267 @@ MOVE_POSITION_CHOICES = (
 )
 
 
-def convert_annotated_list(annotated_list, serializer_class):
+def convert_annotated_list(annotated_list, serializer_class, context=None):
     '''
     Takes an annotated list and a serializer class and returns a version that is suitable for
-    serialization.
+    serialization. All items are serialized with the field plan of a :class:`CompiledSerializer`.
+
+    :param context:
+        Optional serializer context, e.g. the ``tree_aggregates`` of a tree builder.
+    '''
+    items = [item for item, info in annotated_list]
+    data = CompiledSerializer(serializer_class, context).to_representation_many(items)
+    return [(item_data, info) for item_data, (item, info) in zip(data, annotated_list)]
+
+
+def convert_nested_tree(nodes, serializer_class, context=None):
+    '''
+    Takes a path ordered list of nodes and a serializer class and returns the serialized top level nodes,
+    with the descendants of each one nested under its ``children`` key. The nesting is built in a single
+    pass over the nodes.
+
+    :param context:
+        Optional serializer context, e.g. the ``tree_aggregates`` of a tree builder.
+    '''
+    data = CompiledSerializer(serializer_class, context).to_representation_many(nodes)
+    roots = []
+    open_nodes = []
+    for node, node_data in zip(nodes, data):
+        node_data['children'] = []
+        while open_nodes and open_nodes[-1][0] >= node.depth:
+            open_nodes.pop()
+        (open_nodes[-1][1]['children'] if open_nodes else roots).append(node_data)
+        open_nodes.append((node.depth, node_data))
+    return roots
+
+
+def convert_tree(tree, serializer_class, context=None):
+    '''
+    Serializes a tree builder's nodes, leaving out the root, in the ``tree_format`` requested in the
+    serializer context (see :class:`fiction_outlines_api.mixins.TreeFormatMixin`).
+    '''
+    context = context or {}
+    if context.get('tree_format') == 'nested':
+        return convert_nested_tree(tree.nodes[1:], serializer_class, context=context)
+    return convert_annotated_list(tree.annotated_list()[1:], serializer_class, context=context)
+
+
+def convert_nodes(nodes, serializer_class, context=None):
     '''
-    converted_list = []  # pragma: no cover
-    for item, info in annotated_list:
-        converted_list.append((serializer_class(item).data, info))
-    return converted_list
+    Serializes a path ordered list of nodes, whose first node is the top of the tree, in the ``tree_format``
+    requested in the serializer context. Levels are relative to the first node.
+    '''
+    context = context or {}
+    if context.get('tree_format') == 'nested':
+        return convert_nested_tree(nodes, serializer_class, context=context)
+    return convert_annotated_list(annotate_nodes(nodes), serializer_class, context=context)
+
+
+class SparseFieldsetsSerializerMixin(object):
+    '''
+    Serializer mixin that only renders the fields named by ``fields`` in the serializer context, minus those
+    named by ``omit`` (see :class:`fiction_outlines_api.mixins.SparseFieldsetsMixin`). Fields that are left
+    out are removed before serialization, so computed fields and method fields are never evaluated.
+
+    Only the top level serializer, or the child of a top level list serializer, is restricted. Nested
+    serializers always render all their fields.
+    '''
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+        requested = self.context.get('fields')
+        omit = self.context.get('omit', ())
+        for field_name in list(fields):
+            if (requested is not None and field_name not in requested) or field_name in omit:
+                del fields[field_name]
+        return fields
+
+
+class TreeAggregateMixin(object):
+    '''
+    Field mixin for values that a tree builder has already computed for every node in the tree.
+
+    When the serializer context contains ``tree_aggregates`` (a dict of node pk -> dict of values, see
+    :class:`fiction_outlines_api.trees.StoryTree`) the value is read from there. Otherwise the field
+    falls back to the model attribute as usual.
+    '''
+
+    def get_attribute(self, instance):
+        aggregates = self.context.get('tree_aggregates', {})
+        if instance.pk in aggregates:
+            return aggregates[instance.pk][self.field_name]
+        return super().get_attribute(instance)
 
 
-class SeriesSerializer(TaggitSerializer, serializers.ModelSerializer):
+class TreeAggregateField(TreeAggregateMixin, serializers.ReadOnlyField):
+    '''
+    Read-only field that can be served by a tree builder.
+    '''
+    pass
+
+
+class TreeAggregateListSerializer(TreeAggregateMixin, serializers.ListSerializer):
+    '''
+    Nested list serializer that can be served by a tree builder.
+    '''
+    pass
+
+
+def get_model_field(model, field):
+    '''
+    Returns the concrete model field a serializer field reads directly from, or ``None``.
+    '''
+    if model is None or len(field.source_attrs) != 1:
+        return None
+    try:
+        model_field = model._meta.get_field(field.source_attrs[0])
+    except FieldDoesNotExist:
+        return None
+    return model_field if model_field.concrete else None
+
+
+def compile_reader(field, model):
+    '''
+    Returns a function of (instance, tree aggregates) that gets the attribute a serializer field would get.
+    Concrete model fields, foreign key ids and prefetched many to many relations are read directly, everything
+    else goes through the field.
+    '''
+    model_field = get_model_field(model, field)
+    if isinstance(field, TreeAggregateMixin):
+        field_name = field.field_name
+
+        def read(instance, aggregates):
+            if instance.pk in aggregates:
+                return aggregates[instance.pk][field_name]
+            return field.get_attribute(instance)
+        return read
+    if model_field is not None and model_field.many_to_many and isinstance(field, serializers.ManyRelatedField):
+        def read(instance, aggregates):
+            # Creating a related manager just to reach its prefetched queryset is costly on large trees.
+            prefetched = getattr(instance, '_prefetched_objects_cache', {})
+            if model_field.name in prefetched:
+                return prefetched[model_field.name]
+            return field.get_attribute(instance)
+        return read
+    if model_field is not None and not model_field.many_to_many and (not model_field.is_relation or (
+            isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None)):
+        return lambda instance, aggregates: getattr(instance, model_field.attname)
+    return lambda instance, aggregates: field.get_attribute(instance)
+
+
+def compile_converter(field):
+    '''
+    Returns the function that turns an attribute into its representation, as the field would.
+    '''
+    if isinstance(field, serializers.ReadOnlyField):
+        return lambda value: value
+    if isinstance(field, serializers.UUIDField) and field.uuid_format == 'hex_verbose':
+        return str
+    if isinstance(field, serializers.CharField):
+        return str
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        return lambda value: value.pk if isinstance(value, PKOnlyObject) else value
+    if (isinstance(field, serializers.ManyRelatedField) and
+            isinstance(field.child_relation, serializers.PrimaryKeyRelatedField) and
+            field.child_relation.pk_field is None):
+        return lambda value: [item.pk for item in value]
+    if isinstance(field, serializers.ListSerializer) and isinstance(field.child, serializers.Serializer):
+        child = CompiledSerializer(field.child)
+        return lambda value: [child.to_representation(item) for item in
+                              (value.all() if isinstance(value, models.Manager) else value)]
+    return field.to_representation
+
+
+class CompiledSerializer(object):
+    '''
+    Read-only serialization path for the nodes of large trees, giving the same output as the serializer it is
+    built from.
+
+    A serializer instance builds its fields on every use and dispatches each value through the generic field
+    machinery. The field plan here is built once per serializer class: for each readable field, a reader that
+    gets its attribute (directly from the row for model columns and foreign keys) and a converter that
+    renders it. Serializing a row is then a plain loop over the plan.
+
+    The serializer context may hold ``tree_aggregates`` as well as ``fields`` and ``omit`` (see
+    :class:`SparseFieldsetsSerializerMixin`), which apply to every row. Overrides of ``to_representation``
+    on the serializer class are not used.
+
+    :param serializer:
+        A serializer class, or a bound serializer instance such as the child of a nested list serializer.
+    :param context:
+        Optional serializer context.
+    '''
+    _plans = {}
+
+    def __init__(self, serializer, context=None):
+        context = context or {}
+        self.aggregates = context.get('tree_aggregates', {})
+        plan = self.get_plan(serializer)
+        requested = context.get('fields')
+        omit = context.get('omit', ())
+        self.plan = [entry for entry in plan if (requested is None or entry[0] in requested) and entry[0] not in omit]
+
+    @classmethod
+    def get_plan(cls, serializer):
+        if not isinstance(serializer, serializers.BaseSerializer):
+            if serializer not in cls._plans:
+                logger.debug('Compiling field plan for %s' % serializer.__name__)
+                cls._plans[serializer] = cls.compile(serializer())
+            return cls._plans[serializer]
+        return cls.compile(serializer)
+
+    @staticmethod
+    def compile(serializer):
+        model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+        return [(field.field_name, compile_reader(field, model), compile_converter(field))
+                for field in serializer._readable_fields]
+
+    def to_representation(self, instance):
+        ret = OrderedDict()
+        aggregates = self.aggregates
+        for field_name, read, convert in self.plan:
+            try:
+                attribute = read(instance, aggregates)
+            except SkipField:
+                continue
+            ret[field_name] = None if attribute is None else convert(attribute)
+        return ret
+
+    def to_representation_many(self, instances):
+        return [self.to_representation(instance) for instance in instances]
+
+
+class TaggedListSerializer(serializers.ListSerializer):
+    '''
+    List serializer that loads the tags of every object on the page with one query per tag field before
+    serializing them, unless the view already prefetched them or the tag fields are left out.
+    '''
+
+    def to_representation(self, data):
+        objects = list(data.all() if isinstance(data, models.Manager) else data)
+        lookups = [field.source for field in self.child.fields.values() if isinstance(field, TagListSerializerField)]
+        if objects and lookups:
+            prefetch_related_objects(objects, *lookups)
+        return super().to_representation(objects)
+
+
+class BulkTaggitSerializer(TaggitSerializer):
+    '''
+    ``TaggitSerializer`` that writes tags in bulk with :func:`fiction_outlines_api.tags.set_tags`.
+    '''
+
+    def _save_tags(self, tag_object, tags):
+        for field_name, names in tags.items():
+            set_tags(getattr(tag_object, field_name), names)
+        return tag_object
+
+
+class SeriesSerializer(SparseFieldsetsSerializerMixin, BulkTaggitSerializer, serializers.ModelSerializer):
     '''
     Serializer for Series model.
     '''
@@ -39,11 +297,12 @@ class SeriesSerializer(TaggitSerializer, serializers.ModelSerializer):
 
     class Meta:  # pragma: no cover
         model = Series
+        list_serializer_class = TaggedListSerializer
         fields = ('id', 'title', 'description', 'tags')
         read_only_fields = ('id',)
 
 
-class CharacterInstanceSerializer(serializers.ModelSerializer):
+class CharacterInstanceSerializer(SparseFieldsetsSerializerMixin, serializers.ModelSerializer):
     '''
     Serializer for character instance.
     '''
@@ -59,7 +318,7 @@ class CharacterInstanceSerializer(serializers.ModelSerializer):
             extra_kwargs['field'] = {'required': False}
 
 
-class LocationInstanceSerializer(serializers.ModelSerializer):
+class LocationInstanceSerializer(SparseFieldsetsSerializerMixin, serializers.ModelSerializer):
     '''
     Serializer for location instance.
     '''
@@ -74,7 +333,7 @@ class LocationInstanceSerializer(serializers.ModelSerializer):
             extra_kwargs['field'] = {'required': False}
 
 
-class CharacterSerializer(TaggitSerializer, serializers.ModelSerializer):
+class CharacterSerializer(SparseFieldsetsSerializerMixin, BulkTaggitSerializer, serializers.ModelSerializer):
     '''
     Serializer for Character model.
     '''
@@ -86,11 +345,12 @@ class CharacterSerializer(TaggitSerializer, serializers.ModelSerializer):
 
     class Meta:  # pragma: no cover
         model = Character
+        list_serializer_class = TaggedListSerializer
         fields = ('id', 'name', 'description', 'series', 'tags', 'character_instances')
         read_only_fields = ('id', 'character_instances')
 
 
-class LocationSerializer(TaggitSerializer, serializers.ModelSerializer):
+class LocationSerializer(SparseFieldsetsSerializerMixin, BulkTaggitSerializer, serializers.ModelSerializer):
     '''
     Serializer for Location model.
     '''
@@ -102,11 +362,52 @@ class LocationSerializer(TaggitSerializer, serializers.ModelSerializer):
 
     class Meta:  # pragma: no cover
         model = Location
+        list_serializer_class = TaggedListSerializer
         fields = ('id', 'name', 'description', 'series', 'tags', 'location_instances')
         read_only_fields = ('id', 'location_instances')
 
 
-class OutlineSerializer(TaggitSerializer, serializers.ModelSerializer):
+class OutlineListSerializer(TaggedListSerializer):
+    '''
+    List serializer for outlines that looks up every ``outline_structure`` on the page in the structure cache
+    at once, and builds the missing ones from one batched node query (see
+    :meth:`fiction_outlines_api.trees.StoryTree.for_outlines`) instead of one per outline.
+
+    When the outlines come with their ``characterinstance_set``, ``locationinstance_set`` and ``arc_set``
+    prefetched, ``length_estimate`` is calculated from those as well.
+    '''
+
+    def to_representation(self, data):
+        outlines = list(data.all() if isinstance(data, models.Manager) else data)
+        if 'length_estimate' in self.child.fields:
+            for outline in outlines:
+                self.prime_length_estimate(outline)
+        if 'outline_structure' in self.child.fields:
+            structure_cache = StructureCache('outline', dict((outline.pk, outline.pk) for outline in outlines),
+                                             self.context.get('tree_format'))
+            missing = [outline for outline in outlines if outline.pk not in structure_cache.hits]
+            self._context = dict(self.context, structure_cache=structure_cache,
+                                 story_trees=StoryTree.for_outlines(missing))
+        return super().to_representation(outlines)
+
+    @staticmethod
+    def prime_length_estimate(outline):
+        '''
+        Sets :attr:`fiction_outlines.models.Outline.length_estimate` from prefetched relations, using the same
+        formula as the model. Does nothing if any of them was not prefetched.
+        '''
+        prefetched = getattr(outline, '_prefetched_objects_cache', {})
+        if not all(name in prefetched for name in ('characterinstance_set', 'locationinstance_set', 'arc_set')):
+            return
+        characters = len([instance for instance in prefetched['characterinstance_set'] if
+                          instance.main_character or instance.pov_character or instance.protagonist or
+                          instance.antagonist or instance.villain])
+        locations = len(prefetched['locationinstance_set'])
+        arcs = len(prefetched['arc_set'])
+        outline.__dict__.setdefault('length_estimate', ((characters + locations) * 750) * (1.5 * arcs))
+
+
+class OutlineSerializer(SparseFieldsetsSerializerMixin, BulkTaggitSerializer, serializers.ModelSerializer):
     '''
     Serializer for Outline model.
     Also provides ``outline_structure``, which is a treebeard annotated list of story element nodes.
@@ -123,7 +424,9 @@ class OutlineSerializer(TaggitSerializer, serializers.ModelSerializer):
         Location instances associated with this outline.
     :attribute outline_structure:
         An annotated list of :class:`fiction_outlines.models.StoryElementNode` objects for visualizing the
-        tree structure.
+        tree structure, or nested nodes when the ``nested`` tree format is requested (see
+        :class:`fiction_outlines_api.mixins.TreeFormatMixin`). It is left out when the serializer context has
+        ``include_structure`` set to ``False``.
     '''
 
     length_estimate = serializers.IntegerField(read_only=True,
@@ -137,10 +440,18 @@ class OutlineSerializer(TaggitSerializer, serializers.ModelSerializer):
     outline_structure = serializers.SerializerMethodField(read_only=True,
                                                           help_text=_("Annotated list of outline items."))
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('include_structure', True):
+            del fields['outline_structure']
+        return fields
+
     def get_outline_structure(self, obj):
         '''
         Retrieves all :class:`fiction_outlines.StoryElementNode` objects associated with this outline,
-        and returns it as an annotated list that can be serialized.
+        and returns it as an annotated list that can be serialized. The result is kept in the structure cache
+        (see :mod:`fiction_outlines_api.cache`), and trees already built by :class:`OutlineListSerializer`
+        are reused.
 
         :param obj:
             The outline object this serializer represents.
@@ -148,31 +459,38 @@ class OutlineSerializer(TaggitSerializer, serializers.ModelSerializer):
         :returns: An annotated list for serialization or an empty list.
         '''
         logger.debug("Checking outline structure.")
-        if obj.story_tree_root:
-            logger.debug('Found a root node')
-            annotated_list = StoryElementNode.get_annotated_list(obj.story_tree_root)
-            logger.debug('Annotated list retrieved.')
-            if len(annotated_list) > 1:
-                # There is more than just a single root node: serialize and return.
-                annotated_list = convert_annotated_list(annotated_list, StoryElementNodeSerializer)
-                logger.debug("Returning results to field.")  # pragma: no cover
-                return annotated_list[1:]
-        return []
+        structure_cache = self.context.get('structure_cache') or StructureCache('outline', {obj.pk: obj.pk},
+                                                                                self.context.get('tree_format'))
+        if obj.pk in structure_cache.hits:
+            return structure_cache.hits[obj.pk]
+        tree = self.context.get('story_trees', {}).get(obj.pk) or StoryTree(obj)
+        annotated_list = []
+        if len(tree.nodes) > 1:
+            # There is more than just a single root node: serialize and return.
+            annotated_list = convert_tree(tree, StoryElementNodeSerializer,
+                                          context={'tree_aggregates': tree.aggregates,
+                                                   'tree_format': self.context.get('tree_format')})
+            logger.debug("Returning results to field.")  # pragma: no cover
+        structure_cache.set(obj.pk, annotated_list)
+        return annotated_list
 
     class Meta:  # pragma: no cover
         model = Outline
+        list_serializer_class = OutlineListSerializer
         fields = ('id', 'title', 'description', 'series', 'tags', 'length_estimate', 'arc_set',
                   'characterinstance_set', 'locationinstance_set', 'outline_structure')
         read_only_fields = ('id', 'length_estimate', 'arc_set', 'characterinstance_set',
                             'locationinstance_set', 'outline_structure')
 
 
-class ArcSerializer(serializers.ModelSerializer):
+class ArcSerializer(SparseFieldsetsSerializerMixin, serializers.ModelSerializer):
     '''
     Serializer for Arc model.
 
     To create an Arc, make sure to instead use the :class:`ArcCreateSerializer` and
     post it to :class:`fiction_outlines_api.views.ArcCreateView`
+
+    ``arc_structure`` is an annotated list, or nested nodes when the ``nested`` tree format is requested.
     '''
 
     outline = serializers.PrimaryKeyRelatedField(read_only=True, required=False)
@@ -180,6 +498,29 @@ class ArcSerializer(serializers.ModelSerializer):
                                                help_text=_('dict current validation errors'))
     arc_structure = serializers.SerializerMethodField(read_only=True, help_text=_('Annotated list of arc elements.'))
 
+    def to_representation(self, instance):
+        '''
+        Loads the whole arc tree in bulk before serializing, so that ``current_errors`` and ``arc_structure``
+        are both computed from it rather than from per-node queries. Both are kept in the structure cache
+        (see :mod:`fiction_outlines_api.cache`) and reused while the outline does not change.
+        '''
+        if 'arc_structure' not in self.fields and ('current_errors' not in self.fields or
+                                                   'current_errors' in instance.__dict__):
+            return super().to_representation(instance)
+        structure_cache = StructureCache('arc', {instance.pk: instance.outline_id}, self.context.get('tree_format'))
+        if instance.pk in structure_cache.hits:
+            current_errors, arc_structure = structure_cache.hits[instance.pk]
+            instance.__dict__.setdefault('current_errors', current_errors)
+            self._arc_structures = {instance.pk: arc_structure}
+            return super().to_representation(instance)
+        tree = ArcTree(instance)
+        instance.__dict__.setdefault('current_errors', tree.current_errors())
+        self._arc_trees = {instance.pk: tree}
+        data = super().to_representation(instance)
+        if 'arc_structure' in data:
+            structure_cache.set(instance.pk, (instance.current_errors, data['arc_structure']))
+        return data
+
     def get_arc_structure(self, obj):
         '''
         Fetches all the :class:`fiction_outlines.models.ArcElementNode` objects assocaited with this arc as an
@@ -191,19 +532,19 @@ class ArcSerializer(serializers.ModelSerializer):
         :returns: An annotated list ready to be serialized or an empty list.
         '''
         logger.debug("Attempting to retrieve arc structure for arc %s" % obj.pk)
-        if obj.arc_root_node:
-            annotated_list = ArcElementNode.get_annotated_list(obj.arc_root_node)
-            logger.debug("Retrieved annotated list")
-            if len(annotated_list) > 1:
-                # There is more than just a root node which we don't want to display to users.
-                logger.debug("Arc structure found, builidng serialized structure.")
-                annotated_list = convert_annotated_list(annotated_list, ArcElementNodeSerializer)
-                logger.debug("Success serializing arc!")
-                logger.debug("Arc looks like this:\n\n%s" % annotated_list[1:])
-                logger.debug("Returning result to field.")
-                return annotated_list[1:]
-            else:
-                logger.debug("Only a root node... returning empty list.")
+        cached_structures = getattr(self, '_arc_structures', {})
+        if obj.pk in cached_structures:
+            return cached_structures.pop(obj.pk)
+        tree = getattr(self, '_arc_trees', {}).pop(obj.pk, None) or ArcTree(obj)
+        if len(tree.nodes) > 1:
+            # There is more than just a root node which we don't want to display to users.
+            logger.debug("Arc structure found, builidng serialized structure.")
+            annotated_list = convert_tree(tree, ArcElementNodeSerializer,
+                                          context={'tree_format': self.context.get('tree_format')})
+            logger.debug("Success serializing arc!")
+            logger.debug("Returning result to field.")
+            return annotated_list
+        logger.debug("Only a root node... returning empty list.")
         return []  # pragma: no cover This is really unlikely to occur.
 
     class Meta:  # pragma: no cover
@@ -220,7 +561,7 @@ class ArcCreateSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=255)
 
 
-class ArcElementNodeSerializer(serializers.ModelSerializer):
+class ArcElementNodeSerializer(SparseFieldsetsSerializerMixin, serializers.ModelSerializer):
     '''
     Serializer for ArcElementNode.
 
@@ -252,26 +593,92 @@ class ArcElementNodeSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'arc', 'headline', 'milestone_seq', 'is_milestone', 'parent_outline')
 
 
-class StoryElementNodeSerializer(serializers.ModelSerializer):
+class NodeMoveSerializer(serializers.Serializer):
+    '''
+    One operation of a bulk move, see :class:`fiction_outlines_api.mixins.NodeBulkMoveMixin`.
+    '''
+    node = serializers.UUIDField()
+    target = serializers.UUIDField()
+    position = serializers.CharField()
+
+
+class OutlineCloneSerializer(serializers.Serializer):
+    '''
+    Options of an outline copy, see :class:`fiction_outlines_api.views.OutlineCloneView`.
+    '''
+    title = serializers.CharField(max_length=255, required=False,
+                                  help_text=_('Title of the copy. Defaults to the title of the original.'))
+
+
+class StoryElementNodeSerializer(SparseFieldsetsSerializerMixin, serializers.ModelSerializer):
     '''
     Serializer for StoryElementNode
 
-    Two special fields here:
+    Three special fields here, all of which can be precomputed by a tree builder:
 
     :attribute all_characters:
         All characters associated with this node or its descendants.
     :attribute all_locations:
         All locations associated with this node of its descendants.
+    :attribute impact_rating:
+        The impact rating of this node.
     '''
 
-    all_characters = CharacterInstanceSerializer(many=True, read_only=True, required=False,
+    all_characters = TreeAggregateListSerializer(child=CharacterInstanceSerializer(), read_only=True, required=False,
                                                  help_text=_('All characters associated with this node its descendants.'))  # noqa: E501
-    all_locations = LocationInstanceSerializer(many=True, read_only=True, required=False,
-                                               help_text=_('All locations associated with this node or its descendants.'))  # noqa: E501
+    all_locations = TreeAggregateListSerializer(child=LocationInstanceSerializer(), read_only=True, required=False,
+                                                help_text=_('All locations associated with this node or its descendants.'))  # noqa: E501
+    impact_rating = TreeAggregateField(required=False)
+
     outline = serializers.PrimaryKeyRelatedField(read_only=True, required=False)
 
+    def to_representation(self, instance):
+        '''
+        When serializing a single node, the aggregates for it are computed from its subtree in bulk
+        unless they were already provided in the context, or none of them is requested.
+        '''
+        if (self.parent is None and instance.pk not in self.context.get('tree_aggregates', {}) and
+                self.fields.keys() & {'all_characters', 'all_locations', 'impact_rating'}):
+            tree = StoryTree(node=instance)
+            self._context = dict(self.context, tree_aggregates=tree.aggregates)
+        return super().to_representation(instance)
+
     class Meta:  # pragma: no cover
         model = StoryElementNode
         fields = ('id', 'story_element_type', 'name', 'description', 'outline', 'assoc_characters',
                   'assoc_locations', 'all_characters', 'all_locations', 'impact_rating')
         read_only_fields = ('all_characters', 'all_locations', 'impact_rating', 'outline', 'id')
+
+
+class StoryTreeNodeSerializer(StoryElementNodeSerializer):
+    '''
+    Read-only serializer for the nodes of a subtree. Adds ``depth`` and ``numchild`` so that clients can tell
+    which nodes have children that were left out by ``max_depth``, and fetch them later.
+    '''
+
+    class Meta(StoryElementNodeSerializer.Meta):  # pragma: no cover
+        fields = StoryElementNodeSerializer.Meta.fields + ('depth', 'numchild')
+        read_only_fields = fields
+
+
+class StorySubtreeSerializer(serializers.BaseSerializer):
+    '''
+    Read-only serializer for a :class:`fiction_outlines.models.StoryElementNode` and its descendants, as an
+    annotated list or as nested nodes depending on ``tree_format`` in the context.
+
+    The subtree is loaded with a single path prefix query (see :class:`fiction_outlines_api.trees.StoryTree`).
+    When the context has ``max_depth``, only the nodes at most that many levels below the requested one are
+    rendered. The aggregates of the rendered nodes still cover all their descendants.
+
+    ``fields`` and ``omit`` in the context apply to every node.
+    '''
+
+    def to_representation(self, instance):
+        tree = StoryTree(node=instance)
+        nodes = tree.nodes
+        max_depth = self.context.get('max_depth')
+        if max_depth is not None:
+            nodes = [node for node in nodes if node.depth - instance.depth <= max_depth]
+        context = dict((key, self.context[key]) for key in ('tree_format', 'fields', 'omit') if key in self.context)
+        context['tree_aggregates'] = tree.aggregates
+        return convert_nodes(nodes, StoryTreeNodeSerializer, context=context)
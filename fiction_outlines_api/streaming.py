@@ -0,0 +1,176 @@
+'''
+Streaming JSON for large outlines and arcs.
+
+The regular responses build the whole body in memory as nested dicts before rendering it. The generators in
+this module first load the structure of a tree without its text fields (see ``deferred_fields`` in
+:mod:`fiction_outlines_api.trees`) and compute everything that depends on the whole tree from it. The complete
+rows are then pulled from a chunked queryset iterator and each node is rendered as soon as it is read, so only
+one chunk of complete rows is held in memory at a time.
+
+The output parses to the same JSON as the regular responses. Streamed structures bypass the structure cache,
+since caching them would mean holding them in memory.
+'''
+import json
+import logging
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+from fiction_outlines.models import StoryElementNode, ArcElementNode
+from .serializers import OutlineSerializer, OutlineListSerializer, ArcSerializer
+from .serializers import StoryElementNodeSerializer, ArcElementNodeSerializer, CompiledSerializer
+from .trees import StoryTree, ArcTree, iter_annotated_nodes
+
+logger = logging.getLogger('fiction-outlines-api')
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+class LightStoryTree(StoryTree):
+    '''
+    A :class:`fiction_outlines_api.trees.StoryTree` without the text of the nodes.
+    '''
+    deferred_fields = ('name', 'description')
+
+
+class LightArcTree(ArcTree):
+    '''
+    An :class:`fiction_outlines_api.trees.ArcTree` without the text of the nodes.
+    '''
+    deferred_fields = ('headline', 'description')
+
+
+def encode(data):
+    '''
+    Encodes data the same way as the JSON renderer of rest framework.
+    '''
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=not api_settings.UNICODE_JSON,
+                      allow_nan=not api_settings.STRICT_JSON,
+                      separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '))
+
+
+def iter_full_rows(light_nodes, queryset, chunk_size=DEFAULT_CHUNK_SIZE, **attributes):
+    '''
+    Pulls the complete rows of a light tree from a chunked iterator in path order, with the relations that were
+    prefetched for the light nodes attached. Rows that are not part of the light tree are skipped, so that both
+    passes agree on the nodes.
+
+    :param attributes:
+        Extra attributes to set on every row, e.g. a shared ``arc`` instance.
+    '''
+    light_nodes = dict((node.pk, node) for node in light_nodes)
+    for row in queryset.order_by('path').iterator(chunk_size=chunk_size):
+        light_node = light_nodes.get(row.pk)
+        if light_node is None:
+            continue
+        row._prefetched_objects_cache = getattr(light_node, '_prefetched_objects_cache', {})
+        for name, value in attributes.items():
+            setattr(row, name, value)
+        yield row
+
+
+def iter_annotated_list(nodes, serializer):
+    '''
+    Renders a path ordered iterable of nodes as the JSON of an annotated list, leaving out the first node.
+    '''
+    yield '['
+    for index, (node, info) in enumerate(iter_annotated_nodes(nodes)):
+        if index:
+            yield (',' if index > 1 else '') + encode([serializer.to_representation(node), info])
+    yield ']'
+
+
+def iter_nested_tree(nodes, serializer):
+    '''
+    Renders a path ordered iterable of nodes as the JSON of nested nodes, leaving out the first node.
+    '''
+    yield '['
+    open_depths = []
+    first_child = True
+    for index, node in enumerate(nodes):
+        if not index:
+            continue
+        depth = node.get_depth()
+        while open_depths and open_depths[-1] >= depth:
+            open_depths.pop()
+            first_child = False
+            yield ']}'
+        node_json = encode(serializer.to_representation(node))
+        yield ('' if first_child else ',') + node_json[:-1] + (',' if len(node_json) > 2 else '') + '"children":['
+        first_child = True
+        open_depths.append(depth)
+    yield ']}' * len(open_depths)
+    yield ']'
+
+
+def iter_structure(nodes, serializer, tree_format=None):
+    if tree_format == 'nested':
+        return iter_nested_tree(nodes, serializer)
+    return iter_annotated_list(nodes, serializer)
+
+
+def iter_with_structure(data, field_name, structure):
+    '''
+    Renders a serialized object with one more field, whose JSON comes from the ``structure`` iterable.
+    '''
+    data = encode(data)
+    yield data[:-1] + (',' if len(data) > 2 else '') + encode(field_name) + ':'
+    yield from structure
+    yield '}'
+
+
+def iter_outline(outline, context=None, chunk_size=DEFAULT_CHUNK_SIZE, tree=None):
+    '''
+    Renders an outline like :class:`fiction_outlines_api.serializers.OutlineSerializer` does, streaming its
+    ``outline_structure``.
+
+    :param tree:
+        A :class:`LightStoryTree` already loaded for the outline.
+    '''
+    context = context or {}
+    if 'outline_structure' not in OutlineSerializer(context=context).fields:
+        yield encode(OutlineSerializer(outline, context=context).data)
+        return
+    data = OutlineSerializer(outline, context=dict(context, omit=set(context.get('omit', ())) | {'outline_structure'}))
+    tree = tree or LightStoryTree(outline)
+    node_serializer = CompiledSerializer(StoryElementNodeSerializer, {'tree_aggregates': tree.aggregates})
+    rows = iter_full_rows(tree.nodes, StoryElementNode.objects.filter(outline=outline), chunk_size)
+    logger.debug('Streaming %d nodes of outline %s' % (len(tree.nodes), outline.pk))
+    yield from iter_with_structure(data.data, 'outline_structure',
+                                   iter_structure(rows, node_serializer, context.get('tree_format')))
+
+
+def iter_outlines(outlines, context=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Renders a list of outlines like :class:`fiction_outlines_api.serializers.OutlineListSerializer` does.
+    The light trees of all the outlines are loaded at once, the complete rows one outline at a time.
+    '''
+    context = context or {}
+    outlines = list(outlines)
+    trees = {}
+    if 'outline_structure' in OutlineSerializer(context=context).fields:
+        trees = LightStoryTree.for_outlines(outlines)
+    yield '['
+    for index, outline in enumerate(outlines):
+        OutlineListSerializer.prime_length_estimate(outline)
+        if index:
+            yield ','
+        yield from iter_outline(outline, context, chunk_size, trees.get(outline.pk))
+    yield ']'
+
+
+def iter_arc(arc, context=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Renders an arc like :class:`fiction_outlines_api.serializers.ArcSerializer` does, streaming its
+    ``arc_structure``.
+    '''
+    context = context or {}
+    if 'arc_structure' not in ArcSerializer(context=context).fields:
+        yield encode(ArcSerializer(arc, context=context).data)
+        return
+    tree = LightArcTree(arc)
+    arc.__dict__.setdefault('current_errors', tree.current_errors())
+    data = ArcSerializer(arc, context=dict(context, omit=set(context.get('omit', ())) | {'arc_structure'}))
+    node_serializer = CompiledSerializer(ArcElementNodeSerializer)
+    rows = iter_full_rows(tree.nodes, ArcElementNode.objects.filter(arc=arc), chunk_size, arc=arc)
+    logger.debug('Streaming %d nodes of arc %s' % (len(tree.nodes), arc.pk))
+    yield from iter_with_structure(data.data, 'arc_structure',
+                                   iter_structure(rows, node_serializer, context.get('tree_format')))
@@ -0,0 +1,76 @@
+'''
+Batched tag reads and writes for the serializers that use ``TagListSerializerField``.
+
+Reads go through ``prefetch_related``, which loads the tags of a whole page of objects in one query (see
+:class:`fiction_outlines_api.serializers.TaggedListSerializer`). Writes go through :func:`set_tags`, which
+replaces the tags of an object with a fixed number of queries instead of the two or more per tag of
+``TaggableManager.set``.
+'''
+import logging
+from django.conf import settings
+from django.db import router
+from django.db.models.signals import m2m_changed
+
+logger = logging.getLogger('fiction-outlines-api')
+
+
+def get_or_create_tags(tag_model, names, using):
+    '''
+    Returns the tags with the given names, creating the missing ones in bulk.
+
+    Tags whose slug is already taken by another tag are created one at a time, so that the tag model can
+    pick a free slug for them.
+    '''
+    manager = tag_model._default_manager.using(using)
+    tags = list(manager.filter(name__in=names))
+    missing = set(names) - set(tag.name for tag in tags)
+    if not missing:
+        return tags
+    logger.debug('Creating %d tags' % len(missing))
+    manager.bulk_create([tag_model(name=name, slug=tag_model().slugify(name)) for name in missing],
+                        ignore_conflicts=True)
+    tags.extend(manager.filter(name__in=missing))
+    for name in missing - set(tag.name for tag in tags):
+        tags.append(manager.get_or_create(name=name)[0])
+    return tags
+
+
+def send_m2m_changed(manager, action, pk_set, using):
+    m2m_changed.send(sender=manager.through, action=action, instance=manager.instance, reverse=False,
+                     model=manager.through.tag_model(), pk_set=pk_set, using=using)
+
+
+def set_tags(manager, names):
+    '''
+    Replaces the tags of an object with the given names, like ``TaggableManager.set``. Tags that are kept
+    are not touched, and ``m2m_changed`` is sent for the removed and the added tags as usual.
+
+    With ``TAGGIT_CASE_INSENSITIVE`` the names have to be matched one by one, so this falls back to
+    ``TaggableManager.set``.
+
+    :param manager:
+        The tag manager of the object, e.g. ``outline.tags``.
+    :param names:
+        An iterable of tag names.
+    '''
+    names = set(names)
+    if getattr(settings, 'TAGGIT_CASE_INSENSITIVE', False):
+        manager.set(names)
+        return
+    through = manager.through
+    using = router.db_for_write(through, instance=manager.instance)
+    lookup = through.lookup_kwargs(manager.instance)
+    items = through._default_manager.using(using).filter(**lookup)
+    current = dict(items.values_list('tag__name', 'tag_id'))
+    removed = set(tag_id for name, tag_id in current.items() if name not in names)
+    if removed:
+        send_m2m_changed(manager, 'pre_remove', removed, using)
+        items.filter(tag_id__in=removed).delete()
+        send_m2m_changed(manager, 'post_remove', removed, using)
+    added = names - set(current)
+    if added:
+        tags = get_or_create_tags(through.tag_model(), added, using)
+        added_ids = set(tag.pk for tag in tags)
+        send_m2m_changed(manager, 'pre_add', added_ids, using)
+        through._default_manager.using(using).bulk_create([through(tag=tag, **lookup) for tag in tags])
+        send_m2m_changed(manager, 'post_add', added_ids, using)
@@ -0,0 +1,405 @@
+'''
+Bulk builders for the story and arc trees.
+
+Treebeard and the ``fiction_outlines`` models look up related data one node at a time, which is fine for a
+single node but gets very expensive once a whole tree is serialized. The builders in this module fetch every
+node of a tree in path order with a single query, load the related rows in bulk, and compute the per-node
+values the serializers need in memory.
+'''
+import logging
+from django.db.models import Prefetch, Q
+from django.utils.translation import gettext
+from fiction_outlines.models import StoryElementNode, ArcElementNode, CharacterInstance, LocationInstance
+from fiction_outlines.models import ARC_NODE_ELEMENT_DEFINITIONS
+
+logger = logging.getLogger('fiction-outlines-api')
+
+# Mirrors the values used by :meth:`fiction_outlines.models.StoryElementNode.impact_rating`.
+IMPACT_VALUES = {
+    'base': 0.5,
+    'mile': 2,
+    'beat': 0.5,
+    'tf': 0.5,
+    'mile_child': 0.5,
+    'same_mile': 2.5,
+}
+
+IMPACT_BLEED = {
+    'mile': 0.5,
+    'tf_beat': 0.25,
+}
+
+
+def annotate_nodes(nodes):
+    '''
+    Builds a treebeard style annotated list from a list of nodes that is already in path order.
+
+    :param nodes:
+        A path ordered list of tree nodes.
+
+    :returns: A list of ``(node, info)`` tuples, identical to what ``get_annotated_list`` would return.
+    '''
+    if not nodes:
+        return []
+    return nodes[0].__class__.get_annotated_list_qs(nodes)
+
+
+def iter_annotated_nodes(nodes):
+    '''
+    Lazy version of :func:`annotate_nodes` for an iterable of nodes in path order, such as a queryset iterator.
+    Each node is yielded once the next one has been read, as that is what its ``close`` levels depend on.
+
+    :returns: A generator of ``(node, info)`` tuples, identical to what ``get_annotated_list`` would return.
+    '''
+    start_depth = previous = None
+    for node in nodes:
+        depth = node.get_depth()
+        if previous is None:
+            start_depth = depth
+        else:
+            previous_node, info = previous
+            if depth < previous_node.get_depth():
+                info['close'] = list(range(0, previous_node.get_depth() - depth))
+            yield previous
+        open = previous is None or depth > previous[0].get_depth()
+        previous = (node, {'open': open, 'close': [], 'level': depth - start_depth})
+    if previous is not None:
+        previous[1]['close'] = list(range(0, previous[0].get_depth() - start_depth + 1))
+        yield previous
+
+
+def local_impact_rating(arc_elements):
+    '''
+    Calculates the local impact of a story node from the arc elements attached to it. This is the in-memory
+    equivalent of :meth:`fiction_outlines.models.StoryElementNode._local_impact_rating`.
+
+    :param arc_elements:
+        A list of ``(arc_element_type, parent_arc_element_type)`` tuples for the arc elements linked to the node.
+
+    :returns: A tuple of ``(base_impact, add_impact, mile_impact)``
+    '''
+    base_impact = IMPACT_VALUES['base']
+    add_impact = 0
+    mile_impact = 0
+    arc_element_types = dict.fromkeys(ARC_NODE_ELEMENT_DEFINITIONS.keys(), 0)
+    for element_type, parent_type in arc_elements:
+        arc_element_types[element_type] += 1
+        if ARC_NODE_ELEMENT_DEFINITIONS[element_type]['milestone']:
+            mile_impact += IMPACT_VALUES['mile']
+        else:
+            if parent_type and ARC_NODE_ELEMENT_DEFINITIONS[parent_type]['milestone']:
+                add_impact += IMPACT_VALUES['mile_child']
+            if element_type == 'beat':
+                add_impact += IMPACT_VALUES['beat']
+            if element_type == 'tf':
+                add_impact += IMPACT_VALUES['tf']
+    for key, value in arc_element_types.items():
+        if ARC_NODE_ELEMENT_DEFINITIONS[key]['milestone'] and value > 1:
+            add_impact += (value - 1) * .5
+    return base_impact, add_impact, mile_impact
+
+
+def impact_bleed(add_impact, mile_impact, depth_diff):
+    '''
+    How much of a related node's impact carries over to a node ``depth_diff`` generations away.
+    '''
+    return (add_impact * IMPACT_BLEED['tf_beat'] ** depth_diff) + (mile_impact * IMPACT_BLEED['mile'] ** depth_diff)
+
+
+class DescendantAggregator(object):
+    '''
+    Computes the union of related objects over each node and all of its descendants.
+
+    Rather than walking the descendants of every node, which is O(n²) over a whole tree, the aggregator makes a
+    single bottom-up pass over a path ordered list of nodes: each node merges its own objects with the already
+    aggregated objects of its children and hands the result to its parent.
+
+    :param getters:
+        Keyword arguments of ``name=callable``, where the callable takes a node and returns an iterable of the
+        objects to aggregate under ``name``.
+    '''
+
+    def __init__(self, **getters):
+        self.getters = getters
+
+    def aggregate(self, nodes):
+        '''
+        :param nodes:
+            A path ordered list of nodes. Descendants of a node that are missing from the list are ignored.
+
+        :returns: A dict of node pk -> dict of name -> list of aggregated objects, ordered by pk.
+        '''
+        aggregates = {}
+        pending = {}
+        for node in reversed(nodes):
+            collected = pending.pop(node.path, None) or dict((name, {}) for name in self.getters)
+            for name, getter in self.getters.items():
+                for obj in getter(node):
+                    collected[name][obj.pk] = obj
+            aggregates[node.pk] = dict((name, [objects[pk] for pk in sorted(objects)])
+                                       for name, objects in collected.items())
+            parent_path = node.path[:-node.steplen]
+            if parent_path in pending:
+                for name, objects in collected.items():
+                    pending[parent_path][name].update(objects)
+            else:
+                pending[parent_path] = collected
+        return aggregates
+
+
+class StoryTree(object):
+    '''
+    A story tree loaded in a fixed number of queries regardless of its size. Either the complete tree of an
+    outline, or the subtree of a single node.
+
+    :attribute outline:
+        The :class:`fiction_outlines.models.Outline` the tree belongs to, if loading the whole tree.
+    :attribute node:
+        The :class:`fiction_outlines.models.StoryElementNode` at the top of the subtree, if loading a subtree.
+    :attribute nodes:
+        The :class:`fiction_outlines.models.StoryElementNode` objects of the tree in path order.
+    :attribute ancestors:
+        When loading a subtree, the ancestors of its top node in path order. They are only needed to calculate
+        the impact rating.
+    :attribute aggregates:
+        A dict keyed by node pk of the values that would otherwise be computed by each node with additional
+        queries: ``all_characters``, ``all_locations`` and ``impact_rating``.
+    :attribute deferred_fields:
+        Fields left out of the node query, for callers that only need the structure and load the rest later.
+    '''
+    deferred_fields = ()
+    descendant_aggregator = DescendantAggregator(
+        all_characters=lambda node: node.assoc_characters.all(),
+        all_locations=lambda node: node.assoc_locations.all(),
+    )
+
+    def __init__(self, outline=None, node=None, nodes=None, arc_elements=None):
+        self.outline = outline
+        self.node = node
+        if nodes is None:
+            nodes = list(self.get_queryset(self.get_node_filter()))
+        if node is None:
+            self.ancestors = []
+            self.nodes = nodes
+        else:
+            self.ancestors = [ancestor for ancestor in nodes if len(ancestor.path) < len(node.path)]
+            self.nodes = nodes[len(self.ancestors):]
+        logger.debug('Loaded %d story nodes and %d ancestors' % (len(self.nodes), len(self.ancestors)))
+        if arc_elements is None and self.nodes:
+            arc_elements = self.get_arc_elements(self.get_node_filter('story_element_node__'))
+        self.aggregates = self.build_aggregates(arc_elements)
+
+    @classmethod
+    def for_outlines(cls, outlines):
+        '''
+        Builds the trees of several outlines at once, using the same number of queries as a single tree.
+
+        :param outlines:
+            An iterable of :class:`fiction_outlines.models.Outline` objects.
+
+        :returns: A dict of outline pk -> :class:`StoryTree`
+        '''
+        outlines = list(outlines)
+        if not outlines:
+            return {}
+        nodes_by_outline = {}
+        for node in cls.get_queryset(Q(outline__in=outlines)):
+            nodes_by_outline.setdefault(node.outline_id, []).append(node)
+        arc_elements = cls.get_arc_elements(Q(story_element_node__outline__in=outlines))
+        return dict((outline.pk, cls(outline, nodes=nodes_by_outline.get(outline.pk, []), arc_elements=arc_elements))
+                    for outline in outlines)
+
+    def get_node_filter(self, prefix=''):
+        '''
+        The filter selecting the nodes of this tree, including the ancestors of a subtree.
+
+        :param prefix:
+            Prefix for the lookups, to apply the filter through a relation.
+        '''
+        if self.node is None:
+            return Q(**{prefix + 'outline': self.outline})
+        steplen = StoryElementNode.steplen
+        ancestor_paths = [self.node.path[:x] for x in range(steplen, len(self.node.path), steplen)]
+        return Q(**{prefix + 'path__startswith': self.node.path}) | Q(**{prefix + 'path__in': ancestor_paths})
+
+    @classmethod
+    def get_queryset(cls, node_filter):
+        '''
+        The single query used to load the nodes, with their associated instances prefetched.
+        '''
+        return StoryElementNode.objects.filter(node_filter).order_by('path').defer(
+            *cls.deferred_fields
+        ).prefetch_related(
+            Prefetch('assoc_characters', queryset=CharacterInstance.objects.select_related('character')),
+            Prefetch('assoc_locations', queryset=LocationInstance.objects.select_related('location')),
+        )
+
+    def annotated_list(self):
+        '''
+        :returns: The annotated list for the tree, its top node included.
+        '''
+        return annotate_nodes(self.nodes)
+
+    @classmethod
+    def get_arc_elements(cls, arc_element_filter):
+        '''
+        Fetches the type of every matching arc element linked to a story node, along with the type of its parent
+        for those that need it.
+
+        :returns: A dict of story node pk -> list of ``(arc_element_type, parent_arc_element_type)`` tuples.
+        '''
+        elements = list(ArcElementNode.objects.filter(arc_element_filter).values_list(
+            'story_element_node_id', 'arc_element_type', 'path'))
+        steplen = ArcElementNode.steplen
+        parent_paths = set(path[:-steplen] for node_id, element_type, path in elements
+                           if not ARC_NODE_ELEMENT_DEFINITIONS[element_type]['milestone'])
+        parent_types = {}
+        if parent_paths:
+            parent_types = dict(ArcElementNode.objects.filter(path__in=parent_paths).values_list(
+                'path', 'arc_element_type'))
+        arc_elements = {}
+        for node_id, element_type, path in elements:
+            arc_elements.setdefault(node_id, []).append((element_type, parent_types.get(path[:-steplen])))
+        return arc_elements
+
+    def build_impact_ratings(self, arc_elements):
+        '''
+        Calculates the impact rating of every node in a single pass, see
+        :meth:`fiction_outlines.models.StoryElementNode.impact_rating`.
+
+        :param arc_elements:
+            The arc elements linked to the nodes, as returned by :meth:`get_arc_elements`.
+
+        :returns: A dict of node pk -> impact rating.
+        '''
+        nodes = self.ancestors + self.nodes
+        local_impacts = {}
+        inherited_impacts = {}
+        open_nodes = []
+        for node in nodes:
+            while open_nodes and not node.path.startswith(open_nodes[-1].path):
+                open_nodes.pop()
+            local_impacts[node.pk] = local_impact_rating(arc_elements.get(node.pk, []))
+            inherited_impacts[node.pk] = 0
+            # Whatever is left open at this point are the ancestors of the node, so every ancestor/descendant
+            # pair is visited exactly once, from the descendant's side.
+            for ancestor in [open_node for open_node in open_nodes if open_node.depth > 1]:
+                depth_diff = node.depth - ancestor.depth
+                base, add, mile = local_impacts[ancestor.pk]
+                if (add + mile) > 0:
+                    inherited_impacts[node.pk] += impact_bleed(add, mile, depth_diff)
+                base, add, mile = local_impacts[node.pk]
+                if (add + mile) > 0:
+                    inherited_impacts[ancestor.pk] += impact_bleed(add, mile, depth_diff)
+            open_nodes.append(node)
+        impact_ratings = {}
+        for node in self.nodes:
+            if node.depth == 1:
+                impact_ratings[node.pk] = 0
+            else:
+                base, add, mile = local_impacts[node.pk]
+                impact_ratings[node.pk] = base + add + mile + inherited_impacts[node.pk]
+        return impact_ratings
+
+    def build_aggregates(self, arc_elements):
+        '''
+        Computes ``all_characters``, ``all_locations`` and ``impact_rating`` for every node in the tree.
+        '''
+        if not self.nodes:
+            return {}
+        aggregates = self.descendant_aggregator.aggregate(self.nodes)
+        for pk, impact_rating in self.build_impact_ratings(arc_elements).items():
+            aggregates[pk]['impact_rating'] = impact_rating
+        return aggregates
+
+
+class ArcTree(object):
+    '''
+    The complete element tree of an arc, loaded in a fixed number of queries regardless of its size.
+
+    :attribute arc:
+        The :class:`fiction_outlines.models.Arc` the tree belongs to.
+    :attribute nodes:
+        All :class:`fiction_outlines.models.ArcElementNode` objects of the arc in path order, each sharing the
+        ``arc`` instance so that following ``node.arc.outline`` costs no extra queries.
+    :attribute deferred_fields:
+        Fields left out of the node query, for callers that only need the structure and load the rest later.
+    '''
+
+    deferred_fields = ()
+
+    def __init__(self, arc):
+        self.arc = arc
+        self.nodes = list(self.get_queryset())
+        for node in self.nodes:
+            node.arc = arc
+        logger.debug('Loaded %d arc nodes for arc %s' % (len(self.nodes), arc.pk))
+
+    def get_queryset(self):
+        '''
+        The single query used to load the nodes. Only the keys of the associated instances are needed.
+        '''
+        return ArcElementNode.objects.filter(arc=self.arc).order_by('path').defer(
+            *self.deferred_fields
+        ).prefetch_related(
+            Prefetch('assoc_characters', queryset=CharacterInstance.objects.only('id')),
+            Prefetch('assoc_locations', queryset=LocationInstance.objects.only('id')),
+        )
+
+    def annotated_list(self):
+        '''
+        :returns: The annotated list for the whole tree, root included.
+        '''
+        return annotate_nodes(self.nodes)
+
+    @property
+    def root(self):
+        return self.nodes[0] if self.nodes else None
+
+    def get_children(self, node):
+        '''
+        :returns: The children of a node in path order.
+        '''
+        return [child for child in self.nodes if child.depth == node.depth + 1 and child.path.startswith(node.path)]
+
+    def validate_generations(self):
+        '''
+        In-memory equivalent of :meth:`fiction_outlines.models.Arc.validate_generations`.
+
+        :returns: The error message for the first invalid node found, or ``None``.
+        '''
+        nodes_by_path = dict((node.path, node) for node in self.nodes)
+        for node in self.nodes[1:]:
+            parent = nodes_by_path[node.path[:-node.steplen]]
+            if 'mile' in node.arc_element_type and parent.get_depth() > 1:
+                return gettext("Milestones cannot be descendants of anything besides the root!")
+            if (parent.get_depth() > 1 and
+                parent.arc_element_type not in ARC_NODE_ELEMENT_DEFINITIONS[node.arc_element_type]['allowed_parents']):
+                return gettext("Node %s cannot be a descendant of node %s" % (node, parent))
+        return None
+
+    def current_errors(self):
+        '''
+        In-memory equivalent of :meth:`fiction_outlines.models.Arc.fetch_arc_errors`, which runs several queries
+        per node.
+
+        :returns: A list of errors, in the same format as ``Arc.current_errors``.
+        '''
+        error_list = []
+        if not self.root:
+            return error_list
+        children = self.get_children(self.root)
+        if children and children[0].arc_element_type != 'mile_hook':
+            error_list.append({'hook_error': children[0]})
+        if children and children[-1].arc_element_type != 'mile_reso':
+            error_list.append({'reso_error': children[-1]})
+        generation_error = self.validate_generations()
+        if generation_error:
+            error_list.append({'generation_error': generation_error})
+        current_cursor = 0
+        for mile in [child for child in children if 'mile' in child.arc_element_type]:
+            if mile.milestone_seq < current_cursor:
+                error_list.append({'mseq_error': mile})
+                break
+            current_cursor = mile.milestone_seq
+        return error_list
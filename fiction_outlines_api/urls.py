@@ -21,17 +21,28 @@ urlpatterns = [
     path('location/<uuid:location>/instance/<uuid:instance>/', views.LocationInstanceDetailView.as_view(),
          name='location_instance_item'),
     path('outlines/', views.OutlineList.as_view(), name='outline_listcreate'),
+    path('outlines/import/', views.OutlineImportView.as_view(), name='outline_import'),
     path('outline/<uuid:outline>/', views.OutlineDetail.as_view(), name='outline_item'),
+    path('outline/<uuid:outline>/export/', views.OutlineExportView.as_view(), name='outline_export'),
+    path('outline/<uuid:outline>/clone/', views.OutlineCloneView.as_view(), name='outline_clone'),
     path('outline/<uuid:outline>/createarc/', views.ArcCreateView.as_view(), name='arc_create'),
     path('outline/<uuid:outline>/arc/<uuid:arc>/', views.ArcDetailView.as_view(), name='arc_item'),
     path('outline/<uuid:outline>/item/<uuid:storynode>/', views.StoryNodeDetailView.as_view(),
          name='storynode_item'),
+    path('outline/<uuid:outline>/item/<uuid:storynode>/tree/', views.StoryNodeTreeView.as_view(),
+         name='storynode_tree'),
     path('storynode/move/<uuid:node_to_move_id>/<uuid:target_node_id>/<position>/', views.StoryNodeMoveView.as_view(),
          name='storynode_move'),
+    path('storynode/move/', views.StoryNodeBulkMoveView.as_view(), name='storynode_bulk_move'),
+    path('storynode/<uuid:storynode>/bulk/<position>/', views.StoryNodeBulkCreateView.as_view(),
+         name='storynode_bulk_create'),
     path('storynode/<uuid:storynode>/<action>/<position>/',
          views.StoryNodeCreateView.as_view(), name='storynode_create'),
     path('arcnode/move/<uuid:node_to_move_id>/<uuid:target_node_id>/<position>/',
          views.ArcNodeMoveView.as_view(), name='arcnode_move'),
+    path('arcnode/move/', views.ArcNodeBulkMoveView.as_view(), name='arcnode_bulk_move'),
+    path('arcnode/<uuid:arcnode>/bulk/<position>/', views.ArcNodeBulkCreateView.as_view(),
+         name='arcnode_bulk_create'),
     path('arcnode/<uuid:arcnode>/<action>/', views.ArcNodeCreateView.as_view(), name='arcnode_create_default'),
     path('arcnode/<uuid:arcnode>/<action>/<position>/', views.ArcNodeCreateView.as_view(), name='arcnode_create'),
     path('outline/<uuid:outline>/arc/<uuid:arc>/item/<uuid:arcnode>', views.ArcNodeDetailView.as_view(),
@@ -1,11 +1,12 @@
 import logging
 from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from django.db.models import Prefetch
 from django.utils.translation import gettext_lazy as _
 from rest_framework.generics import get_object_or_404
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied, ParseError
-from rest_framework_rules.mixins import PermissionRequiredMixin
+from rest_framework.exceptions import ParseError, ValidationError
 from fiction_outlines.models import Series, Character, Location, Outline, Arc
 from fiction_outlines.models import CharacterInstance, LocationInstance
 from fiction_outlines.models import ArcElementNode, StoryElementNode
@@ -13,22 +14,34 @@ from fiction_outlines.signals import tree_manipulation
 from .serializers import SeriesSerializer, CharacterSerializer, LocationSerializer
 from .serializers import OutlineSerializer, ArcSerializer, ArcCreateSerializer, ArcElementNodeSerializer
 from .serializers import StoryElementNodeSerializer, CharacterInstanceSerializer, LocationInstanceSerializer
-from .mixins import NodeMoveMixin, MultiObjectPermissionsMixin, NodeAddMixin
+from .serializers import StorySubtreeSerializer, NodeMoveSerializer, OutlineCloneSerializer
+from .mixins import NodeMoveMixin, MultiObjectPermissionsMixin, NodeAddMixin, TreeFormatMixin, NodeBulkMoveMixin
+from .mixins import ConditionalRetrieveMixin, SparseFieldsetsMixin, StreamingMixin
+from .mixins import PermissionCacheMixin, CachedPermissionRequiredMixin, NodeBulkAddMixin
+from .pagination import OptionalCursorPagination
+from .streaming import DEFAULT_CHUNK_SIZE, iter_outline, iter_outlines, iter_arc
+from .bulk import check_arc_placement, check_story_placement
+from .imports import OutlineImporter, OutlineImportError
+from .exports import iter_outline_document
+from .clones import OutlineCloner
 
 logger = logging.getLogger('fiction-outlines-api')
 
 
-class SeriesList(generics.ListCreateAPIView):
+class SeriesList(SparseFieldsetsMixin, generics.ListCreateAPIView):
     '''
     API view for series list.
 
     Provides HTTP methods:
 
     - GET: Retrive :class:`fiction_outlines.models.Series` objects for the current user.
+      Pass ``page_size`` or ``cursor`` to paginate, see
+      :class:`fiction_outlines_api.pagination.OptionalCursorPagination`.
     - POST: Accepts data compatible with a :class:`fiction_outlines_api.serializers.SeriesSerializer`
     '''
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = SeriesSerializer
+    pagination_class = OptionalCursorPagination
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -37,7 +50,7 @@ class SeriesList(generics.ListCreateAPIView):
         return Series.objects.filter(user=self.request.user)
 
 
-class SeriesDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class SeriesDetail(SparseFieldsetsMixin, CachedPermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
     '''
     Retrieves details of a series, and enables editing of the object.
 
@@ -67,31 +80,39 @@ class SeriesDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIVie
         return Series.objects.all()
 
 
-class CharacterList(generics.ListCreateAPIView):
+class CharacterList(SparseFieldsetsMixin, PermissionCacheMixin, generics.ListCreateAPIView):
     '''
     API view for character list
 
     Provies HTTP methods:
 
     - GET: Retrive a list of :class:`fiction_outlines.models.Character` objects for the current user.
+      Pass ``page_size`` or ``cursor`` to paginate, see
+      :class:`fiction_outlines_api.pagination.OptionalCursorPagination`.
     - POST: Create a character. Takes data compatible with
       :class:`fiction_outlines_api.serializers.CharacterSerializer`
     '''
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = CharacterSerializer
+    pagination_class = OptionalCursorPagination
+    field_prefetches = {
+        'series': ('series',),
+        'tags': ('tags',),
+        # CharacterInstanceSerializer renders character.name.
+        'character_instances': (
+            Prefetch('characterinstance_set', queryset=CharacterInstance.objects.select_related('character')),
+        ),
+    }
 
     def perform_create(self, serializer):
-        if serializer.validated_data['series']:
-            for series in serializer.validated_data['series']:
-                if not self.request.user.has_perm('fiction_outlines.edit_series', series):
-                    raise PermissionDenied(_('You do not have editing rights for the specified series.'))
+        self.check_series_permissions(serializer.validated_data['series'])
         serializer.save(user=self.request.user)
 
     def get_queryset(self):
-        return Character.objects.filter(user=self.request.user)
+        return Character.objects.filter(user=self.request.user).prefetch_related(*self.get_field_prefetches())
 
 
-class CharacterDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class CharacterDetail(SparseFieldsetsMixin, CachedPermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
     '''
     API view for all single item character operations besides create.
 
@@ -103,6 +124,14 @@ class CharacterDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPI
       :class:`fiction_outlines_api.serializers.CharacterSerializer`
     '''
     serializer_class = CharacterSerializer
+    field_prefetches = {
+        'series': ('series',),
+        'tags': ('tags',),
+        # CharacterInstanceSerializer renders character.name.
+        'character_instances': (
+            Prefetch('characterinstance_set', queryset=CharacterInstance.objects.select_related('character')),
+        ),
+    }
     object_permission_required = 'fiction_outlines.view_character'
     permission_classes = (permissions.IsAuthenticated,)
     permission_required = 'fiction_outlines_api.valid_user'
@@ -115,10 +144,7 @@ class CharacterDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPI
         :raises PermissionDenied: if the user does not have the required permissions.
         '''
         if 'series' in serializer.validated_data.keys():
-            if serializer.validated_data['series']:
-                for series in serializer.validated_data['series']:
-                    if not self.request.user.has_perm('fiction_outlines.edit_series', series):
-                        raise PermissionDenied(_("You do not have editing rights to the specified series."))
+            self.check_series_permissions(serializer.validated_data['series'])
         return super().perform_update(serializer)
 
     def put(self, request, *args, **kwargs):
@@ -134,10 +160,11 @@ class CharacterDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPI
         return super().delete(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Character.objects.all()
+        # The object permission rules compare character.user with the current user.
+        return Character.objects.all().select_related('user').prefetch_related(*self.get_field_prefetches())
 
 
-class CharacterInstanceCreateView(MultiObjectPermissionsMixin, PermissionRequiredMixin, generics.CreateAPIView):
+class CharacterInstanceCreateView(MultiObjectPermissionsMixin, CachedPermissionRequiredMixin, generics.CreateAPIView):
     '''
     API view for creating a character instance. Expects kwargs in url for character and
     outline. All other data comes from the serializer.
@@ -169,7 +196,8 @@ class CharacterInstanceCreateView(MultiObjectPermissionsMixin, PermissionRequire
             raise ParseError
 
 
-class CharacterInstanceDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class CharacterInstanceDetailView(SparseFieldsetsMixin, CachedPermissionRequiredMixin,
+                                  generics.RetrieveUpdateDestroyAPIView):
     '''
     API view for non-creation actions on CharacterInstance objects.
 
@@ -199,20 +227,32 @@ class CharacterInstanceDetailView(PermissionRequiredMixin, generics.RetrieveUpda
         return super().delete(request, *args, **kwargs)
 
     def get_queryset(self):
-        return CharacterInstance.objects.all()
+        # The object permission rules check character.user, and the serializer renders character.name.
+        return CharacterInstance.objects.all().select_related('character__user')
 
 
-class LocationList(generics.ListCreateAPIView):
+class LocationList(SparseFieldsetsMixin, PermissionCacheMixin, generics.ListCreateAPIView):
     '''
     API view for location list
 
     Provides HTTP methods:
 
     - GET: Retrieve a list of Locations for the current user.
+      Pass ``page_size`` or ``cursor`` to paginate, see
+      :class:`fiction_outlines_api.pagination.OptionalCursorPagination`.
     - POST: Create a location with data compatibile with :class:`fiction_outlines_api.serializers.LocationSerializer`
     '''
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = LocationSerializer
+    pagination_class = OptionalCursorPagination
+    field_prefetches = {
+        'series': ('series',),
+        'tags': ('tags',),
+        # LocationInstanceSerializer renders location.name.
+        'location_instances': (
+            Prefetch('locationinstance_set', queryset=LocationInstance.objects.select_related('location')),
+        ),
+    }
 
     def perform_create(self, serializer):
         '''
@@ -220,17 +260,14 @@ class LocationList(generics.ListCreateAPIView):
 
         :raises PermissionDenied: if the user lackst he required permissions.
         '''
-        if serializer.validated_data['series']:
-            for series in serializer.validated_data['series']:
-                if not self.request.user.has_perm('fiction_outlines.edit_series', series):
-                    raise PermissionDenied(_('You do not have editing rights for the specified series.'))
+        self.check_series_permissions(serializer.validated_data['series'])
         serializer.save(user=self.request.user)
 
     def get_queryset(self):
-        return Location.objects.filter(user=self.request.user)
+        return Location.objects.filter(user=self.request.user).prefetch_related(*self.get_field_prefetches())
 
 
-class LocationDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class LocationDetail(SparseFieldsetsMixin, CachedPermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
     '''
     API view for all single item location operations besides create.
 
@@ -242,6 +279,14 @@ class LocationDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIV
     - DELETE: Delete the object.
     '''
     serializer_class = LocationSerializer
+    field_prefetches = {
+        'series': ('series',),
+        'tags': ('tags',),
+        # LocationInstanceSerializer renders location.name.
+        'location_instances': (
+            Prefetch('locationinstance_set', queryset=LocationInstance.objects.select_related('location')),
+        ),
+    }
     object_permission_required = 'fiction_outlines.view_location'
     permission_classes = (permissions.IsAuthenticated,)
     permission_required = 'fiction_outlines_api.valid_user'
@@ -254,10 +299,7 @@ class LocationDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIV
         :raises PermissionDenied: if the user does not have the correct permissions.
         '''
         if 'series' in serializer.validated_data.keys():
-            if serializer.validated_data['series']:
-                for series in serializer.validated_data['series']:
-                    if not self.request.user.has_perm('fiction_outlines.edit_series', series):
-                        raise PermissionDenied(_("You do not have editing rights to the specified series."))
+            self.check_series_permissions(serializer.validated_data['series'])
         return super().perform_update(serializer)
 
     def put(self, request, *args, **kwargs):
@@ -273,10 +315,11 @@ class LocationDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIV
         return super().delete(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Location.objects.all()
+        # The object permission rules compare location.user with the current user.
+        return Location.objects.all().select_related('user').prefetch_related(*self.get_field_prefetches())
 
 
-class LocationInstanceCreateView(MultiObjectPermissionsMixin, PermissionRequiredMixin, generics.CreateAPIView):
+class LocationInstanceCreateView(MultiObjectPermissionsMixin, CachedPermissionRequiredMixin, generics.CreateAPIView):
     '''
     API view for creating a location instance. Expects kwargs in url for location and
     outline. All other data comes from the serializer.
@@ -308,7 +351,7 @@ class LocationInstanceCreateView(MultiObjectPermissionsMixin, PermissionRequired
             raise ParseError
 
 
-class LocationInstanceDetailView(PermissionRequiredMixin, generics.RetrieveDestroyAPIView):
+class LocationInstanceDetailView(SparseFieldsetsMixin, CachedPermissionRequiredMixin, generics.RetrieveDestroyAPIView):
     '''
     API view for non-creation actions on LocationInstance objects. As locations instances don't have
     editable data, only retrieval and destroy are supported at this time.
@@ -328,21 +371,48 @@ class LocationInstanceDetailView(PermissionRequiredMixin, generics.RetrieveDestr
         return super().delete(request, *args, **kwargs)
 
     def get_queryset(self):
-        return LocationInstance.objects.all()
+        # The object permission rules check location.user, and the serializer renders location.name.
+        return LocationInstance.objects.all().select_related('location__user')
 
 
-class OutlineList(generics.ListCreateAPIView):
+class OutlineList(SparseFieldsetsMixin, PermissionCacheMixin, StreamingMixin, TreeFormatMixin,
+                  generics.ListCreateAPIView):
     '''
     API view for Outline list
 
     Provides HTTP methods:
 
-    - GET: Retrived a list of outlines for the current user.
+    - GET: Retrived a list of outlines for the current user. The ``outline_structure`` of every outline is
+      included unless :attr:`include_structure` is ``False`` or the request has ``?structure=false``, in which
+      case it is only available from :class:`OutlineDetail`.
+      Pass ``page_size`` or ``cursor`` to paginate, see
+      :class:`fiction_outlines_api.pagination.OptionalCursorPagination`, or ``stream=true`` to stream the list,
+      see :class:`fiction_outlines_api.mixins.StreamingMixin`.
     - POST: Create a new Outline. Accepts data compatible with
       :class:`fiction_outlines_api.serializers.OutlineSerializer`
     '''
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = OutlineSerializer
+    pagination_class = OptionalCursorPagination
+    include_structure = True
+    field_prefetches = {
+        'tags': ('tags',),
+        'arc_set': ('arc_set',),
+        'characterinstance_set': ('characterinstance_set',),
+        'locationinstance_set': ('locationinstance_set',),
+        # Used to calculate length_estimate for the whole page, see OutlineListSerializer.
+        'length_estimate': ('arc_set', 'characterinstance_set', 'locationinstance_set'),
+    }
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request.method == 'GET':
+            structure = self.request.query_params.get('structure', 'true' if self.include_structure else 'false')
+            context['include_structure'] = structure.lower() not in ('false', '0', 'no')
+        return context
+
+    def stream_list(self, queryset):
+        return iter_outlines(queryset, self.get_serializer_context(), self.stream_chunk_size)
 
     def perform_create(self, serializer):
         '''
@@ -351,33 +421,62 @@ class OutlineList(generics.ListCreateAPIView):
         :raises PermissionDenied: if the user does not have the required permissions.
         '''
         if serializer.validated_data['series']:
-            if not self.request.user.has_perm('fiction_outlines.edit_series', serializer.validated_data['series']):
-                raise PermissionDenied(_('You do not have editing rights for the specified series.'))
+            self.check_series_permissions([serializer.validated_data['series']])
         serializer.save(user=self.request.user)
 
     def get_queryset(self):
         return Outline.objects.filter(
             user=self.request.user
-        ).select_related('series').prefetch_related('tags',
-                                                    'arc_set',
-                                                    'storyelementnode_set',
-                                                    'characterinstance_set',
-                                                    'locationinstance_set')
+        ).select_related('series').prefetch_related(*self.get_field_prefetches())
 
 
-class OutlineDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class OutlineImportView(CachedPermissionRequiredMixin, generics.GenericAPIView):
+    '''
+    API view for importing a whole outline with its series, characters, locations, arcs and trees.
+
+    Provides HTTP method:
+
+    - POST: Accepts a newline-delimited JSON document, see :mod:`fiction_outlines_api.imports` for the format.
+      The body is read line by line rather than parsed up front, so large documents do not have to fit in
+      memory. Responds with the id and title of the new outline and the number of imported records per type.
+    '''
+    permission_required = 'fiction_outlines_api.valid_user'
+
+    def post(self, request, *args, **kwargs):
+        if request.stream is None:
+            raise ValidationError(_('The import document is empty.'))
+        importer = OutlineImporter(request.user)
+        try:
+            outline = importer.run(request.stream)
+        except OutlineImportError as OIE:
+            logger.debug('Invalid import document: %s' % OIE)
+            raise ValidationError({'detail': OIE.message, 'line': OIE.line})
+        return Response({'id': outline.pk, 'title': outline.title, 'counts': importer.counts},
+                        status=status.HTTP_201_CREATED)
+
+
+class OutlineDetail(SparseFieldsetsMixin, StreamingMixin, ConditionalRetrieveMixin, TreeFormatMixin,
+                    CachedPermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
     '''
     API view for all single item outline operations besides create.
 
     Provides HTTP methods:
 
-    - GET: Retrieve an individual object.
+    - GET: Retrieve an individual object. Supports ``If-None-Match``, see
+      :class:`fiction_outlines_api.mixins.ConditionalRetrieveMixin`, and ``stream=true``, see
+      :class:`fiction_outlines_api.mixins.StreamingMixin`.
     - PUT: Update the object with data compatible with a :class:`fiction_outlines_api.serializers.OutlineSerializer`
     - PATCH: Update the object with partial data that corresponds to keys in the serializer.
     - DELETE: Delete the object.
     '''
     serializer_class = OutlineSerializer
     object_permission_required = 'fiction_outlines.view_outline'
+    field_prefetches = {
+        'tags': ('tags',),
+        'arc_set': ('arc_set',),
+        'characterinstance_set': ('characterinstance_set',),
+        'locationinstance_set': ('locationinstance_set',),
+    }
     permission_classes = (permissions.IsAuthenticated,)
     permission_required = 'fiction_outlines_api.valid_user'
     lookup_url_kwarg = 'outline'
@@ -388,12 +487,13 @@ class OutlineDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIVi
 
         :raises PermissionDenied: if the user lacks the needed permissions.
         '''
-        if 'series' in serializer.validated_data.keys():
-            if (serializer.validated_data['series'] and
-                not self.request.user.has_perm('fiction_outlines.edit_series', serializer.validated_data['series'])):
-                raise PermissionDenied(_("You do not have editing rights to the specified series."))
+        if serializer.validated_data.get('series'):
+            self.check_series_permissions([serializer.validated_data['series']])
         return super().perform_update(serializer)
 
+    def stream_object(self, instance):
+        return iter_outline(instance, self.get_serializer_context(), self.stream_chunk_size)
+
     def put(self, request, *args, **kwargs):
         self.object_permission_required = 'fiction_outlines.edit_outline'
         return super().put(request, *args, **kwargs)
@@ -406,15 +506,70 @@ class OutlineDetail(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIVi
         self.object_permission_required = 'fiction_outlines.delete_outline'
         return super().delete(request, *args, **kwargs)
 
+    def get_outline_id(self, obj):
+        return obj.pk
+
     def get_queryset(self):
-        return Outline.objects.all().select_related('series').prefetch_related('tags',
-                                                                               'arc_set',
-                                                                               'storyelementnode_set',
-                                                                               'characterinstance_set',
-                                                                               'locationinstance_set')
+        return Outline.objects.all().select_related('series').prefetch_related(*self.get_field_prefetches())
 
 
-class ArcCreateView(PermissionRequiredMixin, generics.CreateAPIView):
+class OutlineExportView(CachedPermissionRequiredMixin, generics.GenericAPIView):
+    '''
+    API view for exporting a whole outline with its series, characters, locations, arcs and trees.
+
+    Provides HTTP method:
+
+    - GET: Streams the outline as a newline-delimited JSON document that can be imported again, see
+      :mod:`fiction_outlines_api.exports`.
+    '''
+    permission_classes = (permissions.IsAuthenticated,)
+    permission_required = 'fiction_outlines_api.valid_user'
+    object_permission_required = 'fiction_outlines.view_outline'
+    lookup_url_kwarg = 'outline'
+    export_chunk_size = DEFAULT_CHUNK_SIZE
+
+    def get(self, request, *args, **kwargs):
+        outline = self.get_object()
+        response = StreamingHttpResponse((line.encode('utf-8') for line in
+                                          iter_outline_document(outline, self.export_chunk_size)),
+                                         content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="outline-%s.ndjson"' % outline.pk
+        return response
+
+    def get_queryset(self):
+        return Outline.objects.all().select_related('user')
+
+
+class OutlineCloneView(CachedPermissionRequiredMixin, generics.GenericAPIView):
+    '''
+    API view for copying a whole outline with its instances, arcs and trees.
+
+    Provides HTTP method:
+
+    - POST: Accepts data compatible with a :class:`fiction_outlines_api.serializers.OutlineCloneSerializer`, see
+      :mod:`fiction_outlines_api.clones`. Responds with the id and title of the copy and the number of copied
+      objects per model.
+    '''
+    serializer_class = OutlineCloneSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    permission_required = 'fiction_outlines_api.valid_user'
+    object_permission_required = 'fiction_outlines.view_outline'
+    lookup_url_kwarg = 'outline'
+
+    def post(self, request, *args, **kwargs):
+        outline = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cloner = OutlineCloner(outline)
+        clone = cloner.run(serializer.validated_data.get('title'))
+        return Response({'id': clone.pk, 'title': clone.title, 'counts': cloner.counts},
+                        status=status.HTTP_201_CREATED)
+
+    def get_queryset(self):
+        return Outline.objects.all().select_related('user')
+
+
+class ArcCreateView(TreeFormatMixin, CachedPermissionRequiredMixin, generics.CreateAPIView):
     '''
     API for creating arcs. Uses a custom serializer, as Arcs are generated via special methods inside
     a transaction.
@@ -443,18 +598,21 @@ class ArcCreateView(PermissionRequiredMixin, generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
-        result_serializer = ArcSerializer(self.object)
+        result_serializer = ArcSerializer(self.object, context=self.get_serializer_context())
         headers = self.get_success_headers(result_serializer.data)
         return Response(result_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class ArcDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class ArcDetailView(SparseFieldsetsMixin, StreamingMixin, ConditionalRetrieveMixin, TreeFormatMixin,
+                    CachedPermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
     '''
     API for non-create object operations for Arc model.
 
     Provides HTTP methods:
 
-    - GET: Retrieve an individual object.
+    - GET: Retrieve an individual object. Supports ``If-None-Match``, see
+      :class:`fiction_outlines_api.mixins.ConditionalRetrieveMixin`, and ``stream=true``, see
+      :class:`fiction_outlines_api.mixins.StreamingMixin`.
     - PUT: Update the object with data compatible with a :class:`fiction_outlines_api.serializers.ArcSerializer`
     - PATCH: Update the object with partial data that corresponds to keys in the serializer.
     - DELETE: Delete the object.
@@ -464,6 +622,9 @@ class ArcDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIVi
     permission_required = 'fiction_outlines_api.valid_user'
     lookup_url_kwarg = 'arc'
 
+    def stream_object(self, instance):
+        return iter_arc(instance, self.get_serializer_context(), self.stream_chunk_size)
+
     def put(self, request, *args, **kwargs):
         self.object_permission_required = 'fiction_outlines.edit_arc'
         return super().put(request, *args, **kwargs)
@@ -477,16 +638,18 @@ class ArcDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIVi
         return super().delete(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Arc.objects.all()
+        return Arc.objects.all().select_related('outline')
 
 
-class ArcNodeDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class ArcNodeDetailView(SparseFieldsetsMixin, ConditionalRetrieveMixin, CachedPermissionRequiredMixin,
+                        generics.RetrieveUpdateDestroyAPIView):
     '''
     API for viewing a tree of :class:`fiction_outlines.models.ArcElementNode`, as well as some basic updates.
 
     Provides HTTP methods:
 
-    - GET: Retrieve an individual object.
+    - GET: Retrieve an individual object. Supports ``If-None-Match``, see
+      :class:`fiction_outlines_api.mixins.ConditionalRetrieveMixin`.
     - PUT: Update the object with data compatible with a
       :class:`fiction_outlines_api.serializers.ArcElementNodeSerializer`
     - PATCH: Update the object with partial data that corresponds to keys in the serializer.
@@ -533,10 +696,13 @@ class ArcNodeDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestroyA
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def get_queryset(self):
-        return ArcElementNode.objects.all()  # pragma: no cover
+        return ArcElementNode.objects.all().select_related('arc__outline')  # pragma: no cover
+
+    def get_outline_id(self, obj):
+        return obj.arc.outline_id
 
 
-class ArcNodeCreateView(PermissionRequiredMixin, NodeAddMixin, generics.CreateAPIView):
+class ArcNodeCreateView(CachedPermissionRequiredMixin, NodeAddMixin, generics.CreateAPIView):
     '''
     API view for add_child and add_sibling. You can only create tree objects in relation to
     another object in the tree. See :class:`mixins.NodeAddMixin` for more details.
@@ -551,7 +717,22 @@ class ArcNodeCreateView(PermissionRequiredMixin, NodeAddMixin, generics.CreateAP
         return ArcElementNode.objects.all()
 
 
-class ArcNodeMoveView(PermissionRequiredMixin, NodeMoveMixin, generics.GenericAPIView):
+class ArcNodeBulkCreateView(NodeBulkAddMixin, ArcNodeCreateView):
+    '''
+    View for adding a nested list of arc nodes at once. See :class:`mixins.NodeBulkAddMixin` for more details.
+    '''
+    related_key = 'arc'
+    target_node_type_fieldname = 'arc_element_type'
+    placement_rules = staticmethod(check_arc_placement)
+
+    def get_outline_id(self, node):
+        return node.arc.outline_id
+
+    def get_queryset(self):
+        return ArcElementNode.objects.select_related('arc__outline__user')
+
+
+class ArcNodeMoveView(CachedPermissionRequiredMixin, NodeMoveMixin, generics.GenericAPIView):
     '''
     View for moving arc nodes. See :class:`mixins.NodeMoveMixin` for more details.
     '''
@@ -563,10 +744,11 @@ class ArcNodeMoveView(PermissionRequiredMixin, NodeMoveMixin, generics.GenericAP
     related_key = 'arc'
 
     def get_queryset(self):
-        return ArcElementNode.objects.all()
+        # The object permission rules compare arc.outline.user with the current user.
+        return ArcElementNode.objects.select_related('arc__outline__user')
 
 
-class StoryNodeMoveView(PermissionRequiredMixin, NodeMoveMixin, generics.GenericAPIView):
+class StoryNodeMoveView(CachedPermissionRequiredMixin, NodeMoveMixin, generics.GenericAPIView):
     '''
     View for moving story nodes. See :class:`mixins.NodeMoveMixin` for more details.
     '''
@@ -577,10 +759,25 @@ class StoryNodeMoveView(PermissionRequiredMixin, NodeMoveMixin, generics.Generic
     related_key = 'outline'
 
     def get_queryset(self):
-        return StoryElementNode.objects.all()
+        # The object permission rules compare outline.user with the current user.
+        return StoryElementNode.objects.select_related('outline__user')
+
+
+class ArcNodeBulkMoveView(NodeBulkMoveMixin, ArcNodeMoveView):
+    '''
+    View for moving many arc nodes at once. See :class:`mixins.NodeBulkMoveMixin` for more details.
+    '''
+    serializer_class = NodeMoveSerializer
+
+
+class StoryNodeBulkMoveView(NodeBulkMoveMixin, StoryNodeMoveView):
+    '''
+    View for moving many story nodes at once. See :class:`mixins.NodeBulkMoveMixin` for more details.
+    '''
+    serializer_class = NodeMoveSerializer
 
 
-class StoryNodeCreateView(PermissionRequiredMixin, NodeAddMixin, generics.CreateAPIView):
+class StoryNodeCreateView(CachedPermissionRequiredMixin, NodeAddMixin, generics.CreateAPIView):
     '''
     View for adding story nodes. You can only create tree elements in relation to other objects in
     the same tree. See :class:`mixins.NodeAddMixin` for more details.
@@ -595,13 +792,27 @@ class StoryNodeCreateView(PermissionRequiredMixin, NodeAddMixin, generics.Create
         return StoryElementNode.objects.all()
 
 
-class StoryNodeDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestroyAPIView):
+class StoryNodeBulkCreateView(NodeBulkAddMixin, StoryNodeCreateView):
+    '''
+    View for adding a nested list of story nodes at once. See :class:`mixins.NodeBulkAddMixin` for more details.
+    '''
+    related_key = 'outline'
+    target_node_type_fieldname = 'story_element_type'
+    placement_rules = staticmethod(check_story_placement)
+
+    def get_queryset(self):
+        return StoryElementNode.objects.select_related('outline__user')
+
+
+class StoryNodeDetailView(SparseFieldsetsMixin, ConditionalRetrieveMixin, CachedPermissionRequiredMixin,
+                          generics.RetrieveUpdateDestroyAPIView):
     '''
     API for viewing and editing a story node.
 
     Provides HTTP methods:
 
-    - GET: Retrieve an individual object.
+    - GET: Retrieve an individual object. Supports ``If-None-Match``, see
+      :class:`fiction_outlines_api.mixins.ConditionalRetrieveMixin`.
     - PUT: Update the object with data compatible with a
       :class:`fiction_outlines_api.serializers.StoryElementNodeSerializer`
     - PATCH: Update the object with partial data that corresponds to keys in the serializer.
@@ -653,4 +864,47 @@ class StoryNodeDetailView(PermissionRequiredMixin, generics.RetrieveUpdateDestro
         return super().delete(request, *args, **kwargs)
 
     def get_queryset(self):
-        return StoryElementNode.objects.all()  # pragma: no cover
+        return StoryElementNode.objects.all().select_related('outline')  # pragma: no cover
+
+
+class StoryNodeTreeView(SparseFieldsetsMixin, ConditionalRetrieveMixin, TreeFormatMixin, CachedPermissionRequiredMixin,
+                        generics.RetrieveAPIView):
+    '''
+    API view for the subtree of a story node, see
+    :class:`fiction_outlines_api.serializers.StorySubtreeSerializer`.
+
+    Provides HTTP methods:
+
+    - GET: Retrieve the node and its descendants. Accepts ``?max_depth=`` to only include the nodes that
+      many levels below it; nodes with ``numchild`` above zero and no children in the response can be
+      expanded by requesting their own subtree. Supports ``?tree=``, ``?fields=``, ``?omit=`` and
+      ``If-None-Match``.
+    '''
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = StorySubtreeSerializer
+    permission_required = 'fiction_outlines_api.valid_user'
+    object_permission_required = 'fiction_outlines.view_story_node'
+    lookup_url_kwarg = 'storynode'
+
+    def get_max_depth(self):
+        '''
+        :raises ValidationError: if ``max_depth`` is not a positive integer or zero.
+        '''
+        max_depth = self.request.query_params.get('max_depth')
+        if max_depth is None:
+            return None
+        try:
+            max_depth = int(max_depth)
+        except ValueError:
+            max_depth = -1
+        if max_depth < 0:
+            raise ValidationError({'max_depth': _('Must be a positive integer or zero.')})
+        return max_depth
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['max_depth'] = self.get_max_depth()
+        return context
+
+    def get_queryset(self):
+        return StoryElementNode.objects.filter(outline_id=self.kwargs['outline']).select_related('outline')
@@ -54,6 +54,8 @@ setup(
     url='https://github.com/andrlik/django-fiction-outlines-api',
     packages=[
         'fiction_outlines_api',
+        'fiction_outlines_api.management',
+        'fiction_outlines_api.management.commands',
     ],
     include_package_data=True,
     install_requires=[
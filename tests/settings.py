@@ -40,6 +40,9 @@ TEMPLATES = [
 
 ROOT_URLCONF = "tests.urls"
 
+# The tests run in a single process, so the in-process structure cache is safe to opt into.
+FICTION_OUTLINES_API_CACHE_SIZE = 256
+
 INSTALLED_APPS = [
     "django.contrib.auth",
     "django.contrib.sessions",
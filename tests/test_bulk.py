@@ -0,0 +1,394 @@
+import logging
+import pytest
+from unittest import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from treebeard.exceptions import InvalidMoveToDescendant, InvalidPosition, PathOverflow
+from fiction_outlines.models import Outline, StoryElementNode, ArcElementNode
+from fiction_outlines_api.bulk import TreeLayout
+from fiction_outlines_api.cache import get_revisions
+from fiction_outlines_api.views import StoryNodeBulkMoveView, StoryNodeBulkCreateView
+from .test_views import ArcNodeAbstractTestCase
+
+logger = logging.getLogger('test_bulk')
+logger.setLevel(logging.DEBUG)
+
+
+def build_story(outline, prefix, chapters=3, scenes=4):
+    '''
+    Adds a part with chapters and scenes to an outline. Names start with ``prefix`` and are unique per outline.
+    '''
+    outline.story_tree_root.refresh_from_db()
+    part = outline.story_tree_root.add_child(story_element_type='part', name='%s part' % prefix, description='')
+    for x in range(chapters):
+        part.refresh_from_db()
+        chapter = part.add_child(story_element_type='chapter', name='%s chapter %d' % (prefix, x), description='')
+        for y in range(scenes):
+            chapter.refresh_from_db()
+            chapter.add_child(story_element_type='ss', name='%s scene %d.%d' % (prefix, x, y), description='')
+    return part
+
+
+def get_shape(outline):
+    '''
+    The names and depths of the story tree of an outline, in tree order, without the prefix of the names.
+    '''
+    return [(node.name.split(' ', 1)[-1] if node.name else None, node.depth)
+            for node in StoryElementNode.get_tree(StoryElementNode.objects.get(pk=outline.story_tree_root.pk))]
+
+
+class TreeLayoutTest(ArcNodeAbstractTestCase):
+    '''
+    The in-memory layout must end up with the same tree treebeard builds.
+    '''
+    moves = [
+        ('scene 0.0', 'scene 2.3', 'right'),
+        ('scene 1.1', 'chapter 0', 'first-child'),
+        ('chapter 2', 'chapter 0', 'left'),
+        ('scene 0.2', 'scene 1.0', 'last-sibling'),
+        ('scene 2.1', 'chapter 1', 'last-child'),
+        ('scene 2.0', 'scene 0.1', 'first-sibling'),
+        ('chapter 1', 'chapter 2', 'right'),
+        ('scene 1.2', 'scene 1.3', 'left'),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.treebeard_outline = Outline.objects.create(title='Moved by treebeard', user=self.user1)
+        self.layout_outline = Outline.objects.create(title='Moved by layout', user=self.user1)
+        build_story(self.treebeard_outline, 'treebeard')
+        build_story(self.layout_outline, 'layout')
+
+    def get_node(self, outline, prefix, name):
+        return StoryElementNode.objects.get(outline=outline, name='%s %s' % (prefix, name))
+
+    def test_same_tree_as_treebeard(self):
+        for source, target, pos in self.moves:
+            self.get_node(self.treebeard_outline, 'treebeard', source).move(
+                self.get_node(self.treebeard_outline, 'treebeard', target), pos)
+        layout = TreeLayout.load(self.layout_outline.story_tree_root)
+        by_name = dict((node.name, node) for node in layout.nodes.values())
+        for source, target, pos in self.moves:
+            layout.move(by_name['layout %s' % source], by_name['layout %s' % target], pos)
+        with CaptureQueriesContext(connection) as queries:
+            changed = layout.save()
+        assert changed
+        # Parking the moved paths and writing the tree fields, whatever the number of moves.
+        assert len([query for query in queries if 'SAVEPOINT' not in query['sql']]) == 2
+        assert get_shape(self.layout_outline) == get_shape(self.treebeard_outline)
+        assert not any(StoryElementNode.find_problems())
+        # The parents answer from the layout.
+        assert by_name['layout scene 2.1'].get_parent() == by_name['layout chapter 1']
+
+    def test_untouched_paths(self):
+        layout = TreeLayout.load(self.layout_outline.story_tree_root)
+        by_name = dict((node.name, node) for node in layout.nodes.values())
+        last = by_name['layout scene 2.3']
+        layout.move(by_name['layout scene 0.0'], last, 'right')
+        changed = layout.save()
+        # Only the moved scene and the numchild of both chapters change.
+        assert sorted(node.name for node in changed) == ['layout chapter 0', 'layout chapter 2', 'layout scene 0.0']
+        assert by_name['layout scene 0.1'].path == StoryElementNode.objects.get(pk=by_name['layout scene 0.1'].pk).path
+        assert layout.save() == []
+
+    def test_invalid_moves(self):
+        layout = TreeLayout.load(self.layout_outline.story_tree_root)
+        by_name = dict((node.name, node) for node in layout.nodes.values())
+        with pytest.raises(InvalidMoveToDescendant):
+            layout.move(by_name['layout chapter 0'], by_name['layout scene 0.1'], 'right')
+        with pytest.raises(InvalidMoveToDescendant):
+            layout.move(by_name['layout chapter 0'], by_name['layout chapter 0'], 'left')
+        with pytest.raises(InvalidPosition):
+            layout.move(by_name['layout part'], layout.root, 'right')
+        with pytest.raises(InvalidPosition):
+            layout.move(by_name['layout scene 0.0'], by_name['layout scene 0.1'], 'sorted-sibling')
+        assert layout.save() == []
+
+    def test_path_overflow(self):
+        layout = TreeLayout.load(self.layout_outline.story_tree_root)
+        by_name = dict((node.name, node) for node in layout.nodes.values())
+        layout.max_step = 4
+        layout.move(by_name['layout scene 1.0'], by_name['layout chapter 0'], 'last-child')
+        with pytest.raises(PathOverflow):
+            layout.save()
+
+    def test_partial_load(self):
+        layout = TreeLayout.load(self.layout_outline.story_tree_root, fields=('story_element_type',))
+        node = next(iter(layout.nodes.values()))
+        assert 'story_element_type' in node.__dict__
+        assert 'description' not in node.__dict__
+
+
+class BulkMoveTest(ArcNodeAbstractTestCase):
+    '''
+    Tests for the bulk move endpoints.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.part = build_story(self.o1, 'bulk')
+        self.nodes = dict((node.name, node) for node in StoryElementNode.objects.filter(outline=self.o1))
+
+    def operation(self, source, target, position):
+        return {'node': str(self.nodes['bulk %s' % source].pk), 'target': str(self.nodes['bulk %s' % target].pk),
+                'position': position}
+
+    def bulk_move(self, operations, username=None, url_name='fiction_outlines_api:storynode_bulk_move'):
+        with self.login(username=username or self.user1.username):
+            self.post(url_name, data=operations, extra=self.extra)
+        return self.last_response.data
+
+    def test_login_required(self):
+        self.post('fiction_outlines_api:storynode_bulk_move', data=[self.operation('scene 0.0', 'scene 1.0', 'left')],
+                  extra=self.extra)
+        self.response_403()
+
+    def test_object_permissions(self):
+        shape = get_shape(self.o1)
+        for user in self.naughty_users:
+            self.bulk_move([self.operation('scene 0.0', 'scene 1.0', 'left')], username=user.username)
+            self.response_403()
+        assert get_shape(self.o1) == shape
+
+    def test_valid_moves(self):
+        operations = [self.operation('scene %d.%d' % (x, y), 'chapter 2', 'last-child')
+                      for x in range(2) for y in range(4)]
+        operations.append(self.operation('chapter 0', 'chapter 2', 'right'))
+        results = self.bulk_move(operations)
+        self.response_200()
+        assert [result['status'] for result in results] == ['moved'] * 9
+        assert results[0]['parent'] == self.nodes['bulk chapter 2'].pk
+        assert results[-1]['parent'] == self.part.pk
+        chapter = StoryElementNode.objects.get(pk=self.nodes['bulk chapter 2'].pk)
+        assert [node.name for node in chapter.get_children()] == ['bulk scene 2.%d' % y for y in range(4)] + [
+            'bulk scene %d.%d' % (x, y) for x in range(2) for y in range(4)]
+        part = StoryElementNode.objects.get(pk=self.part.pk)
+        assert [node.name for node in part.get_children()] == ['bulk chapter 1', 'bulk chapter 2', 'bulk chapter 0']
+        assert not any(StoryElementNode.find_problems())
+
+    def test_invalid_moves(self):
+        shape = get_shape(self.o1)
+        results = self.bulk_move([
+            self.operation('scene 0.0', 'scene 1.0', 'left'),
+            self.operation('chapter 0', 'scene 1.1', 'right'),
+            self.operation('scene 0.1', 'scene 1.0', 'sideways'),
+            self.operation('chapter 1', 'scene 1.0', 'first-child'),
+            {'node': str(self.nodes['bulk chapter 2'].pk), 'target': str(self.o1.story_tree_root.pk),
+             'position': 'left'},
+            {'node': str(self.nodes['bulk scene 2.0'].pk), 'target': str(self.o1_invalid_node.pk), 'position': 'left'},
+            self.operation('scene 1.2', 'scene 1.2', 'right'),
+        ])
+        self.response_400()
+        assert [result['status'] for result in results] == ['valid'] + ['invalid'] * 6
+        assert 'children of invalid parent nodes' in results[1]['error']
+        assert 'position' in results[2]['error']
+        assert 'children of invalid parent nodes' in results[3]['error']
+        assert 'root node' in results[4]['error']
+        assert 'same outline' in results[5]['error']
+        assert 'descendants' in results[6]['error']
+        assert get_shape(self.o1) == shape
+
+    def test_later_moves_see_earlier_ones(self):
+        '''
+        A scene moved into a chapter is a descendant of that chapter for the following operations.
+        '''
+        results = self.bulk_move([
+            self.operation('scene 0.0', 'chapter 1', 'first-child'),
+            self.operation('chapter 1', 'scene 0.0', 'right'),
+        ])
+        self.response_400()
+        assert [result['status'] for result in results] == ['valid', 'invalid']
+
+    def test_fixed_query_count(self):
+        def count_queries(operations):
+            with self.login(username=self.user1.username):
+                with CaptureQueriesContext(connection) as queries:
+                    self.post('fiction_outlines_api:storynode_bulk_move', data=operations, extra=self.extra)
+                self.response_200()
+            return len([query for query in queries if 'SAVEPOINT' not in query['sql']])
+
+        few = count_queries([self.operation('scene 0.0', 'scene 2.3', 'right')])
+        many = count_queries([self.operation('scene %d.%d' % (x, y), 'scene 0.0', 'left')
+                              for x in range(1, 3) for y in range(4)])
+        assert few == many
+
+    def test_arc_nodes(self):
+        children = list(self.arc1.arc_root_node.get_children())
+        operations = [{'node': str(children[0].pk), 'target': str(children[-1].pk), 'position': 'right'},
+                      {'node': str(children[1].pk), 'target': str(children[0].pk), 'position': 'right'}]
+        results = self.bulk_move(operations, url_name='fiction_outlines_api:arcnode_bulk_move')
+        self.response_200()
+        assert [result['status'] for result in results] == ['moved', 'moved']
+        root = ArcElementNode.objects.get(pk=self.arc1.arc_root_node.pk)
+        assert [node.pk for node in root.get_children()] == [node.pk for node in children[2:]] + [
+            children[0].pk, children[1].pk]
+
+    def test_request_validation(self):
+        self.bulk_move([])
+        self.response_400()
+        self.bulk_move([{'node': 'not a uuid', 'target': str(self.part.pk), 'position': 'left'}])
+        self.response_400()
+        self.bulk_move([self.operation('scene 0.0', 'scene 1.0', 'left')] * 3)
+        self.response_200()
+
+    def test_max_operations(self):
+        with mock.patch.object(StoryNodeBulkMoveView, 'max_operations', 2):
+            self.bulk_move([self.operation('scene 0.0', 'scene 1.0', 'left')] * 3)
+        self.response_400()
+
+
+def scene(name, **kwargs):
+    return dict(story_element_type='ss', name=name, description='', **kwargs)
+
+
+def chapter(name, scenes=()):
+    return {'story_element_type': 'chapter', 'name': name, 'description': '', 'children': list(scenes)}
+
+
+class BulkAddTest(ArcNodeAbstractTestCase):
+    '''
+    Tests for the bulk creation endpoints.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.part = build_story(self.o1, 'bulk', chapters=2, scenes=2)
+        self.root = StoryElementNode.objects.get(pk=self.o1.story_tree_root.pk)
+
+    def bulk_add(self, node, position, items, username=None, url_name='fiction_outlines_api:storynode_bulk_create'):
+        kwargs = {'arcnode' if 'arcnode' in url_name else 'storynode': node.pk}
+        with self.login(username=username or self.user1.username):
+            self.post(url_name, data=items, extra=self.extra, position=position, **kwargs)
+        return self.last_response.data
+
+    def test_login_required(self):
+        self.post('fiction_outlines_api:storynode_bulk_create', data=[scene('New')], extra=self.extra,
+                  storynode=self.part.pk, position='last-child')
+        self.response_403()
+
+    def test_object_permissions(self):
+        for user in self.naughty_users:
+            self.bulk_add(self.part, 'last-child', [scene('New')], username=user.username)
+            self.response_403()
+        assert not StoryElementNode.objects.filter(name='New').exists()
+
+    def test_nested_nodes(self):
+        revision = get_revisions([self.o1.pk])[self.o1.pk]
+        results = self.bulk_add(self.part, 'last-child', [
+            chapter('new chapter 0', [scene('new scene 0.%d' % y) for y in range(3)]),
+            chapter('new chapter 1', [scene('new scene 1.0')]),
+            scene('new scene'),
+        ])
+        self.response_201()
+        assert [result['story_element_type'] for result in results] == ['chapter', 'chapter', 'ss']
+        assert len(results[0]['children']) == 3
+        assert StoryElementNode.objects.get(pk=results[0]['children'][2]['id']).name == 'new scene 0.2'
+        part = StoryElementNode.objects.get(pk=self.part.pk)
+        assert [node.name for node in part.get_children()] == [
+            'bulk chapter 0', 'bulk chapter 1', 'new chapter 0', 'new chapter 1', 'new scene']
+        chapter_node = StoryElementNode.objects.get(pk=results[0]['id'])
+        assert [node.name for node in chapter_node.get_children()] == ['new scene 0.%d' % y for y in range(3)]
+        assert chapter_node.outline == self.o1
+        assert not any(StoryElementNode.find_problems())
+        assert get_revisions([self.o1.pk])[self.o1.pk] != revision
+
+    def test_positions(self):
+        first = StoryElementNode.objects.get(name='bulk chapter 0')
+        self.bulk_add(first, 'right', [chapter('new chapter 0'), chapter('new chapter 1')])
+        self.response_201()
+        self.bulk_add(self.part, 'first-child', [chapter('new chapter 2'), chapter('new chapter 3')])
+        self.response_201()
+        part = StoryElementNode.objects.get(pk=self.part.pk)
+        assert [node.name for node in part.get_children()] == [
+            'new chapter 2', 'new chapter 3', 'bulk chapter 0', 'new chapter 0', 'new chapter 1', 'bulk chapter 1']
+        assert not any(StoryElementNode.find_problems())
+
+    def test_invalid_nodes(self):
+        shape = get_shape(self.o1)
+        errors = self.bulk_add(self.part, 'last-child', [
+            chapter('new chapter', [scene('new scene'), chapter('nested chapter'), {'story_element_type': 'novel'}]),
+            {'story_element_type': 'book', 'name': 'new book', 'description': ''},
+            'not a node',
+            dict(chapter('listed'), children='not a list'),
+            scene('linked', assoc_characters=[str(self.c1int.pk)]),
+        ])
+        self.response_400()
+        assert list(errors.keys()) == ['0/children/1', '0/children/2', '1', '2', '3', '4']
+        assert 'chapter is not an allowed child of chapter' in errors['0/children/1'][0]
+        assert 'story_element_type' in errors['0/children/2']
+        assert 'book is not an allowed child of part' in errors['1'][0]
+        assert 'children' in errors['3']
+        assert get_shape(self.o1) == shape
+
+    def test_request_validation(self):
+        self.bulk_add(self.part, 'sideways', [scene('New')])
+        self.response_400()
+        self.bulk_add(self.part, 'last-child', [])
+        self.response_400()
+        self.bulk_add(self.part, 'last-child', {'name': 'New'})
+        self.response_400()
+        errors = self.bulk_add(self.root, 'right', [scene('New')])
+        self.response_400()
+        assert 'root' in errors['0'][0]
+
+    def test_max_nodes(self):
+        with mock.patch.object(StoryNodeBulkCreateView, 'max_nodes', 3):
+            self.bulk_add(self.part, 'last-child', [chapter('new chapter', [scene('new scene')] * 3)])
+        self.response_400()
+        assert not StoryElementNode.objects.filter(name='new chapter').exists()
+
+    def test_fixed_query_count(self):
+        def count_queries(items):
+            with self.login(username=self.user1.username):
+                with CaptureQueriesContext(connection) as queries:
+                    self.post('fiction_outlines_api:storynode_bulk_create', data=items, extra=self.extra,
+                              storynode=self.part.pk, position='first-child')
+                self.response_201()
+            return len([query for query in queries if 'SAVEPOINT' not in query['sql']])
+
+        few = count_queries([chapter('few chapter', [scene('few scene')])])
+        many = count_queries([chapter('many chapter %d' % x, [scene('many scene %d.%d' % (x, y)) for y in range(5)])
+                              for x in range(5)])
+        assert few == many
+
+    def test_arc_nodes(self):
+        root = self.arc1.arc_root_node
+        beat = root.add_child(arc_element_type='beat', description='A beat')
+        results = self.bulk_add(beat, 'right', [
+            {'arc_element_type': 'tf', 'description': 'First line\nSecond line',
+             'story_element_node': str(self.o1_valid_storynode.pk),
+             'children': [{'arc_element_type': 'beat', 'description': 'Inner beat'}]},
+        ], url_name='fiction_outlines_api:arcnode_bulk_create')
+        self.response_201()
+        node = ArcElementNode.objects.get(pk=results[0]['id'])
+        assert node.headline == 'First line'
+        assert node.arc == self.arc1
+        assert node.get_prev_sibling().pk == beat.pk
+        assert [child.description for child in node.get_children()] == ['Inner beat']
+        # A milestone that is missing from the arc can be added back.
+        ArcElementNode.objects.get(arc=self.arc1, arc_element_type='mile_reso').delete()
+        self.bulk_add(root, 'last-child', [{'arc_element_type': 'mile_reso', 'description': 'The end'}],
+                      url_name='fiction_outlines_api:arcnode_bulk_create')
+        self.response_201()
+        assert ArcElementNode.objects.get(arc=self.arc1, arc_element_type='mile_reso').get_parent() == root
+        assert not any(ArcElementNode.find_problems())
+
+    def test_arc_rules(self):
+        root = ArcElementNode.objects.get(pk=self.arc1.arc_root_node.pk)
+        milestone = root.get_children().filter(arc_element_type='mile_hook').get()
+        count = ArcElementNode.objects.count()
+        errors = self.bulk_add(root, 'last-child', [
+            {'arc_element_type': 'mile_hook', 'description': 'Another hook'},
+            {'arc_element_type': 'tf', 'description': 'Try',
+             'story_element_node': str(self.o2.story_tree_root.pk)},
+        ], url_name='fiction_outlines_api:arcnode_bulk_create')
+        self.response_400()
+        assert 'two of the same milestone' in errors['0'][0]
+        assert 'another outline' in errors['1'][0]
+        errors = self.bulk_add(milestone, 'last-child', [{'arc_element_type': 'tf', 'description': 'Try'}] * 2 + [
+            {'arc_element_type': 'mile_pt1', 'description': 'Nested milestone'}],
+            url_name='fiction_outlines_api:arcnode_bulk_create')
+        self.response_400()
+        assert list(errors.keys()) == ['2']
+        assert 'child to another milestone' in errors['2'][0]
+        assert ArcElementNode.objects.count() == count
@@ -0,0 +1,242 @@
+import logging
+from django.core.cache import caches
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from fiction_outlines.models import Outline, Arc, StoryElementNode, ArcElementNode
+from fiction_outlines.signals import tree_manipulation
+from fiction_outlines_api import cache
+from fiction_outlines_api.serializers import OutlineSerializer, ArcSerializer
+from .test_trees import TreeAbstractTestCase
+
+logger = logging.getLogger('test_cache')
+logger.setLevel(logging.DEBUG)
+
+
+class LRUCacheTest(TreeAbstractTestCase):
+    '''
+    Tests for the in-process fallback cache.
+    '''
+
+    def test_eviction(self):
+        lru = cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        assert lru.get('a') == 1
+        lru.set('c', 3)
+        assert lru.get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
+        assert len(lru) == 2
+
+    def test_values_are_copies(self):
+        lru = cache.LRUCache()
+        value = [{'children': []}]
+        lru.set('a', value)
+        lru.get('a')[0]['children'].append(1)
+        value.append(2)
+        assert lru.get('a') == [{'children': []}]
+
+    def test_add_delete_clear(self):
+        lru = cache.LRUCache()
+        assert lru.add('a', 1)
+        assert not lru.add('a', 2)
+        assert lru.get('a') == 1
+        assert lru.delete('a')
+        assert not lru.delete('a')
+        assert lru.get('a', 'missing') == 'missing'
+        lru.set('b', 1)
+        lru.clear()
+        assert len(lru) == 0
+
+    def test_disabled(self):
+        lru = cache.LRUCache(0)
+        lru.set('a', 1)
+        assert lru.get('a') is None
+
+
+class StructureCacheTest(TreeAbstractTestCase):
+    '''
+    Tests for caching serialized structures and invalidating them.
+    '''
+
+    def revision(self, outline=None):
+        outline = outline or self.o1
+        return cache.get_revisions([outline.pk])[outline.pk]
+
+    def assert_invalidates(self, change, outline=None):
+        before = self.revision(outline)
+        change()
+        assert self.revision(outline) != before
+
+    def test_outline_hit(self):
+        with CaptureQueriesContext(connection) as miss:
+            data = OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        with CaptureQueriesContext(connection) as hit:
+            cached_data = OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        assert data == cached_data
+        assert len(hit) < len(miss)
+        assert not any('fiction_outlines_storyelementnode' in query['sql'] for query in hit)
+
+    def test_outline_list_hit(self):
+        outlines = Outline.objects.filter(user=self.user1).prefetch_related('arc_set', 'characterinstance_set',
+                                                                            'locationinstance_set')
+        data = OutlineSerializer(outlines, many=True).data
+        with CaptureQueriesContext(connection) as hit:
+            cached_data = OutlineSerializer(outlines.all(), many=True).data
+        assert data == cached_data
+        assert not any('fiction_outlines_storyelementnode' in query['sql'] for query in hit)
+
+    def test_arc_hit(self):
+        data = ArcSerializer(Arc.objects.get(pk=self.arc1.pk)).data
+        with CaptureQueriesContext(connection) as hit:
+            cached_data = ArcSerializer(Arc.objects.get(pk=self.arc1.pk)).data
+        assert data['arc_structure'] == cached_data['arc_structure']
+        assert data['current_errors'] == cached_data['current_errors']
+        assert not any('fiction_outlines_arcelementnode' in query['sql'] for query in hit)
+
+    def test_tree_format_is_part_of_key(self):
+        annotated = OutlineSerializer(self.o1).data['outline_structure']
+        nested = OutlineSerializer(self.o1, context={'tree_format': 'nested'}).data['outline_structure']
+        assert annotated != nested
+
+    def test_stale_data_is_not_served(self):
+        OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        self.chap1.refresh_from_db()
+        self.chap1.add_child(story_element_type='ss', name='New scene')
+        data = OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        assert 'New scene' in [node_data['name'] for node_data, info in data['outline_structure']]
+
+    def test_story_node_invalidation(self):
+        self.assert_invalidates(lambda: tree_manipulation.send(sender=StoryElementNode, instance=self.chap1,
+                                                               action='update', target_node_type='chapter',
+                                                               target_node=None, pos=None))
+        self.assert_invalidates(lambda: StoryElementNode.objects.get(pk=self.chap1.pk).save())
+        self.assert_invalidates(lambda: StoryElementNode.objects.get(pk=self.scenes[3].pk).delete())
+        self.assert_invalidates(lambda: self.scenes[3].assoc_characters.add(self.c2int))
+        self.assert_invalidates(lambda: self.c2int.storyelementnode_set.remove(self.scenes[3]))
+
+    def test_arc_node_invalidation(self):
+        milestone = self.arc1.arc_root_node.get_children()[0]
+        self.assert_invalidates(lambda: tree_manipulation.send(sender=ArcElementNode, instance=milestone,
+                                                               action='update',
+                                                               target_node_type=milestone.arc_element_type,
+                                                               target_node=None, pos=None))
+        self.assert_invalidates(lambda: ArcElementNode.objects.get(pk=milestone.pk).save())
+        self.assert_invalidates(lambda: milestone.assoc_characters.add(self.c1int))
+        self.assert_invalidates(lambda: Arc.objects.get(pk=self.arc1.pk).save())
+
+    def test_instance_invalidation(self):
+        self.assert_invalidates(self.c1int.save)
+        self.assert_invalidates(self.l1int.delete)
+        self.c1.name = 'Renamed'
+        self.assert_invalidates(self.c1.save)
+        self.assert_invalidates(self.l2.save)
+        self.assert_invalidates(lambda: self.o1.tags.add('revised'))
+
+    def test_unknown_outline(self):
+        cache.invalidate_outline(None)
+        assert cache.arc_outline_id(self.o1.pk) is None
+
+    @override_settings(FICTION_OUTLINES_API_CACHE_SIZE=0)
+    def test_disabled_by_default(self):
+        '''
+        Without a shared cache or an explicit opt-in, nothing is cached and revisions never repeat.
+        '''
+        assert cache.get_cache() is cache._disabled_cache
+        OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        with CaptureQueriesContext(connection) as queries:
+            OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        assert any('fiction_outlines_storyelementnode' in query['sql'] for query in queries)
+        assert self.revision() != self.revision()
+
+    @override_settings(FICTION_OUTLINES_API_CACHE_SIZE=2)
+    def test_local_cache_size(self):
+        assert cache.get_cache().maxsize == 2
+
+    @override_settings(FICTION_OUTLINES_API_CACHE='default')
+    def test_django_cache_backend(self):
+        assert cache.get_cache() is caches['default']
+        data = OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        assert OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data == data
+        self.assert_invalidates(lambda: StoryElementNode.objects.get(pk=self.chap1.pk).save())
+
+
+class ConditionalRetrieveTest(TreeAbstractTestCase):
+    '''
+    Tests for ETag and If-None-Match support on detail views.
+    '''
+
+    def conditional_get(self, url_name, etag, **kwargs):
+        extra = dict(self.extra, HTTP_IF_NONE_MATCH=etag)
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url_name, extra=extra, **kwargs)
+        return queries
+
+    def assert_not_modified(self, url_name, node_queries=0, **kwargs):
+        '''
+        Node views fetch the node itself to check permissions, but never the rest of the tree.
+        '''
+        self.get(url_name, extra=self.extra, **kwargs)
+        self.response_200()
+        etag = self.last_response['ETag']
+        queries = self.conditional_get(url_name, etag, **kwargs)
+        assert self.last_response.status_code == 304
+        assert self.last_response['ETag'] == etag
+        assert len([query for query in queries if 'fiction_outlines_storyelementnode' in query['sql'] or
+                    'fiction_outlines_arcelementnode' in query['sql']]) == node_queries
+        return etag
+
+    def test_outline_detail(self):
+        with self.login(username=self.user1.username):
+            etag = self.assert_not_modified('fiction_outlines_api:outline_item', outline=self.o1.pk)
+            self.chap1.refresh_from_db()
+            self.chap1.add_child(story_element_type='ss', name='New scene')
+            self.conditional_get('fiction_outlines_api:outline_item', etag, outline=self.o1.pk)
+            self.response_200()
+            assert self.last_response['ETag'] != etag
+            etag = self.last_response['ETag']
+            self.patch('fiction_outlines_api:outline_item', outline=self.o1.pk, data={'title': 'New title'},
+                       extra=self.extra)
+            self.response_200()
+            self.conditional_get('fiction_outlines_api:outline_item', etag, outline=self.o1.pk)
+            self.response_200()
+            assert self.last_response.data['title'] == 'New title'
+
+    def test_representation_is_part_of_etag(self):
+        with self.login(username=self.user1.username):
+            etag = self.assert_not_modified('fiction_outlines_api:outline_item', outline=self.o1.pk)
+            self.conditional_get('fiction_outlines_api:outline_item', etag, outline=self.o1.pk,
+                                 data={'tree': 'nested'})
+            self.response_200()
+
+    def test_permissions_checked_first(self):
+        with self.login(username=self.user1.username):
+            etag = self.assert_not_modified('fiction_outlines_api:outline_item', outline=self.o1.pk)
+        with self.login(username=self.user2.username):
+            self.conditional_get('fiction_outlines_api:outline_item', etag, outline=self.o1.pk)
+            self.response_403()
+
+    @override_settings(FICTION_OUTLINES_API_CACHE_SIZE=0)
+    def test_no_etag_without_cache(self):
+        assert not cache.revisions_tracked()
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_item', extra=self.extra, outline=self.o1.pk)
+            self.response_200()
+            assert 'ETag' not in self.last_response
+            self.conditional_get('fiction_outlines_api:outline_item', '*', outline=self.o1.pk)
+            self.response_200()
+            self.get('fiction_outlines_api:outline_item', extra=self.extra, outline=self.o1.pk,
+                     data={'stream': 'true'})
+            self.response_200()
+            assert 'ETag' not in self.last_response
+
+    def test_arc_detail(self):
+        with self.login(username=self.user1.username):
+            self.assert_not_modified('fiction_outlines_api:arc_item', outline=self.o1.pk, arc=self.arc1.pk)
+
+    def test_node_details(self):
+        with self.login(username=self.user1.username):
+            self.assert_not_modified('fiction_outlines_api:storynode_item', node_queries=1, outline=self.o1.pk,
+                                     storynode=self.chap1.pk)
+            milestone = self.arc1.arc_root_node.get_children()[0]
+            self.assert_not_modified('fiction_outlines_api:arcnode_item', node_queries=1, outline=self.o1.pk,
+                                     arc=self.arc1.pk, arcnode=milestone.pk)
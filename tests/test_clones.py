@@ -0,0 +1,105 @@
+import logging
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from fiction_outlines.models import Outline, StoryElementNode, ArcElementNode
+from fiction_outlines_api.cache import get_revisions
+from fiction_outlines_api.clones import OutlineCloner
+from fiction_outlines_api.imports import OutlineImporter
+from .test_exports import export, normalize
+from .test_imports import document, outline_records
+from .test_views import FictionOutlineAbstractTestCase
+
+logger = logging.getLogger('test_clones')
+logger.setLevel(logging.DEBUG)
+
+
+class OutlineClonerTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the outline copies.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.imported = self.import_outline()
+
+    def import_outline(self, chapters=3):
+        return OutlineImporter(self.user1).run(document(outline_records(chapters=chapters)).splitlines())
+
+    def test_clone(self):
+        chapter = self.o1.story_tree_root.add_child(story_element_type='chapter', name='Chapter')
+        chapter.add_child(story_element_type='ss', name='Scene').assoc_characters.add(self.c1int)
+        self.arc1.arc_root_node.get_children()[0].assoc_locations.add(self.l1int)
+        for outline in (self.imported, self.o1):
+            original = export(outline)
+            cloner = OutlineCloner(outline, batch_size=4)
+            clone = cloner.run()
+            assert clone.pk != outline.pk and clone.title == outline.title and clone.user == outline.user
+            assert normalize(export(clone)) == normalize(original)
+            assert export(outline) == original
+            assert cloner.counts['storyelementnode'] == StoryElementNode.objects.filter(outline=clone).count()
+        clone = Outline.objects.get(pk=clone.pk)
+        assert set(instance.character for instance in clone.characterinstance_set.all()) == {self.c1, self.c2}
+        assert clone.story_tree_root.get_descendants().get(name='Scene').assoc_characters.get().outline == clone
+
+    def test_trees_stay_valid(self):
+        clone = OutlineCloner(self.imported).run(title='Copy')
+        assert clone.title == 'Copy'
+        clone.story_tree_root.add_child(story_element_type='chapter', name='Added later')
+        clone.arc_set.get().arc_root_node.add_child(arc_element_type='beat', description='Added later')
+        Outline.objects.create(title='Created later', user=self.user1).create_arc(name='Later', mace_type='idea')
+        assert not any(StoryElementNode.find_problems())
+        assert not any(ArcElementNode.find_problems())
+        assert StoryElementNode.get_root_nodes().filter(outline=clone).count() == 1
+
+    def test_fixed_query_count(self):
+        def count_queries(chapters):
+            outline = self.import_outline(chapters)
+            with CaptureQueriesContext(connection) as queries:
+                OutlineCloner(outline, batch_size=1000).run()
+            return len([query for query in queries if 'SAVEPOINT' not in query['sql']])
+
+        # SQLite limits the rows of one insert, so the trees stay small.
+        assert count_queries(2) == count_queries(8)
+
+    def test_invalidates_outline(self):
+        clone = OutlineCloner(self.imported).run()
+        assert get_revisions([clone.pk])[clone.pk]
+
+
+class OutlineCloneViewTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the clone endpoint.
+    '''
+
+    def test_login_required(self):
+        self.post('fiction_outlines_api:outline_clone', outline=self.o1.pk, data={}, extra=self.extra)
+        self.response_403()
+
+    def test_clone(self):
+        with self.login(username=self.user1.username):
+            self.post('fiction_outlines_api:outline_clone', outline=self.o1.pk, data={'title': 'Fork'},
+                      extra=self.extra)
+        self.response_201()
+        data = self.last_response.data
+        assert data['title'] == 'Fork'
+        assert data['counts']['arc'] == 2
+        assert data['counts']['characterinstance'] == 2
+        assert Outline.objects.get(pk=data['id']).user == self.user1
+        with self.login(username=self.user1.username):
+            self.post('fiction_outlines_api:outline_clone', outline=self.o1.pk, data={}, extra=self.extra)
+        self.response_201()
+        assert self.last_response.data['title'] == self.o1.title
+
+    def test_invalid_title(self):
+        with self.login(username=self.user1.username):
+            self.post('fiction_outlines_api:outline_clone', outline=self.o1.pk, data={'title': 'x' * 256},
+                      extra=self.extra)
+        self.response_400()
+        assert Outline.objects.filter(title=self.o1.title).count() == 1
+
+    def test_other_users(self):
+        for user in self.naughty_users:
+            with self.login(username=user.username):
+                self.post('fiction_outlines_api:outline_clone', outline=self.o1.pk, data={}, extra=self.extra)
+            self.response_403()
+        assert Outline.objects.filter(title=self.o1.title).count() == 1
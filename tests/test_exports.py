@@ -0,0 +1,183 @@
+import json
+import logging
+import pytest
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from fiction_outlines.models import Outline, StoryElementNode
+from fiction_outlines_api import exports
+from fiction_outlines_api.exports import iter_outline_document
+from fiction_outlines_api.imports import OutlineImporter
+from .test_imports import document, outline_records
+from .test_views import FictionOutlineAbstractTestCase
+
+logger = logging.getLogger('test_exports')
+logger.setLevel(logging.DEBUG)
+
+REFERENCES = {
+    'character': 'character',
+    'location': 'location',
+    'series': 'series',
+    'parent': None,
+    'arc': 'arc',
+    'story_element_node': 'story_node',
+    'assoc_characters': 'character_instance',
+    'assoc_locations': 'location_instance',
+}
+
+
+def export(outline, **kwargs):
+    return [json.loads(line) for line in iter_outline_document(outline, **kwargs)]
+
+
+def normalize(records):
+    '''
+    Replaces the ids of the records of a document by their position among the records of the same type, so that
+    the exports of an outline and of its copy can be compared.
+    '''
+    ids = {}
+    for record in records:
+        type_ids = ids.setdefault(record['type'], {})
+        type_ids[record['id']] = len(type_ids)
+
+    def rename(key, record_type, value):
+        record_type = REFERENCES[key] or record_type
+        if isinstance(value, list):
+            return sorted(ids[record_type][item] for item in value)
+        return None if value is None else ids[record_type][value]
+
+    return [dict((key, rename(key, record['type'], value) if key in REFERENCES else value)
+                 for key, value in record.items() if key != 'id') for record in records]
+
+
+class OutlineExportTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the outline export.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.imported = OutlineImporter(self.user1).run(document(outline_records()).splitlines())
+
+    def test_export(self):
+        records = export(self.imported)
+        assert [record['type'] for record in records[:6]] == ['series', 'character', 'location', 'outline',
+                                                              'character_instance', 'location_instance']
+        outline = records[3]
+        assert outline['id'] == str(self.imported.pk)
+        assert outline['tags'] == ['imported'] and outline['series'] == records[0]['id']
+        assert records[0]['tags'] == ['fantasy', 'imported']
+        assert records[1]['series'] == [records[0]['id']]
+        story_nodes = [record for record in records if record['type'] == 'story_node']
+        assert [node['name'] for node in story_nodes[:4]] == [None, 'part', 'chapter 0', 'scene 0.0']
+        assert story_nodes[0]['parent'] is None
+        assert story_nodes[3]['parent'] == story_nodes[2]['id']
+        assert story_nodes[3]['assoc_characters'] == [records[4]['id']]
+        arc_nodes = [record for record in records if record['type'] == 'arc_node']
+        assert [node['arc_element_type'] for node in arc_nodes] == ['root', 'mile_hook', 'tf', 'beat']
+        assert arc_nodes[3]['parent'] == arc_nodes[2]['id']
+        assert arc_nodes[1]['story_element_node'] == story_nodes[3]['id']
+        assert arc_nodes[1]['assoc_locations'] == [records[5]['id']]
+
+    def test_round_trip(self):
+        self.o1.story_tree_root.add_child(story_element_type='part', name='Part').add_child(
+            story_element_type='chapter', name='Chapter', description='A chapter')
+        for outline in (self.imported, self.o1):
+            records = export(outline)
+            copy = OutlineImporter(self.user2).run(json.dumps(record) for record in records)
+            assert normalize(export(copy)) == normalize(records)
+            assert not any(StoryElementNode.find_problems())
+
+    def test_fixed_query_count(self):
+        def count_queries(chapters, chunk_size):
+            outline = OutlineImporter(self.user1).run(document(outline_records(chapters=chapters)).splitlines())
+            with CaptureQueriesContext(connection) as queries:
+                records = export(outline, chunk_size=chunk_size)
+            assert len(records) == 13 + chapters * 5
+            return len(queries)
+
+        assert count_queries(2, 100) == count_queries(8, 100)
+        # Two relation queries for every chunk of nodes: 42 story nodes are read in 5 chunks rather than 1.
+        assert count_queries(8, 10) == count_queries(8, 100) + 8
+
+    def test_nodes_moved_during_export(self):
+        '''
+        A chapter is moved after the first chunk of story nodes was read, before its associations are.
+        '''
+        scenes = StoryElementNode.objects.filter(outline=self.imported, story_element_type='ss')
+        instance = self.imported.characterinstance_set.get()
+        for scene in scenes:
+            scene.assoc_characters.add(instance)
+        get_relations = exports.get_relations
+
+        def move_then_get_relations(model, field_name, pks):
+            if model is StoryElementNode and not moved:
+                moved.append(True)
+                chapter = StoryElementNode.objects.get(outline=self.imported, name='chapter 0')
+                chapter.move(StoryElementNode.objects.get(outline=self.imported, name='part'), 'last-child')
+            return get_relations(model, field_name, pks)
+
+        moved = []
+        with mock.patch.object(exports, 'get_relations', move_then_get_relations):
+            records = export(self.imported, chunk_size=2)
+        assert moved
+        exported = dict((record['id'], record) for record in records if record['type'] == 'story_node')
+        assert len(exported) == StoryElementNode.objects.filter(outline=self.imported).count()
+        for scene in scenes:
+            assert exported[str(scene.pk)]['assoc_characters'] == [str(instance.pk)]
+
+
+class OutlineExportViewTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the export endpoint.
+    '''
+
+    def test_login_required(self):
+        self.get('fiction_outlines_api:outline_export', outline=self.o1.pk)
+        self.response_403()
+
+    def test_export(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_export', outline=self.o1.pk)
+        self.response_200()
+        assert self.last_response.streaming
+        assert self.last_response['Content-Type'] == 'application/x-ndjson'
+        assert str(self.o1.pk) in self.last_response['Content-Disposition']
+        lines = b''.join(self.last_response.streaming_content).decode('utf-8').splitlines()
+        assert [json.loads(line) for line in lines] == export(self.o1)
+
+    def test_other_users(self):
+        for user in self.naughty_users:
+            with self.login(username=user.username):
+                self.get('fiction_outlines_api:outline_export', outline=self.o1.pk)
+            self.response_403()
+
+
+class ExportOutlineCommandTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the ``export_outline`` management command.
+    '''
+
+    def test_export(self):
+        out = StringIO()
+        call_command('export_outline', str(self.o1.pk), stdout=out)
+        assert [json.loads(line) for line in out.getvalue().splitlines()] == export(self.o1)
+
+    def test_file_round_trip(self):
+        path = self.tmp_path / 'outline.ndjson'
+        call_command('export_outline', str(self.o1.pk), str(path), '--chunk-size=5')
+        call_command('import_outline', self.user2.username, str(path), stdout=StringIO())
+        copy = Outline.objects.get(title=self.o1.title, user=self.user2)
+        assert normalize(export(copy)) == normalize(export(self.o1))
+
+    def test_unknown_outline(self):
+        for value in ('nothing', '00000000-0000-0000-0000-000000000000'):
+            with pytest.raises(CommandError, match='no outline'):
+                call_command('export_outline', value)
+
+    @pytest.fixture(autouse=True)
+    def set_tmp_path(self, tmp_path):
+        self.tmp_path = tmp_path
@@ -0,0 +1,81 @@
+import logging
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .test_trees import TreeAbstractTestCase
+
+logger = logging.getLogger('test_fieldsets')
+logger.setLevel(logging.DEBUG)
+
+
+class SparseFieldsetsTest(TreeAbstractTestCase):
+    '''
+    Tests for ?fields= and ?omit= on the API views.
+    '''
+
+    def sparse_get(self, url_name, params, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url_name, data=params, extra=self.extra, **kwargs)
+        self.response_200()
+        return [query['sql'] for query in queries]
+
+    def assert_no_queries_on(self, queries, *tables):
+        for table in tables:
+            assert not any(table in query for query in queries), table
+
+    def test_outline_fields(self):
+        with self.login(username=self.user1.username):
+            queries = self.sparse_get('fiction_outlines_api:outline_item', {'fields': 'id,title'}, outline=self.o1.pk)
+            assert list(self.last_response.data.keys()) == ['id', 'title']
+            self.assert_no_queries_on(queries, 'fiction_outlines_storyelementnode', 'fiction_outlines_arc',
+                                      'fiction_outlines_characterinstance', 'fiction_outlines_locationinstance',
+                                      'taggit')
+
+    def test_outline_omit(self):
+        with self.login(username=self.user1.username):
+            queries = self.sparse_get('fiction_outlines_api:outline_item',
+                                      {'omit': 'outline_structure, length_estimate,tags'}, outline=self.o1.pk)
+            assert 'outline_structure' not in self.last_response.data
+            assert 'length_estimate' not in self.last_response.data
+            assert 'arc_set' in self.last_response.data
+            self.assert_no_queries_on(queries, 'fiction_outlines_storyelementnode', 'taggit')
+
+    def test_outline_list(self):
+        with self.login(username=self.user1.username):
+            queries = self.sparse_get('fiction_outlines_api:outline_listcreate', {'fields': 'id,title'})
+            for outline_data in self.last_response.data:
+                assert list(outline_data.keys()) == ['id', 'title']
+            self.assert_no_queries_on(queries, 'fiction_outlines_storyelementnode', 'fiction_outlines_arc',
+                                      'fiction_outlines_characterinstance', 'taggit')
+
+    def test_arc_fields(self):
+        with self.login(username=self.user1.username):
+            queries = self.sparse_get('fiction_outlines_api:arc_item', {'fields': 'id,name'}, outline=self.o1.pk,
+                                      arc=self.arc1.pk)
+            assert list(self.last_response.data.keys()) == ['id', 'name']
+            self.assert_no_queries_on(queries, 'fiction_outlines_arcelementnode')
+            self.sparse_get('fiction_outlines_api:arc_item', {'omit': 'arc_structure'}, outline=self.o1.pk,
+                            arc=self.arc1.pk)
+            assert 'arc_structure' not in self.last_response.data
+            assert len(self.last_response.data['current_errors']) == 1
+
+    def test_story_node_fields(self):
+        with self.login(username=self.user1.username):
+            queries = self.sparse_get('fiction_outlines_api:storynode_item', {'fields': 'id,name'},
+                                      outline=self.o1.pk, storynode=self.chap1.pk)
+            assert list(self.last_response.data.keys()) == ['id', 'name']
+            assert len([query for query in queries if 'fiction_outlines_storyelementnode' in query]) == 1
+
+    def test_nested_serializers_are_complete(self):
+        with self.login(username=self.user1.username):
+            self.sparse_get('fiction_outlines_api:character_item', {'fields': 'name,character_instances'},
+                            character=self.c1.pk)
+            assert list(self.last_response.data.keys()) == ['name', 'character_instances']
+            assert 'main_character' in self.last_response.data['character_instances'][0]
+
+    def test_writes_use_all_fields(self):
+        url = self.reverse('fiction_outlines_api:series_item', series=self.s1.pk) + '?fields=title'
+        with self.login(username=self.user1.username):
+            self.last_response = self.client.patch(url, data={'description': 'Changed'}, format='json')
+            self.response_200()
+            assert self.last_response.data['description'] == 'Changed'
+            assert 'tags' in self.last_response.data
@@ -0,0 +1,275 @@
+import json
+import logging
+import pytest
+from io import BytesIO, StringIO, TextIOWrapper
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from fiction_outlines.models import Series, Character, Outline, CharacterInstance
+from fiction_outlines.models import StoryElementNode, ArcElementNode
+from fiction_outlines_api.cache import get_revisions
+from fiction_outlines_api.imports import OutlineImporter, OutlineImportError
+from .test_views import FictionOutlineAbstractTestCase
+
+logger = logging.getLogger('test_imports')
+logger.setLevel(logging.DEBUG)
+
+
+def document(records):
+    return '\n'.join(json.dumps(record) for record in records) + '\n'
+
+
+def story_records(chapters=3, scenes=4, prefix=''):
+    '''
+    Records of a story tree with a part, chapters and scenes.
+    '''
+    records = [{'type': 'story_node', 'id': 'root', 'parent': None, 'story_element_type': 'root'},
+               {'type': 'story_node', 'id': 'part', 'parent': 'root', 'story_element_type': 'part',
+                'name': '%spart' % prefix}]
+    for x in range(chapters):
+        records.append({'type': 'story_node', 'id': 'chapter %d' % x, 'parent': 'part',
+                        'story_element_type': 'chapter', 'name': '%schapter %d' % (prefix, x)})
+        records.extend({'type': 'story_node', 'id': 'scene %d.%d' % (x, y), 'parent': 'chapter %d' % x,
+                        'story_element_type': 'ss', 'name': '%sscene %d.%d' % (prefix, x, y),
+                        'description': 'Something happens.'} for y in range(scenes))
+    return records
+
+
+def outline_records(chapters=3, scenes=4):
+    return [
+        {'type': 'series', 'id': 's1', 'title': 'Imported series', 'tags': ['imported', 'fantasy']},
+        {'type': 'character', 'id': 'c1', 'name': 'Imported hero', 'tags': ['brave'], 'series': ['s1']},
+        {'type': 'location', 'id': 'l1', 'name': 'Imported castle', 'series': ['s1']},
+        {'type': 'outline', 'id': 'o1', 'title': 'Imported outline', 'series': 's1', 'tags': ['imported']},
+        {'type': 'character_instance', 'id': 'ci1', 'character': 'c1', 'protagonist': True},
+        {'type': 'location_instance', 'id': 'li1', 'location': 'l1'},
+    ] + story_records(chapters, scenes) + [
+        {'type': 'arc', 'id': 'a1', 'name': 'Imported arc', 'mace_type': 'character'},
+        {'type': 'arc_node', 'id': 'an root', 'arc': 'a1', 'parent': None, 'arc_element_type': 'root',
+         'description': 'Root'},
+        {'type': 'arc_node', 'id': 'an hook', 'arc': 'a1', 'parent': 'an root', 'arc_element_type': 'mile_hook',
+         'description': 'The hook\nMore about it', 'story_element_node': 'scene 0.0',
+         'assoc_characters': ['ci1'], 'assoc_locations': ['li1']},
+        {'type': 'arc_node', 'id': 'an tf', 'arc': 'a1', 'parent': 'an root', 'arc_element_type': 'tf',
+         'description': 'Try'},
+        {'type': 'arc_node', 'id': 'an beat', 'arc': 'a1', 'parent': 'an tf', 'arc_element_type': 'beat',
+         'description': 'Fail', 'story_element_node': 'scene 1.0'},
+    ]
+
+
+class OutlineImporterTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the outline importer.
+    '''
+
+    def run_import(self, records, **kwargs):
+        # The blank last line is skipped.
+        return OutlineImporter(self.user1, **kwargs).run((document(records) + '\n').splitlines())
+
+    def test_import(self):
+        outline = self.run_import(outline_records())
+        outline = Outline.objects.get(pk=outline.pk)
+        assert outline.user == self.user1
+        assert outline.series.title == 'Imported series'
+        assert sorted(outline.tags.names()) == ['imported']
+        assert sorted(outline.series.tags.names()) == ['fantasy', 'imported']
+        character = Character.objects.get(name='Imported hero')
+        assert list(character.series.all()) == [outline.series]
+        assert list(character.tags.names()) == ['brave']
+        assert CharacterInstance.objects.get(outline=outline).protagonist
+        root = outline.story_tree_root
+        assert [(node.name, node.depth) for node in StoryElementNode.get_tree(root)][:4] == [
+            (None, 1), ('part', 2), ('chapter 0', 3), ('scene 0.0', 4)]
+        assert StoryElementNode.objects.filter(outline=outline).count() == 17
+        assert not any(StoryElementNode.find_problems())
+        arc = outline.arc_set.get()
+        assert [node.arc_element_type for node in ArcElementNode.get_tree(arc.arc_root_node)] == [
+            'root', 'mile_hook', 'tf', 'beat']
+        assert not any(ArcElementNode.find_problems())
+        hook = ArcElementNode.objects.get(arc=arc, arc_element_type='mile_hook')
+        assert hook.headline == 'The hook'
+        assert hook.story_element_node.name == 'scene 0.0'
+        # The linked story node gets the characters and locations of the arc node.
+        assert hook.story_element_node.assoc_characters.get().character == character
+        assert hook.story_element_node.assoc_locations.get().location.name == 'Imported castle'
+
+    def test_trees_stay_valid(self):
+        '''
+        Imported roots are allocated after the existing ones, and treebeard can keep working on them.
+        '''
+        records = outline_records()
+        del records[3]['series']
+        outline = self.run_import(records)
+        assert outline.series is None
+        outline.story_tree_root.add_child(story_element_type='chapter', name='Added later')
+        Outline.objects.create(title='Created later', user=self.user1).create_arc(name='Later', mace_type='idea')
+        assert not any(StoryElementNode.find_problems())
+        assert not any(ArcElementNode.find_problems())
+
+    def test_fixed_query_count(self):
+        def count_queries(chapters):
+            with CaptureQueriesContext(connection) as queries:
+                self.run_import(outline_records(chapters=chapters), batch_size=1000)
+            return len([query for query in queries if 'SAVEPOINT' not in query['sql']])
+
+        # The first import creates the tags. SQLite limits the rows of one insert, so the trees stay small.
+        count_queries(2)
+        assert count_queries(2) == count_queries(8)
+
+    def test_batches(self):
+        outline = self.run_import(outline_records(chapters=10), batch_size=7)
+        assert StoryElementNode.objects.filter(outline=outline).count() == 52
+        assert not any(StoryElementNode.find_problems())
+
+    def test_invalidates_outline(self):
+        outline = self.run_import(outline_records())
+        assert get_revisions([outline.pk])[outline.pk]
+
+    @override_settings(TAGGIT_CASE_INSENSITIVE=True)
+    def test_case_insensitive_tags(self):
+        self.c1.tags.add('Brave')
+        self.run_import(outline_records())
+        assert list(Character.objects.get(name='Imported hero').tags.names()) == ['Brave']
+
+    def assert_invalid(self, records, message, line=None):
+        with pytest.raises(OutlineImportError) as info:
+            self.run_import(records)
+        assert message in info.value.message
+        assert info.value.line == line
+        assert not Outline.objects.filter(title='Imported outline').exists()
+        assert not Series.objects.filter(title='Imported series').exists()
+
+    def test_invalid_records(self):
+        records = outline_records()
+        cases = [
+            ({'type': 'story_node', 'parent': 'part'}, 'needs an id'),
+            ({'type': 'story_node', 'id': 'part', 'parent': 'root'}, 'Duplicate story_node id'),
+            ({'type': 'novel', 'id': 'n'}, 'Unknown record type'),
+            ({'type': 'story_node', 'id': 'x', 'parent': 'nowhere'}, 'Unknown parent'),
+            ({'type': 'story_node', 'id': 'x', 'parent': 'part', 'story_element_type': 'book'},
+             'book is not an allowed child of part'),
+            ({'type': 'story_node', 'id': 'x', 'parent': 'part', 'story_element_type': 'novel'},
+             'story_element_type'),
+            ({'type': 'story_node', 'id': 'x', 'parent': None, 'story_element_type': 'root'}, 'one root'),
+            ({'type': 'story_node', 'id': 'x', 'parent': 'part', 'assoc_characters': 'ci1'}, 'must be a list'),
+            ({'type': 'story_node', 'id': 'x', 'parent': 'part', 'assoc_locations': ['ci1']},
+             'Unknown location_instance'),
+            ({'type': 'outline', 'id': 'o2', 'title': 'Second'}, 'only hold one outline'),
+            ({'type': 'character_instance', 'id': 'ci2', 'character': 'c1'}, 'already has an instance'),
+            ({'type': 'character_instance', 'id': 'ci2'}, 'character is required'),
+            ({'type': 'character', 'id': 'c2', 'name': 'Tagged', 'tags': 'brave'}, 'tags must be a list'),
+            ({'type': 'arc_node', 'id': 'x', 'arc': 'a1', 'parent': None, 'arc_element_type': 'root',
+              'description': 'Root'}, 'only have one root'),
+            ({'type': 'arc_node', 'id': 'x', 'arc': 'a1', 'parent': 'an tf', 'arc_element_type': 'root',
+              'description': 'Root'}, 'Only the root'),
+            ({'type': 'arc_node', 'id': 'x', 'arc': 'a1', 'parent': 'an root', 'arc_element_type': 'mile_hook',
+              'description': 'Again'}, 'two of the same milestone'),
+            ({'type': 'arc_node', 'id': 'x', 'arc': 'a1', 'parent': 'an hook', 'arc_element_type': 'mile_pt1',
+              'description': 'Nested'}, 'child to another milestone'),
+            ({'type': 'arc_node', 'id': 'x', 'arc': 'a1', 'parent': 'an tf', 'arc_element_type': 'beat',
+              'description': 'Linked', 'story_element_node': 'nowhere'}, 'Unknown story_node'),
+        ]
+        for record, message in cases:
+            self.assert_invalid(records + [record], message, line=len(records) + 1)
+
+    def test_invalid_documents(self):
+        records = outline_records()
+        self.assert_invalid(records[:1] + ['not an object'], 'JSON object', line=2)
+        with pytest.raises(OutlineImportError) as info:
+            OutlineImporter(self.user1).run(['{"type": "series", '])
+        assert 'Invalid JSON' in str(info.value)
+        assert str(info.value).startswith('Line 1: ')
+        self.assert_invalid(records[:3], 'does not hold an outline')
+        self.assert_invalid(records[:6], 'has no root')
+        self.assert_invalid(records[:-4], 'arc a1 has no root')
+        self.assert_invalid([records[4]], 'must come before', line=1)
+        second_arc = [{'type': 'arc', 'id': 'a2', 'name': 'Second', 'mace_type': 'event'},
+                      {'type': 'arc_node', 'id': 'a2 root', 'arc': 'a2', 'parent': None, 'arc_element_type': 'root',
+                       'description': 'Root'},
+                      {'type': 'arc_node', 'id': 'x', 'arc': 'a2', 'parent': 'an root', 'arc_element_type': 'tf',
+                       'description': 'Wrong arc'}]
+        self.assert_invalid(records + second_arc, 'same arc', line=len(records) + 3)
+        self.assert_invalid(records[:6] + [{'type': 'story_node', 'id': 'root', 'parent': None,
+                                            'story_element_type': 'part'}], 'must have the type root', line=7)
+        self.assert_invalid(records + [{'type': 'arc', 'id': 'a2', 'name': 'Second', 'mace_type': 'event'},
+                                       {'type': 'arc_node', 'id': 'a2 root', 'arc': 'a2', 'parent': None,
+                                        'arc_element_type': 'tf', 'description': 'Root'}],
+                            'must have the type root', line=len(records) + 2)
+        assert str(OutlineImportError('Incomplete')) == 'Incomplete'
+
+    def test_too_deep(self):
+        records = outline_records()
+        nodes = [{'type': 'arc_node', 'id': 'tf 0', 'arc': 'a1', 'parent': 'an root', 'arc_element_type': 'tf',
+                  'description': 'Deep'}]
+        nodes.extend({'type': 'arc_node', 'id': 'tf %d' % x, 'arc': 'a1', 'parent': 'tf %d' % (x - 1),
+                      'arc_element_type': 'tf', 'description': 'Deep'} for x in range(1, 210))
+        with pytest.raises(OutlineImportError) as info:
+            self.run_import(records + nodes)
+        assert 'too deep' in info.value.message
+
+
+class OutlineImportViewTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the import endpoint.
+    '''
+
+    def post_document(self, body, username=None):
+        with self.login(username=username or self.user1.username):
+            self.post('fiction_outlines_api:outline_import', data=body,
+                      extra={'content_type': 'application/x-ndjson'})
+        return self.last_response.data
+
+    def test_login_required(self):
+        self.post('fiction_outlines_api:outline_import', data=document(outline_records()),
+                  extra={'content_type': 'application/x-ndjson'})
+        self.response_403()
+
+    def test_import(self):
+        data = self.post_document(document(outline_records()))
+        self.response_201()
+        assert data['title'] == 'Imported outline'
+        assert data['counts']['story_node'] == 17
+        assert Outline.objects.get(pk=data['id']).user == self.user1
+
+    def test_invalid_document(self):
+        data = self.post_document(document(outline_records()[1:]))
+        self.response_400()
+        assert data['line'] == '1'
+        assert 'Unknown series' in data['detail']
+        self.post_document('')
+        self.response_400()
+
+
+class ImportOutlineCommandTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for the ``import_outline`` management command.
+    '''
+
+    def test_import(self):
+        path = self.tmp_path / 'outline.ndjson'
+        path.write_text(document(outline_records()))
+        out = StringIO()
+        call_command('import_outline', self.user1.username, str(path), '--batch-size=5', stdout=out)
+        assert 'Imported outline Imported outline' in out.getvalue()
+        assert '17 story_node' in out.getvalue()
+        assert Outline.objects.get(title='Imported outline').user == self.user1
+
+    def test_standard_input(self):
+        stdin = TextIOWrapper(BytesIO(document(outline_records()).encode('utf-8')))
+        with mock.patch('sys.stdin', stdin):
+            call_command('import_outline', self.user1.username, '-', stdout=StringIO())
+        assert Outline.objects.get(title='Imported outline').user == self.user1
+
+    def test_errors(self):
+        path = self.tmp_path / 'outline.ndjson'
+        path.write_text(document(outline_records()[1:]))
+        with pytest.raises(CommandError, match='Line 1'):
+            call_command('import_outline', self.user1.username, str(path))
+        with pytest.raises(CommandError, match='no user'):
+            call_command('import_outline', 'nobody', str(path))
+
+    @pytest.fixture(autouse=True)
+    def set_tmp_path(self, tmp_path):
+        self.tmp_path = tmp_path
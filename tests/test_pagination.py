@@ -0,0 +1,73 @@
+import logging
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from fiction_outlines.models import Series, Character, Location, Outline
+from .test_views import FictionOutlineAbstractTestCase
+
+logger = logging.getLogger('test_pagination')
+logger.setLevel(logging.DEBUG)
+
+
+class CursorPaginationTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for opt-in keyset pagination on list views.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        for x in range(12):
+            Series.objects.create(title='Paged series %d' % x, user=self.user1)
+            Character.objects.create(name='Paged character %d' % x, user=self.user1)
+            Location.objects.create(name='Paged location %d' % x, user=self.user1)
+            Outline.objects.create(title='Paged outline %d' % x, user=self.user1)
+
+    def walk(self, url_name, page_size=5):
+        '''
+        Follows the ``next`` links, returning the ids found and the queries of each page.
+        '''
+        ids = []
+        page_queries = []
+        next_url = None
+        with self.login(username=self.user1.username):
+            while True:
+                with CaptureQueriesContext(connection) as queries:
+                    if next_url:
+                        self.last_response = self.client.get(next_url)
+                    else:
+                        self.get(url_name, data={'page_size': page_size}, extra=self.extra)
+                self.response_200()
+                assert len(self.last_response.data['results']) <= page_size
+                ids.extend(item['id'] for item in self.last_response.data['results'])
+                page_queries.append(queries)
+                next_url = self.last_response.data['next']
+                if not next_url:
+                    return ids, page_queries
+
+    def assert_paginates(self, url_name, model):
+        ids, page_queries = self.walk(url_name)
+        expected = sorted(str(pk) for pk in model.objects.filter(user=self.user1).values_list('pk', flat=True))
+        assert ids == expected
+        assert len(page_queries) > 2
+        assert len(page_queries[0]) == len(page_queries[-2])
+        for queries in page_queries:
+            assert not any('COUNT(' in query['sql'] for query in queries)
+
+    def test_series(self):
+        self.assert_paginates('fiction_outlines_api:series_listcreate', Series)
+
+    def test_characters(self):
+        self.assert_paginates('fiction_outlines_api:character_listcreate', Character)
+
+    def test_locations(self):
+        self.assert_paginates('fiction_outlines_api:location_listcreate', Location)
+
+    def test_outlines(self):
+        ids, page_queries = self.walk('fiction_outlines_api:outline_listcreate')
+        assert len(ids) == Outline.objects.filter(user=self.user1).count()
+        assert len(page_queries[0]) == len(page_queries[-2])
+
+    def test_opt_in(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:character_listcreate', extra=self.extra)
+            self.response_200()
+            assert len(self.last_response.data) == Character.objects.filter(user=self.user1).count()
@@ -0,0 +1,136 @@
+import logging
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from fiction_outlines.models import Series, Character, Outline, StoryElementNode
+from fiction_outlines_api.permissions import PermissionCache, get_permission_cache
+from .test_views import ArcNodeAbstractTestCase
+
+logger = logging.getLogger('test_permissions')
+logger.setLevel(logging.DEBUG)
+
+
+class PermissionCacheTest(ArcNodeAbstractTestCase):
+    '''
+    Tests for the request-scoped permission cache.
+    '''
+
+    def test_memoizes_decisions(self):
+        cache = PermissionCache()
+        assert cache.has_perm(self.user1, 'fiction_outlines.edit_character', self.c1)
+        assert not cache.has_perm(self.user2, 'fiction_outlines.edit_character', self.c1)
+        assert (cache.hits, cache.misses) == (0, 2)
+        # Another copy of the same row is the same object.
+        assert cache.has_perm(self.user1, 'fiction_outlines.edit_character', Character.objects.get(pk=self.c1.pk))
+        assert not cache.has_perm(self.user2, 'fiction_outlines.edit_character', self.c1)
+        assert cache.has_perm(self.user1, 'fiction_outlines_api.valid_user')
+        assert cache.has_perm(self.user1, 'fiction_outlines_api.valid_user')
+        assert (cache.hits, cache.misses) == (3, 3)
+        cache.clear()
+        assert cache.has_perm(self.user1, 'fiction_outlines.edit_character', self.c1)
+        assert (cache.hits, cache.misses) == (3, 4)
+
+    def test_unsaved_objects(self):
+        cache = PermissionCache()
+        character = Character(name='Unsaved', user=self.user1)
+        assert cache.has_perm(self.user1, 'fiction_outlines.edit_character', character)
+        assert cache.has_perm(self.user1, 'fiction_outlines.edit_character', character)
+        assert (cache.hits, cache.misses) == (0, 0)
+
+    def test_one_cache_per_request(self):
+        request = RequestFactory().get('/')
+        assert get_permission_cache(request) is get_permission_cache(request)
+        assert get_permission_cache(request) is not get_permission_cache(RequestFactory().get('/'))
+
+    def get_counters(self, url_name, data=None, **kwargs):
+        with self.login(username=self.user1.username):
+            self.post(url_name, data=data, **kwargs)
+        return self.last_response['X-Permission-Cache']
+
+    @override_settings(DEBUG=True)
+    def test_move_counters(self):
+        target = self.o1_valid_storynode.add_sibling(story_element_type='chapter', name='Chapter Two',
+                                                     description='More')
+        counters = self.get_counters('fiction_outlines_api:storynode_move', node_to_move_id=self.o1_valid_storynode.pk,
+                                     target_node_id=target.pk, position='right')
+        self.response_200()
+        assert counters == 'hits=0, misses=3'
+
+    @override_settings(DEBUG=True)
+    def test_create_counters(self):
+        counters = self.get_counters('fiction_outlines_api:storynode_create', storynode=self.o1_valid_storynode.pk,
+                                     action='add_child', position=None,
+                                     data={'story_element_type': 'ss', 'name': 'Scene', 'description': 'Scene'})
+        self.response_201()
+        assert counters == 'hits=0, misses=2'
+        assert StoryElementNode.objects.get(pk=self.last_response.data['id']).name == 'Scene'
+
+    def test_no_header_without_debug(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:character_item', character=self.c1.pk, extra=self.extra)
+        self.response_200()
+        assert 'X-Permission-Cache' not in self.last_response
+
+
+class SeriesPermissionsTest(ArcNodeAbstractTestCase):
+    '''
+    Series attached on writes are checked together.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.own_series = [Series.objects.create(title='Own series %d' % x, user=self.user1) for x in range(5)]
+
+    def post_character(self, series):
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as queries:
+                self.post('fiction_outlines_api:character_listcreate', extra=self.extra,
+                          data={'name': 'Batch', 'tags': '[]', 'series': [item.pk for item in series]})
+        return [query for query in queries
+                if 'fiction_outlines_series' in query['sql'] and 'auth_user' in query['sql']]
+
+    def test_single_query(self):
+        assert len(self.post_character(self.own_series)) == 1
+        self.response_201()
+        assert Character.objects.get(pk=self.last_response.data['id']).series.count() == 5
+
+    def test_reports_all_denied_series(self):
+        foreign_series = Series.objects.create(title='Foreign', user=self.user2)
+        assert len(self.post_character([self.s3] + self.own_series + [foreign_series])) == 1
+        self.response_403()
+        assert self.last_response.data['series'] == [str(self.s3.pk), str(foreign_series.pk)]
+        assert not Character.objects.filter(name='Batch').exists()
+
+    def test_no_series(self):
+        assert not self.post_character([])
+        self.response_201()
+
+
+class MultiObjectPermissionsTest(ArcNodeAbstractTestCase):
+    '''
+    The instance create views load their objects together with the owners the rules compare.
+    '''
+
+    def count_queries(self, url_name, **kwargs):
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as queries:
+                self.post(url_name, data={}, extra=self.extra, **kwargs)
+        return len([query for query in queries if 'SAVEPOINT' not in query['sql']])
+
+    def test_character_instance_create(self):
+        outline = Outline.objects.create(title='New outline', user=self.user1)
+        # Session, user, character with its owner, outline with its owner and the insert.
+        assert self.count_queries('fiction_outlines_api:character_instance_create', character=self.c1.pk,
+                                  outline=outline.pk) == 5
+        self.response_201()
+
+    def test_location_instance_create(self):
+        outline = Outline.objects.create(title='New outline', user=self.user1)
+        assert self.count_queries('fiction_outlines_api:location_instance_create', location=self.l1.pk,
+                                  outline=outline.pk) == 5
+        self.response_201()
+
+    def test_missing_object(self):
+        self.count_queries('fiction_outlines_api:character_instance_create', character=self.c1.pk,
+                           outline=self.c1.pk)
+        self.response_404()
@@ -0,0 +1,182 @@
+import logging
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from fiction_outlines.models import Series, Character, Location, Outline, CharacterInstance, LocationInstance
+from fiction_outlines.models import StoryElementNode
+from .test_views import FictionOutlineAbstractTestCase, ArcNodeAbstractTestCase
+
+logger = logging.getLogger('test_prefetching')
+logger.setLevel(logging.DEBUG)
+
+
+class QueryBudgetTestCase(FictionOutlineAbstractTestCase):
+    '''
+    Checks that responses cost a fixed number of queries, however many related records they render.
+    '''
+
+    def count_queries(self, url_name, **kwargs):
+        '''
+        Counts the queries of a GET, leaving out the savepoints of ``ATOMIC_REQUESTS``.
+        '''
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as queries:
+                self.get(url_name, extra=self.extra, **kwargs)
+            self.response_200()
+        # Treebeard rewrites the paths of the shifted siblings with one update each.
+        return len([query for query in queries
+                    if 'SAVEPOINT' not in query['sql'] and not query['sql'].startswith('UPDATE')])
+
+    def assert_budget(self, url_name, budget, grow=None, **kwargs):
+        '''
+        The query count must stay within the budget, and must not change when ``grow`` adds more records.
+        '''
+        # The first request fills the content type cache used by the tag lookups.
+        self.count_queries(url_name, **kwargs)
+        before = self.count_queries(url_name, **kwargs)
+        assert before <= budget, before
+        if grow is not None:
+            grow()
+            assert self.count_queries(url_name, **kwargs) == before
+
+
+class CharacterQueryBudgetTest(QueryBudgetTestCase):
+    '''
+    Query budgets for the character views.
+    '''
+    # Session, user, characters, series, tags and character instances.
+    list_budget = 6
+    # Session, user, character with its owner, series, tags and character instances.
+    detail_budget = 6
+
+    def add_related(self, characters, count=3):
+        for x in range(count):
+            series = Series.objects.create(title='Budget series %d' % x, user=self.user1)
+            outline = Outline.objects.create(title='Budget outline %d' % x, user=self.user1)
+            for character in characters:
+                character.series.add(series)
+                character.tags.add('budget-tag-%d' % x)
+                CharacterInstance.objects.create(character=character, outline=outline)
+
+    def add_characters(self, count=10):
+        characters = [Character.objects.create(name='Budget character %d' % x, user=self.user1)
+                      for x in range(count)]
+        self.add_related(characters)
+
+    def test_list(self):
+        self.assert_budget('fiction_outlines_api:character_listcreate', self.list_budget, self.add_characters)
+        assert len(self.last_response.data) == Character.objects.filter(user=self.user1).count()
+        assert all(len(character['series']) for character in self.last_response.data)
+
+    def test_detail(self):
+        self.assert_budget('fiction_outlines_api:character_item', self.detail_budget,
+                           lambda: self.add_related([self.c1]), character=self.c1.pk)
+        assert len(self.last_response.data['character_instances']) == self.c1.characterinstance_set.count()
+        assert self.last_response.data['character_instances'][0]['name'] == self.c1.name
+
+    def test_omitted_fields_are_not_prefetched(self):
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as queries:
+                self.get('fiction_outlines_api:character_listcreate', data={'fields': 'id,name'}, extra=self.extra)
+            self.response_200()
+        assert not any('taggit' in query['sql'] or 'characterinstance' in query['sql'] for query in queries)
+
+    def test_instance_detail(self):
+        # Session, user and the instance with its character and owner.
+        self.assert_budget('fiction_outlines_api:character_instance_item', 3, character=self.c1.pk,
+                           instance=self.c1int.pk)
+        assert self.last_response.data['name'] == self.c1.name
+
+
+class LocationQueryBudgetTest(QueryBudgetTestCase):
+    '''
+    Query budgets for the location views.
+    '''
+    # Session, user, locations, series, tags and location instances.
+    list_budget = 6
+    # Session, user, location with its owner, series, tags and location instances.
+    detail_budget = 6
+
+    def add_related(self, locations, count=3):
+        for x in range(count):
+            series = Series.objects.create(title='Budget series %d' % x, user=self.user1)
+            outline = Outline.objects.create(title='Budget outline %d' % x, user=self.user1)
+            for location in locations:
+                location.series.add(series)
+                location.tags.add('budget-tag-%d' % x)
+                LocationInstance.objects.create(location=location, outline=outline)
+
+    def add_locations(self, count=10):
+        self.add_related([Location.objects.create(name='Budget location %d' % x, user=self.user1)
+                          for x in range(count)])
+
+    def test_list(self):
+        self.assert_budget('fiction_outlines_api:location_listcreate', self.list_budget, self.add_locations)
+        assert len(self.last_response.data) == Location.objects.filter(user=self.user1).count()
+        assert all(len(location['series']) for location in self.last_response.data)
+
+    def test_detail(self):
+        self.assert_budget('fiction_outlines_api:location_item', self.detail_budget,
+                           lambda: self.add_related([self.l1]), location=self.l1.pk)
+        assert len(self.last_response.data['location_instances']) == self.l1.locationinstance_set.count()
+        assert self.last_response.data['location_instances'][0]['name'] == self.l1.name
+
+    def test_instance_detail(self):
+        # Session, user and the instance with its location and owner.
+        self.assert_budget('fiction_outlines_api:location_instance_item', 3, location=self.l1.pk,
+                           instance=self.l1int.pk)
+        assert self.last_response.data['name'] == self.l1.name
+
+
+class NodeMoveQueryCountTest(ArcNodeAbstractTestCase):
+    '''
+    A move costs a fixed number of queries, however large the tree around it is.
+    '''
+    # Session, user, both nodes with their owners, the tree manipulation checks, the refresh of the tree fields
+    # and the serialization of the moved node.
+    story_move_queries = 13
+    arc_move_queries = 9
+
+    def count_move_queries(self, url_name, source, target, position):
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as queries:
+                self.post(url_name, node_to_move_id=source.pk, target_node_id=target.pk, position=position,
+                          extra=self.extra)
+            self.response_200()
+        # Treebeard rewrites the paths of the shifted siblings with one update each.
+        return len([query for query in queries
+                    if 'SAVEPOINT' not in query['sql'] and not query['sql'].startswith('UPDATE')])
+
+    def add_chapters(self, count=5):
+        for x in range(count):
+            self.part1.refresh_from_db()
+            chapter = self.part1.add_child(story_element_type='chapter', name='Chapter %d' % x, description='More')
+            for y in range(3):
+                chapter.refresh_from_db()
+                chapter.add_child(story_element_type='ss', name='Scene %d' % y, description='More')
+        return chapter
+
+    def test_story_node_move(self):
+        target = self.add_chapters(1)
+        self.o1_valid_storynode.refresh_from_db()
+        assert self.count_move_queries('fiction_outlines_api:storynode_move', self.o1_valid_storynode, target,
+                                       'right') == self.story_move_queries
+        assert StoryElementNode.objects.get(pk=self.o1_valid_storynode.pk).get_prev_sibling() == target
+        assert self.last_response.data['id'] == str(self.o1_valid_storynode.pk)
+        target = self.add_chapters()
+        self.o1_valid_storynode.refresh_from_db()
+        assert self.count_move_queries('fiction_outlines_api:storynode_move', self.o1_valid_storynode, target,
+                                       'right') == self.story_move_queries
+
+    def test_arc_node_move(self):
+        root = self.arc1.arc_root_node
+        for target in (root.get_children()[1], root.get_children()[4]):
+            assert self.count_move_queries('fiction_outlines_api:arcnode_move', self.node_to_test, target,
+                                           'right') == self.arc_move_queries
+            self.node_to_test.refresh_from_db()
+            assert self.node_to_test.get_prev_sibling() == target
+
+    def test_missing_node(self):
+        with self.login(username=self.user1.username):
+            self.post('fiction_outlines_api:storynode_move', node_to_move_id=self.o1_valid_storynode.pk,
+                      target_node_id=self.o1.pk, position='right', extra=self.extra)
+        self.response_404()
@@ -0,0 +1,78 @@
+import io
+import json
+import logging
+import uuid
+from decimal import Decimal
+from unittest import mock
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from fiction_outlines_api import renderers
+from fiction_outlines_api.parsers import FastJSONParser
+from fiction_outlines_api.renderers import FastJSONRenderer
+from fiction_outlines_api.views import OutlineDetail
+from .test_trees import TreeAbstractTestCase
+
+logger = logging.getLogger('test_renderers')
+logger.setLevel(logging.DEBUG)
+
+
+class FastJSONTest(TreeAbstractTestCase):
+    '''
+    Tests for the optional orjson renderer and parser.
+    '''
+
+    def get_outline(self, **extra):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_item', outline=self.o1.pk, extra=dict(self.extra, **extra))
+            self.response_200()
+        return self.last_response
+
+    def test_renders_like_default(self):
+        data = self.get_outline().data
+        fast = FastJSONRenderer().render(data, 'application/json')
+        assert isinstance(fast, bytes)
+        assert json.loads(fast) == json.loads(JSONRenderer().render(data, 'application/json'))
+
+    def test_native_and_fallback_types(self):
+        pk = uuid.uuid4()
+        data = {'id': pk, 'ids': (pk,), 'amount': Decimal('1.5'), 'label': _('Annotated list'), 1: 'key'}
+        assert json.loads(FastJSONRenderer().render(data)) == {'id': str(pk), 'ids': [str(pk)], 'amount': 1.5,
+                                                               'label': 'Annotated list', '1': 'key'}
+        assert FastJSONRenderer().render(None) == b''
+
+    def test_indent(self):
+        data = {'id': uuid.uuid4()}
+        assert FastJSONRenderer().render(data, 'application/json; indent=2').startswith(b'{\n  "id"')
+        assert (FastJSONRenderer().render(data, 'application/json; indent=4') ==
+                JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_fallback_without_orjson(self):
+        data = self.get_outline().data
+        with mock.patch.object(renderers, 'orjson', None):
+            assert FastJSONRenderer().render(data) == JSONRenderer().render(data)
+        with mock.patch('fiction_outlines_api.parsers.orjson', None):
+            assert FastJSONParser().parse(io.BytesIO(b'{"title": "OOGA"}')) == {'title': 'OOGA'}
+
+    def test_parse(self):
+        body = '{"title": "Café", "series": null}'
+        for encoding in ('utf-8', 'latin-1'):
+            stream = io.BytesIO(body.encode(encoding))
+            assert FastJSONParser().parse(stream, parser_context={'encoding': encoding}) == JSONParser().parse(
+                io.BytesIO(body.encode(encoding)), parser_context={'encoding': encoding})
+        for invalid in (b'{"title": ', b'{"length": NaN}'):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(io.BytesIO(invalid))
+
+    def test_views(self):
+        with mock.patch.object(OutlineDetail, 'renderer_classes', [FastJSONRenderer, BrowsableAPIRenderer]):
+            with mock.patch.object(OutlineDetail, 'parser_classes', [FastJSONParser]):
+                expected = self.get_outline().data
+                assert json.loads(self.last_response.content) == json.loads(JSONRenderer().render(expected))
+                assert b'<html' in self.get_outline(HTTP_ACCEPT='text/html').content
+                with self.login(username=self.user1.username):
+                    self.patch('fiction_outlines_api:outline_item', outline=self.o1.pk,
+                               data={'title': 'Café'}, extra=self.extra)
+                    self.response_200()
+                    assert self.last_response.data['title'] == 'Café'
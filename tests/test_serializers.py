@@ -1,4 +1,11 @@
+from unittest import mock
+from rest_framework import serializers
 from test_plus import APITestCase
+from fiction_outlines.models import ArcElementNode
+from fiction_outlines_api.serializers import CompiledSerializer, StoryElementNodeSerializer, StoryTreeNodeSerializer
+from fiction_outlines_api.serializers import ArcElementNodeSerializer
+from fiction_outlines_api.trees import StoryTree, ArcTree
+from .test_trees import TreeAbstractTestCase
 
 
 class SeriesListTestCase(APITestCase):
@@ -8,3 +15,53 @@ class SeriesListTestCase(APITestCase):
 
     def test_login_required(self):
         pass
+
+
+class MissingFieldSerializer(StoryElementNodeSerializer):
+    missing = serializers.ReadOnlyField()
+
+    class Meta(StoryElementNodeSerializer.Meta):  # pragma: no cover
+        fields = StoryElementNodeSerializer.Meta.fields + ('missing',)
+
+
+class CompiledSerializerTest(TreeAbstractTestCase):
+    '''
+    The compiled field plans must give the same output as the serializers they are built from.
+    '''
+
+    def assert_same_output(self, serializer_class, nodes, context=None):
+        context = context or {}
+        expected = serializer_class(nodes, many=True, context=context).data
+        compiled = CompiledSerializer(serializer_class, context).to_representation_many(nodes)
+        assert len(compiled) == len(nodes)
+        assert [list(node_data.items()) for node_data in compiled] == [
+            list(node_data.items()) for node_data in expected]
+
+    def test_story_nodes(self):
+        tree = StoryTree(self.o1)
+        self.assert_same_output(StoryElementNodeSerializer, tree.nodes, {'tree_aggregates': tree.aggregates})
+        self.assert_same_output(StoryTreeNodeSerializer, tree.nodes, {'tree_aggregates': tree.aggregates})
+        # Without aggregates, the model properties are used.
+        self.assert_same_output(StoryElementNodeSerializer, tree.nodes[:3],
+                                {'omit': {'all_characters', 'all_locations'}})
+
+    def test_arc_nodes(self):
+        self.assert_same_output(ArcElementNodeSerializer, ArcTree(self.arc1).nodes)
+        # Relations that were not prefetched are loaded as usual.
+        self.assert_same_output(ArcElementNodeSerializer, list(ArcElementNode.objects.filter(arc=self.arc1)))
+
+    def test_sparse_fieldsets(self):
+        tree = StoryTree(self.o1)
+        for context in ({'fields': {'id', 'all_characters'}}, {'omit': {'description', 'impact_rating'}}):
+            self.assert_same_output(StoryElementNodeSerializer, tree.nodes,
+                                    dict(context, tree_aggregates=tree.aggregates))
+
+    def test_skipped_fields(self):
+        tree = StoryTree(self.o1)
+        self.assert_same_output(MissingFieldSerializer, tree.nodes, {'tree_aggregates': tree.aggregates})
+
+    def test_plan_is_compiled_once(self):
+        CompiledSerializer(StoryElementNodeSerializer)
+        with mock.patch.object(CompiledSerializer, 'compile') as compile_plan:
+            CompiledSerializer(StoryElementNodeSerializer, {'fields': {'id'}})
+            assert not compile_plan.called
@@ -0,0 +1,123 @@
+import json
+import logging
+from unittest import mock
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext
+from fiction_outlines.models import StoryElementNode
+from fiction_outlines_api import views
+from fiction_outlines_api.streaming import LightStoryTree, iter_outline, iter_full_rows
+from fiction_outlines_api.trees import iter_annotated_nodes
+from .test_trees import TreeAbstractTestCase
+
+logger = logging.getLogger('test_streaming')
+logger.setLevel(logging.DEBUG)
+
+
+class StreamingTest(TreeAbstractTestCase):
+    '''
+    Tests for ?stream=true on outline and arc views.
+    '''
+
+    def get_json(self, url_name, params=None, **kwargs):
+        params = params or {}
+        with self.login(username=self.user1.username):
+            self.get(url_name, data=params, extra=self.extra, **kwargs)
+            self.response_200()
+            assert not isinstance(self.last_response, StreamingHttpResponse)
+            expected = json.loads(self.last_response.content)
+            with CaptureQueriesContext(connection) as queries:
+                self.get(url_name, data=dict(params, stream='true'), extra=self.extra, **kwargs)
+                self.response_200()
+                assert isinstance(self.last_response, StreamingHttpResponse)
+                streamed = json.loads(b''.join(self.last_response.streaming_content))
+        return expected, streamed, queries
+
+    def assert_streams(self, url_name, params=None, **kwargs):
+        expected, streamed, queries = self.get_json(url_name, params, **kwargs)
+        assert streamed == expected
+        return streamed, queries
+
+    def test_iter_annotated_nodes(self):
+        nodes = list(StoryElementNode.objects.filter(outline=self.o1).order_by('path'))
+        expected = StoryElementNode.get_annotated_list(self.o1.story_tree_root)
+        assert [(node.pk, info) for node, info in expected] == [(node.pk, info) for node, info in
+                                                                iter_annotated_nodes(iter(nodes))]
+        assert list(iter_annotated_nodes([])) == []
+
+    def test_full_rows(self):
+        '''
+        Both passes must agree on the nodes even if the tree grows in between.
+        '''
+        tree = LightStoryTree(self.o1)
+        assert 'description' in tree.nodes[0].get_deferred_fields()
+        self.add_scenes(self.chap1, 2)
+        rows = list(iter_full_rows(tree.nodes, StoryElementNode.objects.filter(outline=self.o1), 2))
+        assert [row.pk for row in rows] == [node.pk for node in tree.nodes]
+        assert not rows[0].get_deferred_fields()
+
+    def test_outline(self):
+        streamed, queries = self.assert_streams('fiction_outlines_api:outline_item', outline=self.o1.pk)
+        assert len(streamed['outline_structure']) == len(self.scenes) + 3
+        assert self.last_response['ETag']
+
+    def test_outline_nested(self):
+        streamed, queries = self.assert_streams('fiction_outlines_api:outline_item', {'tree': 'nested'},
+                                                outline=self.o1.pk)
+        assert [node_data['id'] for node_data in streamed['outline_structure']] == [str(self.part1.pk)]
+
+    def test_outline_fields(self):
+        self.assert_streams('fiction_outlines_api:outline_item', {'fields': 'id,title'}, outline=self.o1.pk)
+        self.assert_streams('fiction_outlines_api:outline_item', {'fields': 'outline_structure'},
+                            outline=self.o1.pk)
+        self.assert_streams('fiction_outlines_api:outline_item', {'fields': 'outline_structure', 'tree': 'nested'},
+                            outline=self.o1.pk)
+
+    def test_outline_list(self):
+        for params in ({}, {'tree': 'nested'}, {'structure': 'false'}):
+            self.assert_streams('fiction_outlines_api:outline_listcreate', params)
+
+    def test_fixed_query_count(self):
+        '''
+        With a chunk size smaller than the tree, the rows are pulled in several chunks from one query.
+        '''
+        chunk_size = StoryElementNode.objects.filter(outline=self.o1).count() - 1
+        with CaptureQueriesContext(connection) as queries:
+            list(iter_outline(self.o1, {}, chunk_size))
+        self.add_scenes(self.chap1, 10)
+        self.o1.refresh_from_db()
+        with CaptureQueriesContext(connection) as more_queries:
+            chunks = list(iter_outline(self.o1, {}, chunk_size))
+        assert len(queries) == len(more_queries)
+        assert len(json.loads(''.join(chunks))['outline_structure']) == len(self.scenes) + 13
+
+    def test_arc(self):
+        for params in ({}, {'tree': 'nested'}, {'omit': 'arc_structure'}):
+            self.assert_streams('fiction_outlines_api:arc_item', params, outline=self.o1.pk, arc=self.arc1.pk)
+
+    def test_paginated_list_is_not_streamed(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_listcreate', data={'stream': 'true', 'page_size': 1},
+                     extra=self.extra)
+            self.response_200()
+            assert not isinstance(self.last_response, StreamingHttpResponse)
+            assert len(self.last_response.data['results']) == 1
+
+    def test_browsable_api_is_not_streamed(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_item', outline=self.o1.pk, data={'stream': 'true'},
+                     extra={'HTTP_ACCEPT': 'text/html'})
+            self.response_200()
+            assert not isinstance(self.last_response, StreamingHttpResponse)
+
+    def test_views_without_hooks_are_not_streamed(self):
+        with self.login(username=self.user1.username):
+            with mock.patch.object(views.OutlineDetail, 'stream_object', None):
+                self.get('fiction_outlines_api:outline_item', outline=self.o1.pk, data={'stream': 'true'},
+                         extra=self.extra)
+                self.response_200()
+                assert not isinstance(self.last_response, StreamingHttpResponse)
+            with mock.patch.object(views.OutlineList, 'stream_list', None):
+                self.get('fiction_outlines_api:outline_listcreate', data={'stream': 'true'}, extra=self.extra)
+                self.response_200()
+                assert not isinstance(self.last_response, StreamingHttpResponse)
@@ -0,0 +1,93 @@
+import logging
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from taggit.models import Tag
+from fiction_outlines.models import Series, Outline
+from fiction_outlines_api.cache import get_revisions
+from fiction_outlines_api.tags import set_tags
+from .test_views import FictionOutlineAbstractTestCase
+
+logger = logging.getLogger('test_tags')
+logger.setLevel(logging.DEBUG)
+
+
+class SetTagsTest(FictionOutlineAbstractTestCase):
+    '''
+    Tests for batched tag writes.
+    '''
+
+    def tag_names(self, obj):
+        return sorted(obj.tags.names())
+
+    def test_set_tags(self):
+        set_tags(self.c1.tags, ['anxiety', 'veteran', 'insomnia'])
+        assert self.tag_names(self.c1) == ['anxiety', 'insomnia', 'veteran']
+        # Tags of other objects are untouched.
+        assert self.tag_names(self.c2) == ['magical', 'teen']
+        set_tags(self.c1.tags, ['teen'])
+        assert self.tag_names(self.c1) == ['teen']
+        set_tags(self.c1.tags, [])
+        assert self.tag_names(self.c1) == []
+
+    def test_existing_and_conflicting_tags(self):
+        '''
+        Existing tags are reused, and a new tag whose slug is taken still gets created with a free slug.
+        '''
+        set_tags(self.c3.tags, ['teen', 'PTSD'])
+        assert self.tag_names(self.c3) == ['PTSD', 'teen']
+        assert Tag.objects.filter(name='teen').count() == 1
+        assert Tag.objects.get(name='PTSD').slug != Tag.objects.get(name='ptsd').slug
+
+    def test_fixed_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            set_tags(self.c1.tags, ['anxiety', 'one'])
+        with CaptureQueriesContext(connection) as more_queries:
+            set_tags(self.c2.tags, ['teen'] + ['tag %d' % x for x in range(20)])
+        assert len(queries) == len(more_queries)
+        assert len(self.tag_names(self.c2)) == 21
+
+    def test_invalidates_outline(self):
+        revision = get_revisions([self.o1.pk])[self.o1.pk]
+        set_tags(self.o1.tags, ['draft'])
+        assert get_revisions([self.o1.pk])[self.o1.pk] != revision
+
+    @override_settings(TAGGIT_CASE_INSENSITIVE=True)
+    def test_case_insensitive(self):
+        set_tags(self.c1.tags, ['ANXIETY', 'new'])
+        assert self.tag_names(self.c1) == ['anxiety', 'new']
+
+    def test_serializer_writes(self):
+        with self.login(username=self.user1.username):
+            self.post('fiction_outlines_api:outline_listcreate',
+                      data={'title': 'Tagged', 'tags': '["a", "b"]', 'series': None}, extra=self.extra)
+            self.response_201()
+            assert self.tag_names(Outline.objects.get(pk=self.last_response.data['id'])) == ['a', 'b']
+            self.patch('fiction_outlines_api:character_item', character=self.c1.pk,
+                       data={'tags': '["ptsd", "c"]'}, extra=self.extra)
+            self.response_200()
+            assert sorted(self.last_response.data['tags']) == ['c', 'ptsd']
+
+
+class TagLoadingTest(FictionOutlineAbstractTestCase):
+    '''
+    List responses load the tags of a whole page at once.
+    '''
+
+    def count_tag_queries(self, url_name, **params):
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as queries:
+                self.get(url_name, data=params, extra=self.extra)
+            self.response_200()
+        return len([query for query in queries if 'taggit_tag' in query['sql']])
+
+    def test_series_list(self):
+        assert self.count_tag_queries('fiction_outlines_api:series_listcreate') == 1
+        for x in range(5):
+            Series.objects.create(title='Tagged series %d' % x, user=self.user1).tags.add('tag %d' % x, 'shared')
+        assert self.count_tag_queries('fiction_outlines_api:series_listcreate') == 1
+        assert all('shared' in series['tags'] for series in self.last_response.data
+                   if series['title'].startswith('Tagged'))
+        assert self.count_tag_queries('fiction_outlines_api:series_listcreate', page_size=2) == 1
+
+    def test_omitted_tags(self):
+        assert self.count_tag_queries('fiction_outlines_api:series_listcreate', omit='tags') == 0
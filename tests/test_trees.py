@@ -0,0 +1,410 @@
+import logging
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from fiction_outlines.models import Outline, Arc, StoryElementNode, ArcElementNode
+from fiction_outlines_api.serializers import OutlineSerializer, StoryElementNodeSerializer, ArcSerializer
+from fiction_outlines_api.trees import StoryTree, ArcTree, DescendantAggregator, annotate_nodes, local_impact_rating
+from .test_views import FictionOutlineAbstractTestCase
+
+logger = logging.getLogger('test_trees')
+logger.setLevel(logging.DEBUG)
+
+
+class TreeAbstractTestCase(FictionOutlineAbstractTestCase):
+    '''
+    Builds a story tree with linked arc elements, characters and locations.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.part1 = self.o1.story_tree_root.add_child(story_element_type='part', name='Part 1')
+        self.chap1 = self.part1.add_child(story_element_type='chapter', name='Chapter 1')
+        self.part1.refresh_from_db()
+        self.chap2 = self.part1.add_child(story_element_type='chapter', name='Chapter 2')
+        self.scenes = []
+        for chapter in (self.chap1, self.chap2):
+            for x in range(2):
+                chapter.refresh_from_db()
+                self.scenes.append(chapter.add_child(story_element_type='ss', name='Scene %d' % x))
+        self.scenes[0].assoc_characters.add(self.c1int)
+        self.scenes[1].assoc_characters.add(self.c2int)
+        self.scenes[1].assoc_locations.add(self.l1int)
+        self.scenes[3].assoc_locations.add(self.l2int)
+        self.chap2.assoc_characters.add(self.c1int)
+        milestones = list(self.arc1.arc_root_node.get_children())
+        milestones[0].story_element_node = self.scenes[0]
+        milestones[0].save()
+        milestones[1].story_element_node = self.scenes[0]
+        milestones[1].save()
+        milestones[1].add_child(arc_element_type='beat', description='A beat', story_element_node=self.scenes[2])
+        milestones[2].story_element_node = self.chap2
+        milestones[2].save()
+
+    def add_scenes(self, chapter, count):
+        '''
+        Grows the tree without changing the kind of data in it.
+        '''
+        for x in range(count):
+            chapter.refresh_from_db()
+            scene = chapter.add_child(story_element_type='ss', name='Extra scene %d' % x)
+            scene.assoc_characters.add(self.c2int)
+
+
+class StoryTreeTest(TreeAbstractTestCase):
+    '''
+    Tests for the bulk story tree builder.
+    '''
+
+    def test_annotated_list(self):
+        '''
+        The annotated list must match the one from treebeard.
+        '''
+        tree = StoryTree(self.o1)
+        expected = StoryElementNode.get_annotated_list(self.o1.story_tree_root)
+        assert [(node.pk, info) for node, info in expected] == [(node.pk, info) for node, info in
+                                                                tree.annotated_list()]
+
+    def test_aggregates_match_model(self):
+        '''
+        Precomputed aggregates must match what the nodes compute for themselves.
+        '''
+        tree = StoryTree(self.o1)
+        for node in tree.nodes[1:]:
+            fresh = StoryElementNode.objects.get(pk=node.pk)
+            aggregates = tree.aggregates[node.pk]
+            assert set(c.pk for c in fresh.all_characters) == set(c.pk for c in aggregates['all_characters'])
+            assert set(loc.pk for loc in fresh.all_locations) == set(loc.pk for loc in aggregates['all_locations'])
+            assert fresh.impact_rating == aggregates['impact_rating']
+
+    def test_fixed_query_count(self):
+        '''
+        Serializing an outline costs the same number of queries no matter the size of the tree.
+        '''
+        with CaptureQueriesContext(connection) as small_tree:
+            OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        self.add_scenes(self.chap1, 10)
+        with CaptureQueriesContext(connection) as large_tree:
+            data = OutlineSerializer(Outline.objects.get(pk=self.o1.pk)).data
+        assert len(data['outline_structure']) == 17
+        assert len(small_tree) == len(large_tree)
+
+    def test_subtree_aggregates(self):
+        '''
+        Loading the subtree of a node only covers that node and its descendants.
+        '''
+        tree = StoryTree(node=self.chap1)
+        assert [node.pk for node in tree.nodes] == [self.chap1.pk, self.scenes[0].pk, self.scenes[1].pk]
+        assert [node.pk for node in tree.ancestors] == [self.o1.story_tree_root.pk, self.part1.pk]
+        assert set(tree.aggregates.keys()) == set(node.pk for node in tree.nodes)
+        for node in tree.nodes:
+            fresh = StoryElementNode.objects.get(pk=node.pk)
+            aggregates = tree.aggregates[node.pk]
+            assert set(c.pk for c in fresh.all_characters) == set(c.pk for c in aggregates['all_characters'])
+            assert set(loc.pk for loc in fresh.all_locations) == set(loc.pk for loc in aggregates['all_locations'])
+            assert fresh.impact_rating == aggregates['impact_rating']
+
+    def test_node_serializer_uses_subtree(self):
+        '''
+        A single node serialized on its own gets the same values as it does inside the whole tree.
+        '''
+        chap1 = StoryElementNode.objects.get(pk=self.chap1.pk)
+        with CaptureQueriesContext(connection) as small_tree:
+            data = StoryElementNodeSerializer(chap1).data
+        tree = StoryTree(self.o1)
+        expected_characters = [str(c.pk) for c in tree.aggregates[chap1.pk]['all_characters']]
+        assert expected_characters == [c['id'] for c in data['all_characters']]
+        assert tree.aggregates[chap1.pk]['impact_rating'] == data['impact_rating']
+        self.add_scenes(self.chap1, 10)
+        with CaptureQueriesContext(connection) as large_tree:
+            StoryElementNodeSerializer(chap1).data
+        assert len(small_tree) == len(large_tree)
+
+
+class OutlineListTreeTest(TreeAbstractTestCase):
+    '''
+    Tests for building the structures of a whole page of outlines at once.
+    '''
+
+    def list_outlines(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            self.get('fiction_outlines_api:outline_listcreate', data=params, extra=self.extra)
+        self.response_200()
+        return queries
+
+    def test_for_outlines(self):
+        trees = StoryTree.for_outlines(Outline.objects.filter(user=self.user1))
+        assert set(trees.keys()) == set(Outline.objects.filter(user=self.user1).values_list('pk', flat=True))
+        for outline_pk, tree in trees.items():
+            single = StoryTree(Outline.objects.get(pk=outline_pk))
+            assert [node.pk for node in tree.nodes] == [node.pk for node in single.nodes]
+            assert tree.aggregates == single.aggregates
+        assert StoryTree.for_outlines([]) == {}
+
+    def test_list_matches_detail(self):
+        with self.login(username=self.user1.username):
+            self.list_outlines()
+            for outline_data in self.last_response.data:
+                assert outline_data == OutlineSerializer(Outline.objects.get(pk=outline_data['id'])).data
+
+    def test_fixed_query_count(self):
+        '''
+        Listing outlines costs the same number of queries no matter how many there are.
+        '''
+        with self.login(username=self.user1.username):
+            few_outlines = self.list_outlines()
+            for x in range(5):
+                outline = Outline.objects.create(title='Extra %d' % x, user=self.user1)
+                outline.story_tree_root.add_child(story_element_type='part', name='Part')
+            self.add_scenes(self.chap1, 5)
+            many_outlines = self.list_outlines()
+            assert len(self.last_response.data) == Outline.objects.filter(user=self.user1).count()
+            assert len(few_outlines) == len(many_outlines)
+
+    def test_omit_structure(self):
+        with self.login(username=self.user1.username):
+            with_structure = self.list_outlines()
+            without_structure = self.list_outlines(structure='false')
+            for outline_data in self.last_response.data:
+                assert 'outline_structure' not in outline_data
+                assert 'length_estimate' in outline_data
+            assert len(without_structure) < len(with_structure)
+
+
+class TreeFormatTest(TreeAbstractTestCase):
+    '''
+    Tests for choosing between annotated and nested tree representations.
+    '''
+
+    def flatten(self, nested, level=0):
+        '''
+        Turns nested nodes back into the (data, level) pairs of an annotated list.
+        '''
+        flat = []
+        for node_data in nested:
+            children = node_data.pop('children')
+            flat.append((node_data, level))
+            flat.extend(self.flatten(children, level + 1))
+        return flat
+
+    def assert_same_tree(self, annotated, nested):
+        if not annotated:
+            assert nested == []
+            return
+        top_level = annotated[0][1]['level']
+        assert [(dict(node_data), info['level']) for node_data, info in annotated] == [
+            (dict(node_data), level) for node_data, level in self.flatten(nested, top_level)]
+
+    def test_outline_nested(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_item', outline=self.o1.pk, extra=self.extra)
+            annotated = self.last_response.data['outline_structure']
+            self.get('fiction_outlines_api:outline_item', outline=self.o1.pk, data={'tree': 'nested'},
+                     extra=self.extra)
+            self.response_200()
+            nested = self.last_response.data['outline_structure']
+            assert [node_data['id'] for node_data in nested] == [str(self.part1.pk)]
+            assert len(nested[0]['children']) == 2
+            self.assert_same_tree(annotated, nested)
+
+    def test_media_type(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_listcreate', extra=self.extra)
+            annotated = dict((outline['id'], outline['outline_structure']) for outline in self.last_response.data)
+            self.get('fiction_outlines_api:outline_listcreate',
+                     extra={'HTTP_ACCEPT': 'application/json; tree=nested'})
+            self.response_200()
+            for outline in self.last_response.data:
+                self.assert_same_tree(annotated[outline['id']], outline['outline_structure'])
+
+    def test_arc_nested(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:arc_item', outline=self.o1.pk, arc=self.arc1.pk, extra=self.extra)
+            annotated = self.last_response.data['arc_structure']
+            self.get('fiction_outlines_api:arc_item', outline=self.o1.pk, arc=self.arc1.pk,
+                     data={'tree': 'nested'}, extra=self.extra)
+            self.response_200()
+            self.assert_same_tree(annotated, self.last_response.data['arc_structure'])
+
+    def test_unknown_format(self):
+        with self.login(username=self.user1.username):
+            self.get('fiction_outlines_api:outline_item', outline=self.o1.pk, data={'tree': 'flat'},
+                     extra=self.extra)
+            self.response_400()
+
+
+class DescendantAggregatorTest(TreeAbstractTestCase):
+    '''
+    Tests for the bottom-up aggregation engine.
+    '''
+
+    def test_aggregate(self):
+        tree = StoryTree(self.o1)
+        aggregator = DescendantAggregator(names=lambda node: [node] if node.name else [])
+        aggregates = aggregator.aggregate(tree.nodes)
+        for node in tree.nodes:
+            expected = sorted(n.pk for n in tree.nodes if n.path.startswith(node.path) and n.name)
+            assert [n.pk for n in aggregates[node.pk]['names']] == expected
+
+
+class ImpactRatingTest(TreeAbstractTestCase):
+    '''
+    Tests for the in-memory impact rating helpers.
+    '''
+
+    def test_local_impact_rating(self):
+        assert local_impact_rating([]) == (0.5, 0, 0)
+        assert local_impact_rating([('mile_hook', 'root'), ('mile_hook', 'root')]) == (0.5, 0.5, 4)
+        assert local_impact_rating([('tf', 'mile_pt1'), ('beat', 'tf')]) == (0.5, 1.5, 0)
+
+    def test_fallback_without_aggregates(self):
+        '''
+        Without a tree builder, nodes serialized as a list compute their own values.
+        '''
+        nodes = list(StoryElementNode.objects.filter(outline=self.o1).order_by('path'))
+        tree = StoryTree(self.o1)
+        data = StoryElementNodeSerializer(nodes, many=True).data
+        for node, node_data in zip(nodes, data):
+            assert tree.aggregates[node.pk]['impact_rating'] == node_data['impact_rating']
+        assert annotate_nodes([]) == []
+        assert StoryTree(node=StoryElementNode(path='ZZZZZ', depth=1)).aggregates == {}
+
+
+class ArcTreeTest(TreeAbstractTestCase):
+    '''
+    Tests for the bulk arc tree builder.
+    '''
+
+    def add_elements(self, count):
+        milestone = self.arc1.arc_root_node.get_children()[1]
+        for x in range(count):
+            milestone.refresh_from_db()
+            milestone.add_child(arc_element_type='tf', description='Try/fail %d' % x)
+
+    def test_annotated_list(self):
+        tree = ArcTree(self.arc1)
+        expected = ArcElementNode.get_annotated_list(self.arc1.arc_root_node)
+        assert [(node.pk, info) for node, info in expected] == [(node.pk, info) for node, info in
+                                                                tree.annotated_list()]
+
+    def assert_same_errors(self, arc):
+        expected = arc.current_errors
+        tree_errors = ArcTree(arc).current_errors()
+        assert [list(error.keys()) for error in expected] == [list(error.keys()) for error in tree_errors]
+        for expected_error, error in zip(expected, tree_errors):
+            for key, value in expected_error.items():
+                if isinstance(value, ArcElementNode):
+                    assert value.pk == error[key].pk
+                else:
+                    assert value == error[key]
+        return tree_errors
+
+    def test_current_errors_match_model(self):
+        '''
+        The in-memory validation must report the same errors as the model.
+        '''
+        assert self.assert_same_errors(Arc.objects.get(pk=self.arc2.pk)) == []
+        assert len(self.assert_same_errors(Arc.objects.get(pk=self.arc1.pk))) == 1
+        hook = self.arc2.arc_root_node.get_children()[0]
+        reso = self.arc2.arc_root_node.get_children()[6]
+        hook.move(reso, 'right')
+        ArcElementNode.objects.get(pk=reso.pk).add_child(arc_element_type='tf', description='Try')
+        errors = self.assert_same_errors(Arc.objects.get(pk=self.arc2.pk))
+        assert [list(error.keys()) for error in errors] == [['hook_error'], ['reso_error'], ['generation_error'],
+                                                            ['mseq_error']]
+
+    def test_milestone_generation_error(self):
+        milestones = list(self.arc2.arc_root_node.get_children())
+        ArcElementNode.objects.filter(pk=milestones[2].pk).update(path=milestones[1].path + '00001', depth=3)
+        arc = Arc.objects.get(pk=self.arc2.pk)
+        assert ArcTree(arc).validate_generations() == arc.current_errors[-1]['generation_error']
+        assert ArcTree(Arc(name='Empty')).current_errors() == []
+
+    def test_fixed_query_count(self):
+        '''
+        Serializing an arc costs the same number of queries no matter the size of the tree.
+        '''
+        with CaptureQueriesContext(connection) as small_tree:
+            ArcSerializer(Arc.objects.get(pk=self.arc1.pk)).data
+        self.add_elements(10)
+        with CaptureQueriesContext(connection) as large_tree:
+            data = ArcSerializer(Arc.objects.get(pk=self.arc1.pk)).data
+        assert len(data['arc_structure']) == 18
+        assert len(small_tree) == len(large_tree)
+
+    def test_arc_detail_view_query_count(self):
+        with self.login(username=self.user1.username):
+            with CaptureQueriesContext(connection) as small_tree:
+                self.get('fiction_outlines_api:arc_item', outline=self.o1.pk, arc=self.arc1.pk, extra=self.extra)
+            self.response_200()
+            self.add_elements(10)
+            with CaptureQueriesContext(connection) as large_tree:
+                self.get('fiction_outlines_api:arc_item', outline=self.o1.pk, arc=self.arc1.pk, extra=self.extra)
+            self.response_200()
+            assert len(small_tree) == len(large_tree)
+
+
+class SubtreeViewTest(TreeAbstractTestCase):
+    '''
+    Tests for the story node subtree endpoint.
+    '''
+
+    def get_subtree(self, node, outline=None, **params):
+        with CaptureQueriesContext(connection) as queries:
+            self.get('fiction_outlines_api:storynode_tree', outline=(outline or self.o1).pk, storynode=node.pk,
+                     data=params, extra=self.extra)
+        return queries
+
+    def test_subtree(self):
+        with self.login(username=self.user1.username):
+            self.get_subtree(self.chap1)
+            self.response_200()
+            data = self.last_response.data
+            assert [(node_data['id'], info['level']) for node_data, info in data] == [
+                (str(self.chap1.pk), 0), (str(self.scenes[0].pk), 1), (str(self.scenes[1].pk), 1)]
+            outline_data = dict((node_data['id'], node_data) for node_data, info in
+                                OutlineSerializer(self.o1).data['outline_structure'])
+            for node_data, info in data:
+                expected = dict(outline_data[node_data['id']], depth=node_data['depth'],
+                                numchild=node_data['numchild'])
+                assert node_data == expected
+
+    def test_max_depth(self):
+        with self.login(username=self.user1.username):
+            self.get_subtree(self.part1, max_depth=1, tree='nested')
+            self.response_200()
+            part = self.last_response.data[0]
+            assert [child['id'] for child in part['children']] == [str(self.chap1.pk), str(self.chap2.pk)]
+            for chapter in part['children']:
+                assert chapter['children'] == []
+                assert chapter['numchild'] == 2
+            self.get_subtree(self.chap1, max_depth=0)
+            assert len(self.last_response.data) == 1
+
+    def test_cost_scales_with_subtree(self):
+        with self.login(username=self.user1.username):
+            small_outline = self.get_subtree(self.chap1)
+            self.add_scenes(self.chap2, 10)
+            large_outline = self.get_subtree(self.chap1)
+            self.response_200()
+            assert len(small_outline) == len(large_outline)
+            story_node_queries = [query for query in large_outline.captured_queries if
+                                  'FROM "fiction_outlines_storyelementnode"' in query['sql']]
+            assert len(story_node_queries) == 2
+
+    def test_fields(self):
+        with self.login(username=self.user1.username):
+            self.get_subtree(self.chap1, fields='id,name,numchild')
+            self.response_200()
+            for node_data, info in self.last_response.data:
+                assert list(node_data.keys()) == ['id', 'name', 'numchild']
+
+    def test_errors(self):
+        with self.login(username=self.user1.username):
+            self.get_subtree(self.chap1, outline=self.o2)
+            self.response_404()
+            for max_depth in ('x', '-1'):
+                self.get_subtree(self.chap1, max_depth=max_depth)
+                self.response_400()
+        with self.login(username=self.user2.username):
+            self.get_subtree(self.chap1)
+            self.response_403()